@@ -9,9 +9,13 @@ st.set_page_config(
 )
 
 from utils.auth import check_authentication, show_logout_button
+from utils.prompts import get_prompt_registry
 
 # 認証チェック
 check_authentication()
 
 # サイドバーにログアウトボタンを表示
-show_logout_button()
\ No newline at end of file
+show_logout_button()
+
+# プロンプトのテンプレートを読み込んで検証する（誤りがあれば起動時に表示される）
+get_prompt_registry()
\ No newline at end of file
@@ -0,0 +1,191 @@
+"""JSONL のジョブファイルを Streamlit を使わずに一括処理します。
+
+使い方:
+    python batch.py jobs.jsonl -o results.jsonl --markdown-dir out --workers 4 --metrics metrics.prom
+
+ジョブファイルは 1 行に 1 件の JSON で、type に応じて以下のキーを指定します。
+    {"id": "video-1", "type": "summary", "url": "https://www.youtube.com/watch?v=XXXXXX"}
+    {"id": "page-1", "type": "url", "url": "https://example.com/article"}
+    {"id": "ir-1", "type": "financial", "url": "https://example.com/ir.pdf", "pages": "1-10", "tables": true}
+    {"id": "map-1", "type": "mindmap", "file": "transcript.txt", "consolidate": false}
+
+結果は出力ファイルに 1 件ずつ追記します。同じ出力ファイルを指定して再実行すると、
+成功済みの id を読み飛ばして中断したところから再開します（失敗したものは再実行します）。
+各結果には段階ごとの所要時間とトークン数（metrics）を含め、--metrics を指定すると
+全体の計測値を Prometheus 形式（拡張子が .json の場合は JSON）で書き出します。
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from utils.cache import make_key
+from utils.config import get_setting
+from utils.metrics import run_context, write_metrics
+from utils.pipelines import analyze_pdf, generate_mindmap, summarize_video, summarize_web_page
+from utils.prompts import get_prompt_registry
+
+# 同時に処理するジョブ数の既定値（st.secrets・環境変数で上書き可能）
+DEFAULT_MAX_WORKERS = 4
+
+# プロンプトなどはリポジトリのルートからの相対パスで参照する
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def run_summary(spec: dict) -> dict:
+    result = summarize_video(spec["url"])
+    return {"title": result["title"], "summary": result["summary"], "transcript": result["transcript_text"]}
+
+
+def run_url(spec: dict) -> dict:
+    return {"summary": summarize_web_page(spec["url"])}
+
+
+def run_financial(spec: dict) -> dict:
+    return {"summary": analyze_pdf(spec["url"], spec.get("pages", ""), spec.get("tables", True))}
+
+
+def run_mindmap(spec: dict) -> dict:
+    if "text" in spec:
+        text = spec["text"]
+    else:
+        with open(spec["file"], "r", encoding="utf-8") as f:
+            text = f.read()
+    return {"mindmap": generate_mindmap(text, consolidate=spec.get("consolidate"))}
+
+
+RUNNERS = {
+    "summary": run_summary,
+    "url": run_url,
+    "financial": run_financial,
+    "mindmap": run_mindmap,
+}
+
+
+def load_jobs(path: str) -> list:
+    """ジョブファイルを読み込みます。id の無いジョブには内容から決まる id を付けます。"""
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                spec = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise SystemExit(f"{path}:{line_number}: JSON の形式が正しくありません: {e}")
+            if spec.get("type") not in RUNNERS:
+                raise SystemExit(f"{path}:{line_number}: type は {', '.join(RUNNERS)} のいずれかを指定してください。")
+            spec.setdefault("id", make_key(json.dumps(spec, sort_keys=True, ensure_ascii=False))[:16])
+            jobs.append(spec)
+    return jobs
+
+
+def load_checkpoint(path: str) -> set:
+    """出力ファイルから成功済みのジョブの id を読み込みます。"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断時に書きかけになった行は無視する
+                continue
+            if record.get("status") == "ok":
+                done.add(record["id"])
+    return done
+
+
+def run_job(spec: dict) -> dict:
+    started = time.monotonic()
+    record = {"id": spec["id"], "type": spec["type"]}
+    with run_context(f"batch:{spec['type']}") as run:
+        try:
+            record["result"] = RUNNERS[spec["type"]](spec)
+            record["status"] = "ok"
+        except Exception as e:
+            record["status"] = "error"
+            record["error"] = f"{type(e).__name__}: {e}"
+    record["elapsed"] = round(time.monotonic() - started, 3)
+    summary = run.summary()
+    record["metrics"] = {
+        "stages": {stage["stage"]: round(stage["seconds"], 3) for stage in summary["stages"]},
+        "tokens": summary["tokens"],
+    }
+    return record
+
+
+def write_markdown(markdown_dir: str, record: dict):
+    """結果の要約・マインドマップを <id>.md として保存します。"""
+    result = record["result"]
+    content = result.get("summary") or result.get("mindmap") or ""
+    file_name = re.sub(r"[^\w.-]+", "_", record["id"]) + ".md"
+    with open(os.path.join(markdown_dir, file_name), "w", encoding="utf-8") as f:
+        f.write(content)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="JSONL のジョブファイルを一括処理します。")
+    parser.add_argument("jobs", help="ジョブファイル（JSONL）")
+    parser.add_argument("-o", "--output", default="results.jsonl", help="結果の出力先（JSONL、再開時のチェックポイントを兼ねる）")
+    parser.add_argument("--markdown-dir", help="要約・マインドマップを Markdown で保存するディレクトリ")
+    parser.add_argument("-w", "--workers", type=int, help="同時に処理するジョブ数（既定: batch_max_workers）")
+    parser.add_argument("--metrics", help="計測値の出力先（既定: metrics_export_path）")
+    args = parser.parse_args(argv)
+
+    jobs_path = os.path.abspath(args.jobs)
+    output_path = os.path.abspath(args.output)
+    markdown_dir = os.path.abspath(args.markdown_dir) if args.markdown_dir else None
+    metrics_path = os.path.abspath(args.metrics) if args.metrics else None
+    os.chdir(ROOT_DIR)
+
+    # プロンプトのテンプレートの誤りは処理を始める前に検出する
+    get_prompt_registry()
+
+    jobs = load_jobs(jobs_path)
+    for spec in jobs:
+        if "file" in spec:
+            spec["file"] = os.path.join(os.path.dirname(jobs_path), spec["file"])
+    done = load_checkpoint(output_path)
+    pending = [spec for spec in jobs if spec["id"] not in done]
+    print(f"{len(jobs)} 件中 {len(jobs) - len(pending)} 件は処理済みです。{len(pending)} 件を処理します。", file=sys.stderr)
+    if not pending:
+        return 0
+    if markdown_dir:
+        os.makedirs(markdown_dir, exist_ok=True)
+
+    workers = args.workers or get_setting("batch_max_workers", DEFAULT_MAX_WORKERS)
+    failed = 0
+    executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="batch")
+    try:
+        futures = [executor.submit(run_job, spec) for spec in pending]
+        with open(output_path, "a", encoding="utf-8") as output:
+            for count, future in enumerate(as_completed(futures), start=1):
+                record = future.result()
+                # 1 件ずつ書き出し、中断されてもそこまでの結果が残るようにする
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                output.flush()
+                if record["status"] == "ok":
+                    if markdown_dir:
+                        write_markdown(markdown_dir, record)
+                    status = "完了"
+                else:
+                    failed += 1
+                    status = f"失敗（{record['error']}）"
+                print(f"[{count}/{len(pending)}] {record['id']}: {status} {record['elapsed']:.1f}秒", file=sys.stderr)
+    except KeyboardInterrupt:
+        print("中断しました。同じ出力ファイルを指定して再実行すると続きから処理します。", file=sys.stderr)
+        executor.shutdown(wait=False, cancel_futures=True)
+        return 130
+    finally:
+        write_metrics(metrics_path)
+    executor.shutdown()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
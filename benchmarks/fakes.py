@@ -0,0 +1,419 @@
+"""ベンチマーク用の、ネットワークに接続しないローカルの代替サービスです。
+
+- FakeOpenAIServer: OpenAI 互換の chat.completions（ストリーミング・429 の再現に対応）
+- FixtureServer: 記事の HTML と決算公告の PDF を返す HTTP サーバー（ETag に対応）
+- SMTPSink: 受け取ったメールを数えるだけの SMTP サーバー
+- FakeTranscripts: YouTube の文字起こしの取得を置き換える関数
+- FakeSpeech: 音声合成（gTTS）を置き換える関数
+"""
+import hashlib
+import json
+import socketserver
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 応答のテキストに使う語（トークン数の概算に合わせて 1 語を約 1 トークンとして扱う）
+WORDS = ["売上", "利益", "成長", "市場", "戦略", "顧客", "製品", "技術", "課題", "改善", "計画", "投資"]
+
+
+class Stats:
+    """スレッドセーフなカウンターです。"""
+
+    def __init__(self):
+        self.counts = Counter()
+        self.lock = threading.Lock()
+
+    def add(self, **counts):
+        with self.lock:
+            self.counts.update(counts)
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return dict(self.counts)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+
+
+class _BaseServer:
+    """バックグラウンドのスレッドで動かす、127.0.0.1 の空いているポートで待ち受けるサーバーです。"""
+
+    def __init__(self, handler):
+        self.stats = Stats()
+        self.server = _Server(("127.0.0.1", 0), handler)
+        self.server.owner = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _completion_text(messages: list, tokens: int) -> str:
+    """プロンプトから決まる、見出しと箇条書きの Markdown を作成します。
+
+    2 行目はタイトル、見出しと箇条書きはマインドマップとして解析できる形にします。
+    """
+    seed = int(hashlib.sha256(json.dumps(messages, ensure_ascii=False).encode("utf-8")).hexdigest(), 16)
+    lines = ["# 要約", f"ベンチマーク {seed % 10000:04d}"]
+    count = 2
+    topic = 0
+    while count < tokens:
+        lines.append(f"- {WORDS[(seed + topic) % len(WORDS)]}の動向")
+        for i in range(3):
+            word = WORDS[(seed // (topic + 1) + i) % len(WORDS)]
+            lines.append(f"  - {word}について{topic}-{i}")
+        topic += 1
+        count += 8
+    return "\n".join(lines)
+
+
+class _OpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        owner = self.server.owner
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "not found"}})
+            return
+
+        number = owner.next_request()
+        if owner.rate_limit_every and number % owner.rate_limit_every == 0:
+            owner.stats.add(requests=1, rate_limited=1)
+            self._send_json(
+                429,
+                {"error": {"message": "Rate limit reached", "type": "rate_limit_error"}},
+                {"Retry-After": f"{owner.retry_after:g}", "retry-after-ms": str(int(owner.retry_after * 1000))},
+            )
+            return
+
+        messages = request.get("messages", [])
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in messages) // 2
+        completion_tokens = min(owner.completion_tokens, request.get("max_tokens") or owner.completion_tokens)
+        if (request.get("response_format") or {}).get("type") == "json_object":
+            text = "{}"
+        else:
+            text = _completion_text(messages, completion_tokens)
+        owner.stats.add(requests=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+        time.sleep(owner.latency)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        base = {"id": f"chatcmpl-{number}", "created": int(time.time()), "model": request.get("model", "fake")}
+        if not request.get("stream"):
+            time.sleep(completion_tokens / owner.token_rate)
+            self._send_json(200, {
+                **base,
+                "object": "chat.completion",
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": text}}],
+                "usage": usage,
+            })
+            return
+
+        owner.stats.add(streams=1)
+        # ストリーミングは接続を閉じて終端を示す
+        self.close_connection = True
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        lines = text.split("\n")
+        delay = completion_tokens / owner.token_rate / max(1, len(lines))
+
+        def event(delta: dict, finish_reason=None, choices=True, usage=None):
+            chunk = {**base, "object": "chat.completion.chunk", "choices": []}
+            if choices:
+                chunk["choices"] = [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+            if usage is not None:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant", "content": ""})
+        for i, line in enumerate(lines):
+            time.sleep(delay)
+            event({"content": line + ("\n" if i < len(lines) - 1 else "")})
+        event({}, finish_reason="stop")
+        if (request.get("stream_options") or {}).get("include_usage"):
+            event({}, choices=False, usage=usage)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+class FakeOpenAIServer(_BaseServer):
+    """OpenAI 互換の /v1/chat/completions を返すサーバーです。
+
+    latency 秒待ってから、token_rate（トークン/秒）の速さで completion_tokens 分の
+    応答を返します。rate_limit_every を指定すると、その回数ごとに 429 を返します。
+    """
+
+    def __init__(self, latency: float = 0.2, token_rate: float = 500, completion_tokens: int = 150,
+                 rate_limit_every: int = 0, retry_after: float = 0.2):
+        super().__init__(_OpenAIHandler)
+        self.latency = latency
+        self.token_rate = token_rate
+        self.completion_tokens = completion_tokens
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        return f"{self.url}/v1"
+
+    def next_request(self) -> int:
+        with self._lock:
+            self._count += 1
+            return self._count
+
+
+def article_html(number: int, paragraphs: int = 40) -> str:
+    """本文と定型要素（ナビゲーション・フッター・広告）を含む記事の HTML を作成します。"""
+    body = "\n".join(
+        f"<p>第{number}号の記事の段落{i}です。" + "、".join(f"{WORDS[(number + i + j) % len(WORDS)]}に関する説明" for j in range(12)) + "。</p>"
+        for i in range(paragraphs)
+    )
+    links = "".join(f'<li><a href="/articles/{i}.html">関連記事 {i}</a></li>' for i in range(30))
+    return (
+        f"<!DOCTYPE html><html><head><meta charset=\"utf-8\"><title>記事 {number}</title>"
+        "<script>var tracking = true;</script><style>body { margin: 0; }</style></head><body>"
+        f"<header><nav><ul>{links}</ul></nav></header>"
+        f"<main><article class=\"entry-content\"><h1>記事 {number}</h1>{body}</article></main>"
+        f"<aside class=\"sidebar\"><div class=\"ads\">広告</div><ul>{links}</ul></aside>"
+        "<footer>Copyright</footer></body></html>"
+    )
+
+
+def _pdf_escape(text: str) -> str:
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def report_pdf(number: int, pages: int = 24, lines_per_page: int = 40) -> bytes:
+    """テキストだけの、複数ページの PDF を作成します（pdfplumber で抽出できる最小限の構造）。"""
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>", None, b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for page in range(pages):
+        rows = [f"Annual report {number} - page {page + 1}"] + [
+            f"Line {i}: revenue {(number * 31 + page * 7 + i) % 1000} million, margin {(page + i) % 40} percent"
+            for i in range(lines_per_page)
+        ] + ["Confidential"]
+        text = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({_pdf_escape(row)}) '" for row in rows) + " ET"
+        stream = text.encode("latin-1")
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(stream), stream))
+        content_id = len(objects)
+        objects.append(
+            b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+            b"/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>" % content_id
+        )
+        page_ids.append(len(objects))
+    kids = b" ".join(b"%d 0 R" % page_id for page_id in page_ids)
+    objects[1] = b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(page_ids))
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for i, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (i, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+class _FixtureHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        owner = self.server.owner
+        content = owner.content(self.path)
+        if content is None:
+            owner.stats.add(requests=1, not_found=1)
+            self.send_response(404)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        body, content_type = content
+        etag = '"%s"' % hashlib.sha256(body).hexdigest()[:16]
+        time.sleep(owner.latency)
+        if self.headers.get("If-None-Match") == etag:
+            owner.stats.add(requests=1, not_modified=1)
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        owner.stats.add(requests=1, bytes=len(body))
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FixtureServer(_BaseServer):
+    """/articles/<n>.html と /reports/<n>.pdf を返す HTTP サーバーです。内容は n から決まります。"""
+
+    def __init__(self, latency: float = 0.05, pdf_pages: int = 24):
+        super().__init__(_FixtureHandler)
+        self.latency = latency
+        self.pdf_pages = pdf_pages
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def content(self, path: str):
+        with self._lock:
+            if path not in self._cache:
+                name = path.rsplit("/", 1)[-1]
+                stem = name.split(".")[0]
+                if not stem.isdigit():
+                    return None
+                if path.startswith("/articles/") and name.endswith(".html"):
+                    self._cache[path] = (article_html(int(stem)).encode("utf-8"), "text/html; charset=utf-8")
+                elif path.startswith("/reports/") and name.endswith(".pdf"):
+                    self._cache[path] = (report_pdf(int(stem), self.pdf_pages), "application/pdf")
+                else:
+                    return None
+            return self._cache[path]
+
+
+class _SMTPHandler(socketserver.StreamRequestHandler):
+    """EHLO・AUTH・MAIL・RCPT・DATA に応答し、メールの内容は破棄します。"""
+
+    def reply(self, line: str):
+        self.wfile.write(f"{line}\r\n".encode("ascii"))
+
+    def handle(self):
+        stats = self.server.owner.stats
+        stats.add(connections=1)
+        self.reply("220 localhost ESMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                return
+            command = line.decode("utf-8", "replace").strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb == "EHLO":
+                self.wfile.write(b"250-localhost\r\n250-AUTH PLAIN\r\n250 8BITMIME\r\n")
+            elif verb == "HELO":
+                self.reply("250 localhost")
+            elif verb == "AUTH":
+                # 資格情報は確認しない（初期応答が無い場合は入力を求める）
+                stats.add(logins=1)
+                if len(command.split()) < 3:
+                    self.reply("334 ")
+                    self.rfile.readline()
+                self.reply("235 Authentication successful")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                size = 0
+                for data in iter(self.rfile.readline, b""):
+                    if data in (b".\r\n", b".\n"):
+                        break
+                    size += len(data)
+                stats.add(messages=1, bytes=size)
+                self.reply("250 OK")
+            elif verb == "QUIT":
+                self.reply("221 Bye")
+                return
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                self.reply("250 OK")
+            else:
+                self.reply("502 Command not implemented")
+
+
+class _SMTPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class SMTPSink:
+    """受け取ったメールの件数・接続数・ログイン数を数える SMTP サーバー（SSL・STARTTLS なし）です。"""
+
+    def __init__(self):
+        self.stats = Stats()
+        self.server = _SMTPServer(("127.0.0.1", 0), _SMTPHandler)
+        self.server.owner = self
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+class FakeTranscripts:
+    """utils.transcripts._fetch の代わりに、動画 ID から決まる文字起こしを返します。"""
+
+    def __init__(self, latency: float = 0.3, segments: int = 600):
+        self.latency = latency
+        self.segments = segments
+        self.stats = Stats()
+
+    def __call__(self, video_id: str, languages: tuple) -> list:
+        self.stats.add(requests=1)
+        time.sleep(self.latency)
+        return self.segments_for(video_id)
+
+    def segments_for(self, video_id: str) -> list:
+        seed = int(hashlib.sha256(video_id.encode("utf-8")).hexdigest(), 16)
+        return [
+            {
+                "text": f"{WORDS[(seed + i) % len(WORDS)]}について話します。{WORDS[(seed // 7 + i) % len(WORDS)]}の例を挙げると{i}番目のポイントです。",
+                "start": i * 4.0,
+                "duration": 4.0,
+            }
+            for i in range(self.segments)
+        ]
+
+
+class FakeSpeech:
+    """utils.tts._synthesize_chunk の代わりに、待ち時間の後でテキストの長さに比例した無音のデータを返します。"""
+
+    def __init__(self, latency: float = 0.5):
+        self.latency = latency
+        self.stats = Stats()
+
+    def __call__(self, text: str, lang: str) -> bytes:
+        self.stats.add(requests=1)
+        time.sleep(self.latency)
+        return b"\xff\xfb\x90\x00" + bytes(len(text.encode("utf-8")) * 8)
@@ -0,0 +1,400 @@
+"""複数のセッションから同時にアプリを操作し、同時接続数ごとの応答時間とメモリ使用量を測定します。
+
+使い方:
+    python benchmarks/load.py --concurrency 1 2 4 8 --iterations 3 --json load.json
+
+アプリ（serve.py）を一時ディレクトリの設定で起動し、ブラウザの代わりに WebSocket で
+Streamlit のサーバーに接続して、ログイン済みのセッションからチャット（chat）・
+動画の要約（summary）・複数動画の要約（multi_summary）のページを操作します。
+OpenAI はローカルの代替サーバー、文字起こしと音声合成は serve.py の代替関数を使います。
+
+同時接続数ごとに、操作（ボタン・チャットの送信）から再実行が終わるまでの時間の
+p50/p95/p99、エラー率、サーバープロセスの RSS を表示し、p95 が --slo 秒以内かつ
+エラー率が --max-error-rate 以内だった最大の同時接続数を、1 インスタンスの目安として表示します。
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+
+import websockets
+from streamlit.proto.Alert_pb2 import Alert
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.Common_pb2 import ChatInputValue
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from fakes import FakeOpenAIServer
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+# utils をリポジトリのルートから読み込む
+ROOT_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.insert(0, ROOT_DIR)
+
+PAGES = ("chat", "summary", "multi_summary")
+FULL_RUN_FINISHED = (ForwardMsg.FINISHED_SUCCESSFULLY, ForwardMsg.FINISHED_WITH_COMPILE_ERROR)
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _process_rss(pid: int) -> int:
+    """プロセスの常駐メモリ（バイト）を返します。"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return 0
+
+
+def percentile(values: list, p: float) -> float:
+    """最近傍順位法のパーセンタイルを返します。"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+
+class RerunResult:
+    def __init__(self, seconds: float, errors: list, elements: list):
+        self.seconds = seconds
+        self.errors = errors
+        self.elements = elements
+
+
+class Session:
+    """ブラウザの代わりに WebSocket で 1 つのセッションを操作します。
+
+    ウィジェットの値はブラウザと同じく再実行のたびにすべて送り直し、
+    ボタンなどのトリガーはその再実行でだけ送ります。
+    """
+
+    def __init__(self, url: str, cookie: str, timeout: float):
+        self.url = url
+        self.cookie = cookie
+        self.timeout = timeout
+        self.ws = None
+        self.widgets = {}  # ラベル（チャットは "chat_input"）-> ウィジェット ID
+        self.values = {}  # ウィジェット ID -> 送り直す WidgetState
+        self.auto_reruns = {}  # run_every を指定したフラグメントの ID -> 間隔（秒）
+        self.page_script_hash = ""  # 表示中のページの ID
+
+    async def connect(self):
+        self.ws = await websockets.connect(
+            self.url,
+            subprotocols=["streamlit"],
+            additional_headers={"Cookie": self.cookie},
+            max_size=None,
+        )
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+
+    async def _send(self, page: str, triggers: list = (), fragment_id: str = ""):
+        msg = BackMsg()
+        if fragment_id:
+            # ブラウザと同じく、フラグメントの再実行は表示中のページの ID で指定する
+            msg.rerun_script.page_script_hash = self.page_script_hash
+            msg.rerun_script.fragment_id = fragment_id
+        else:
+            msg.rerun_script.page_name = page
+        msg.rerun_script.widget_states.widgets.extend(self.values.values())
+        msg.rerun_script.widget_states.widgets.extend(triggers)
+        await self.ws.send(msg.SerializeToString())
+
+    async def _receive(self, timeout: float) -> ForwardMsg:
+        msg = ForwardMsg()
+        msg.ParseFromString(await asyncio.wait_for(self.ws.recv(), timeout))
+        return msg
+
+    def _collect(self, msg: ForwardMsg, elements: list, errors: list):
+        kind = msg.WhichOneof("type")
+        if kind == "new_session" and not msg.new_session.fragment_ids_this_run:
+            # ページ全体の再実行が始まると、ブラウザはフラグメントの自動再実行を止める
+            self.auto_reruns.clear()
+        elif kind == "navigation":
+            self.page_script_hash = msg.navigation.page_script_hash
+        elif kind == "auto_rerun":
+            self.auto_reruns[msg.auto_rerun.fragment_id] = msg.auto_rerun.interval
+        if kind != "delta" or msg.delta.WhichOneof("type") != "new_element":
+            return
+        element = msg.delta.new_element
+        kind = element.WhichOneof("type")
+        body = getattr(element, kind)
+        label = "chat_input" if kind == "chat_input" else getattr(body, "label", "")
+        if getattr(body, "id", "") and label:
+            self.widgets[label] = body.id
+        text = getattr(body, "body", "")
+        elements.append((kind, label or text))
+        if kind == "exception":
+            errors.append(f"{body.type}: {body.message}")
+        elif kind == "alert" and body.format == Alert.ERROR:
+            errors.append(body.body)
+
+    async def rerun(self, page: str, values: dict = None, triggers: dict = None) -> RerunResult:
+        """ウィジェットの値を変えてページを再実行し、再実行が終わるまでの時間を返します。"""
+        for label, value in (values or {}).items():
+            state = WidgetState(id=self.widgets[label], string_value=value)
+            self.values[state.id] = state
+        trigger_states = []
+        for label, value in (triggers or {}).items():
+            if label == "chat_input":
+                trigger_states.append(WidgetState(id=self.widgets[label], chat_input_value=ChatInputValue(data=value)))
+            else:
+                trigger_states.append(WidgetState(id=self.widgets[label], trigger_value=True))
+
+        started = time.perf_counter()
+        elements, errors = [], []
+        await self._send(page, trigger_states)
+        try:
+            while True:
+                response = await self._receive(self.timeout)
+                self._collect(response, elements, errors)
+                if response.WhichOneof("type") == "script_finished" and response.script_finished in FULL_RUN_FINISHED:
+                    break
+        except asyncio.TimeoutError:
+            errors.append(f"{self.timeout} 秒以内に再実行が終わりませんでした")
+        return RerunResult(time.perf_counter() - started, errors, elements)
+
+    async def wait_for(self, page: str, text: str) -> RerunResult:
+        """text を含む要素が表示されるまで待ち、待った時間を返します。
+
+        ブラウザと同じく、run_every を指定したフラグメント（ジョブの進捗など）を
+        指定の間隔で再実行します。
+        """
+        started = time.perf_counter()
+        deadline = started + self.timeout
+        next_poll = started
+        elements, errors = [], []
+        while time.perf_counter() < deadline:
+            if self.auto_reruns and time.perf_counter() >= next_poll:
+                for fragment_id in list(self.auto_reruns):
+                    await self._send(page, fragment_id=fragment_id)
+                next_poll = time.perf_counter() + min(self.auto_reruns.values())
+            try:
+                self._collect(await self._receive(max(0.01, next_poll - time.perf_counter())), elements, errors)
+            except asyncio.TimeoutError:
+                continue
+            if errors or any(text in label for _, label in elements):
+                return RerunResult(time.perf_counter() - started, errors, elements)
+        return RerunResult(self.timeout, [f"{self.timeout} 秒以内に「{text}」が表示されませんでした"], elements)
+
+
+async def chat_flow(session: Session, name: str, iterations: int, think_time: float, record):
+    record("load", await session.rerun("chat"))
+    for i in range(iterations):
+        await asyncio.sleep(think_time)
+        record("action", await session.rerun("chat", triggers={"chat_input": f"{name} の質問 {i}: 要点を教えてください。"}))
+
+
+async def summary_flow(session: Session, name: str, iterations: int, think_time: float, record):
+    record("load", await session.rerun("summary"))
+    for i in range(iterations):
+        await asyncio.sleep(think_time)
+        url = f"https://www.youtube.com/watch?v={name}-{i}"
+        record("action", await session.rerun("summary", values={"YouTube 動画の URL:": url}, triggers={"実行": True}))
+
+
+async def multi_summary_flow(session: Session, name: str, iterations: int, think_time: float, record, videos: int = 3):
+    record("load", await session.rerun("multi_summary"))
+    for i in range(iterations):
+        await asyncio.sleep(think_time)
+        urls = "\n".join(f"https://www.youtube.com/watch?v={name}-{i}-{j}" for j in range(videos))
+        result = await session.rerun("multi_summary", values={"動画 URL を入力してください:": urls}, triggers={"実行": True})
+        record("action", result)
+        if result.errors:
+            continue
+        # ジョブはバックグラウンドで実行され、終わるとページが再実行されて全体の要約が表示される
+        record("job", await session.wait_for("multi_summary", "全体の要約"))
+
+FLOWS = {"chat": chat_flow, "summary": summary_flow, "multi_summary": multi_summary_flow}
+
+
+async def run_level(args, concurrency: int, cookie: str, server_pid: int) -> dict:
+    """同時に concurrency 個のセッションを動かし、結果を集計します。"""
+    samples = {}  # (ページ, 種類) -> [秒]
+    errors = {}  # (ページ, 種類) -> [エラー]
+    peak = [_process_rss(server_pid)]
+    stop = threading.Event()
+
+    def sample_memory():
+        while not stop.wait(0.1):
+            peak[0] = max(peak[0], _process_rss(server_pid))
+
+    sampler = threading.Thread(target=sample_memory, daemon=True)
+    sampler.start()
+
+    async def user(index: int):
+        page = args.pages[index % len(args.pages)]
+        session = Session(args.ws_url, cookie, args.timeout)
+
+        def record(kind: str, result: RerunResult):
+            samples.setdefault((page, kind), []).append(result.seconds)
+            errors.setdefault((page, kind), []).extend(result.errors)
+
+        try:
+            await session.connect()
+            await FLOWS[page](session, f"c{concurrency}-s{index}", args.iterations, args.think_time, record)
+        except Exception as e:
+            errors.setdefault((page, "session"), []).append(f"{type(e).__name__}: {e}")
+        finally:
+            await session.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+
+    actions = [seconds for (page, kind), values in samples.items() if kind == "action" for seconds in values]
+    reruns = sum(len(values) for (page, kind), values in samples.items() if kind != "job")
+    error_count = sum(len(values) for values in errors.values())
+    return {
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "reruns": reruns,
+        "errors": error_count,
+        "error_rate": round(error_count / max(1, reruns), 4),
+        "p50": round(percentile(actions, 50), 3),
+        "p95": round(percentile(actions, 95), 3),
+        "p99": round(percentile(actions, 99), 3),
+        "peak_rss_mb": round(peak[0] / 2 ** 20, 1),
+        "rss_after_mb": round(_process_rss(server_pid) / 2 ** 20, 1),
+        "pages": {
+            f"{page}/{kind}": {
+                "count": len(values),
+                "p50": round(percentile(values, 50), 3),
+                "p95": round(percentile(values, 95), 3),
+                "errors": len(errors.get((page, kind), [])),
+            }
+            for (page, kind), values in sorted(samples.items())
+        },
+        "error_samples": sorted({error for values in errors.values() for error in values})[:5],
+    }
+
+
+def write_secrets(workspace: str, openai: FakeOpenAIServer, args):
+    """アプリの設定（ログイン・OpenAI の接続先・キャッシュの保存先）を作業ディレクトリに書き込みます。"""
+    settings = {
+        "auth_user": "loadtest",
+        "auth_pass": "loadtest",
+        "cookie_password": "loadtest-secret",
+        "openai_api_key": "loadtest",
+        "openai_base_url": openai.base_url,
+        "openai_model": "gpt-4o-mini",
+        "cache_dir": os.path.join(workspace, ".cache"),
+        "job_max_workers": args.job_workers,
+    }
+    os.makedirs(os.path.join(workspace, ".streamlit"), exist_ok=True)
+    with open(os.path.join(workspace, ".streamlit", "secrets.toml"), "w", encoding="utf-8") as f:
+        for key, value in settings.items():
+            f.write(f"{key} = {json.dumps(value)}\n")
+
+
+def start_server(workspace: str, port: int, args) -> subprocess.Popen:
+    command = [
+        sys.executable, os.path.join(BENCHMARKS_DIR, "serve.py"),
+        "--port", str(port),
+        "--transcript-latency", str(args.transcript_latency),
+        "--tts-latency", str(args.tts_latency),
+    ]
+    log = open(os.path.join(workspace, "server.log"), "w")
+    server = subprocess.Popen(command, cwd=workspace, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise SystemExit(f"アプリの起動に失敗しました（{os.path.join(workspace, 'server.log')} を参照）。")
+        try:
+            with urllib.request.urlopen(f"http://127.0.0.1:{port}/_stcore/health", timeout=1) as response:
+                if response.status == 200:
+                    return server
+        except OSError:
+            time.sleep(0.5)
+    server.terminate()
+    raise SystemExit("アプリが 60 秒以内に起動しませんでした。")
+
+
+def print_report(levels: list, slo: float, max_error_rate: float):
+    print(f"{'同時接続':>8}{'再実行':>8}{'エラー率':>9}{'p50':>8}{'p95':>8}{'p99':>8}{'RSS最大':>9}{'RSS後':>8}")
+    for level in levels:
+        print(
+            f"{level['concurrency']:>8}{level['reruns']:>8}{level['error_rate']:>9.1%}{level['p50']:>8.2f}"
+            f"{level['p95']:>8.2f}{level['p99']:>8.2f}{level['peak_rss_mb']:>9.1f}{level['rss_after_mb']:>8.1f}"
+        )
+        print("  " + "  ".join(f"{name} p95={page['p95']:.2f}s" for name, page in level["pages"].items()))
+        for error in level["error_samples"]:
+            print(f"  エラー: {error}")
+
+    passed = [level["concurrency"] for level in levels if level["p95"] <= slo and level["error_rate"] <= max_error_rate]
+    if passed:
+        print(f"p95 {slo} 秒以内・エラー率 {max_error_rate:.0%} 以内の最大の同時接続数: {max(passed)}")
+    else:
+        print(f"p95 {slo} 秒以内・エラー率 {max_error_rate:.0%} 以内を満たす同時接続数はありませんでした。")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="複数のセッションからアプリを同時に操作して負荷を測定します。")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8], help="測定する同時接続数")
+    parser.add_argument("--pages", nargs="+", choices=PAGES, default=list(PAGES), help="セッションに順に割り当てるページ")
+    parser.add_argument("--iterations", type=int, default=3, help="セッションごとの操作の回数")
+    parser.add_argument("--think-time", type=float, default=0.5, help="操作の間隔（秒）")
+    parser.add_argument("--timeout", type=float, default=120, help="1 回の再実行・ジョブを待つ上限（秒）")
+    parser.add_argument("--latency", type=float, default=0.2, help="OpenAI の応答までの待ち時間（秒）")
+    parser.add_argument("--token-rate", type=float, default=500, help="OpenAI の生成速度（トークン/秒）")
+    parser.add_argument("--completion-tokens", type=int, default=150, help="OpenAI の応答のトークン数")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="この回数ごとに OpenAI が 429 を返す（0 で無効）")
+    parser.add_argument("--transcript-latency", type=float, default=0.3, help="文字起こしの取得の待ち時間（秒）")
+    parser.add_argument("--tts-latency", type=float, default=0.5, help="音声合成の待ち時間（秒）")
+    parser.add_argument("--job-workers", type=int, default=4, help="アプリの job_max_workers")
+    parser.add_argument("--slo", type=float, default=5.0, help="目安とする操作の p95（秒）")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="目安とするエラー率の上限")
+    parser.add_argument("--json", help="結果を JSON で保存するファイル")
+    args = parser.parse_args(argv)
+
+    openai = FakeOpenAIServer(args.latency, args.token_rate, args.completion_tokens, args.rate_limit_every).start()
+    levels = []
+    with tempfile.TemporaryDirectory(prefix="load-") as workspace:
+        write_secrets(workspace, openai, args)
+        port = _free_port()
+        args.ws_url = f"ws://127.0.0.1:{port}/_stcore/stream"
+        server = start_server(workspace, port, args)
+        try:
+            # ログイン済みのクッキーを、アプリと同じ設定（作業ディレクトリの secrets.toml）で作成する
+            os.chdir(workspace)
+            from utils.auth import COOKIE_PREFIX, TOKEN_COOKIE, generate_token
+
+            cookie = f"{COOKIE_PREFIX}{TOKEN_COOKIE}={generate_token('loadtest')}"
+            for concurrency in args.concurrency:
+                levels.append(asyncio.run(run_level(args, concurrency, cookie, server.pid)))
+                print(f"同時接続 {concurrency}: 完了", file=sys.stderr)
+        finally:
+            os.chdir(ROOT_DIR)
+            server.terminate()
+            server.wait(timeout=30)
+    openai.stop()
+
+    print_report(levels, args.slo, args.max_error_rate)
+    print(f"OpenAI への呼び出し: {openai.stats.snapshot()}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {key: value for key, value in vars(args).items() if key != "ws_url"}, "levels": levels}, f, ensure_ascii=False, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,279 @@
+"""ネットワークに接続せずに、各ページの処理（パイプライン）の性能を測定します。
+
+使い方:
+    python benchmarks/run.py --items 3 --videos 5 --json bench.json
+    python benchmarks/run.py --baseline bench.json --tolerance 0.2
+
+OpenAI・YouTube の文字起こし・ウェブページ／PDF・SMTP をローカルの代替サービス（fakes.py）に
+置き換え、パイプラインごとに初回（キャッシュなし）と 2 回目（キャッシュあり）の経過時間・
+スループット・ピークメモリ・API の呼び出し回数を表示します。キャッシュは一時ディレクトリに
+作成するため、アプリのキャッシュには影響しません。--baseline を指定すると、経過時間が
+基準の結果より tolerance を超えて長くなったパイプラインがある場合に終了コード 1 を返します。
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from fakes import FakeOpenAIServer, FakeTranscripts, FixtureServer, SMTPSink
+
+# utils をリポジトリのルートから読み込む
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+SCENARIOS = ("summary", "multi_summary", "url", "financial", "mindmap")
+PASSES = ("cold", "warm")
+
+
+def _rss() -> int:
+    """現在のプロセスの常駐メモリ（バイト）を返します。"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class PeakMemory:
+    """with ブロックの間、常駐メモリを一定間隔で調べて最大値を記録します。"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _rss())
+
+    def __enter__(self):
+        self.start = self.peak = _rss()
+        self.thread = threading.Thread(target=self._sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self.thread.join()
+        self.peak = max(self.peak, _rss())
+
+
+def configure(workspace: str, openai: FakeOpenAIServer, smtp: SMTPSink):
+    """設定を環境変数で代替サービスに向けます（get_setting は st.secrets に無いキーを環境変数から読む）。"""
+    os.environ.update({
+        "OPENAI_API_KEY": "benchmark",
+        "OPENAI_BASE_URL": openai.base_url,
+        "OPENAI_MODEL": os.environ.get("OPENAI_MODEL", "gpt-4o-mini"),
+        "CACHE_DIR": os.path.join(workspace, ".cache"),
+        "SMTP_HOST": "127.0.0.1",
+        "SMTP_PORT": str(smtp.port),
+        "SMTP_SSL": "false",
+        "SMTP_STARTTLS": "false",
+    })
+
+    from utils.config import get_setting
+
+    # secrets.toml の値は環境変数より優先されるため、実際のサービスに接続しないことを確認する
+    for key in ("openai_base_url", "cache_dir", "smtp_host"):
+        if get_setting(key) != os.environ[key.upper()]:
+            raise SystemExit(f"secrets.toml の {key} がベンチマークの設定より優先されています。secrets.toml の無い場所で実行してください。")
+
+
+def run_summary(services: dict, items: int):
+    from utils.llm import stream_chat_completion
+    from utils.pipelines import fetch_video_transcript, video_summary_messages
+
+    # ページと同じく、要約はストリーミングで受け取る
+    for i in range(items):
+        transcript_text = fetch_video_transcript(f"https://www.youtube.com/watch?v=summary{i}")
+        for _ in stream_chat_completion(video_summary_messages(transcript_text), max_tokens=3000, temperature=0.5):
+            pass
+    return items
+
+
+def run_multi_summary(services: dict, items: int):
+    from utils.jobs import Job
+    from utils.pipelines import summarize_videos
+
+    urls = [f"https://www.youtube.com/watch?v=multi{i}" for i in range(items)]
+    results = summarize_videos(Job("benchmark"), urls, "bench@example.com", "bench@example.com", "benchmark")
+    errors = [item["error"] or item["email_error"] for item in results if item["error"] or item["email_error"]]
+    if errors:
+        raise RuntimeError(errors[0])
+    return items
+
+
+def run_url(services: dict, items: int):
+    from utils.pipelines import summarize_web_page
+
+    for i in range(items):
+        summarize_web_page(f"{services['fixtures'].url}/articles/{i}.html")
+    return items
+
+
+def run_financial(services: dict, items: int):
+    from utils.pipelines import analyze_pdf
+
+    for i in range(items):
+        analyze_pdf(f"{services['fixtures'].url}/reports/{i}.pdf", "", True)
+    return items
+
+
+def run_mindmap(services: dict, items: int):
+    from utils.pipelines import generate_mindmap
+    from utils.transcripts import transcript_to_text
+
+    for i in range(items):
+        generate_mindmap(transcript_to_text(services["transcripts"].segments_for(f"mindmap{i}")))
+    return items
+
+
+RUNNERS = {
+    "summary": run_summary,
+    "multi_summary": run_multi_summary,
+    "url": run_url,
+    "financial": run_financial,
+    "mindmap": run_mindmap,
+}
+
+
+def _delta(after: dict, before: dict) -> dict:
+    return {key: value - before.get(key, 0) for key, value in after.items() if value - before.get(key, 0)}
+
+
+def run_scenario(name: str, services: dict, items: int) -> dict:
+    """1 回分の測定を行い、結果を dict で返します。"""
+    from utils.metrics import run_context
+
+    before = {key: service.stats.snapshot() for key, service in services.items()}
+    error = None
+    with PeakMemory() as memory, run_context(f"bench:{name}") as run:
+        started = time.perf_counter()
+        try:
+            count = RUNNERS[name](services, items)
+        except Exception as e:
+            count = 0
+            error = f"{type(e).__name__}: {e}"
+        elapsed = time.perf_counter() - started
+    summary = run.summary()
+    return {
+        "seconds": round(elapsed, 3),
+        "throughput": round(count / elapsed, 3) if elapsed else 0,
+        "peak_rss_mb": round(memory.peak / 2 ** 20, 1),
+        "rss_growth_mb": round((memory.peak - memory.start) / 2 ** 20, 1),
+        "calls": {key: _delta(service.stats.snapshot(), before[key]) for key, service in services.items()},
+        "stages": {stage["stage"]: round(stage["seconds"], 3) for stage in summary["stages"]},
+        "error": error,
+    }
+
+
+def print_report(results: dict):
+    print(f"{'pipeline':<14}{'pass':<6}{'秒':>8}{'件/秒':>8}{'RSS(MB)':>9}{'増加':>7}  API 呼び出し")
+    for name, passes in results.items():
+        for pass_name, result in passes.items():
+            calls = result["calls"]
+            api = (
+                f"openai={calls['openai'].get('requests', 0)}(429={calls['openai'].get('rate_limited', 0)}) "
+                f"http={calls['fixtures'].get('requests', 0)}(304={calls['fixtures'].get('not_modified', 0)}) "
+                f"transcript={calls['transcripts'].get('requests', 0)} "
+                f"smtp={calls['smtp'].get('messages', 0)}/{calls['smtp'].get('connections', 0)}接続"
+            )
+            print(
+                f"{name:<14}{pass_name:<6}{result['seconds']:>8.2f}{result['throughput']:>8.2f}"
+                f"{result['peak_rss_mb']:>9.1f}{result['rss_growth_mb']:>7.1f}  {api}"
+            )
+            if result["error"]:
+                print(f"  エラー: {result['error']}")
+            top = sorted(result["stages"].items(), key=lambda item: -item[1])[:4]
+            if top:
+                print("  " + "  ".join(f"{stage}={seconds:.2f}s" for stage, seconds in top))
+
+
+def compare(results: dict, baseline_path: str, tolerance: float) -> list:
+    """基準の結果と比べて、経過時間が tolerance を超えて長くなったものを返します。"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["results"]
+    regressions = []
+    for name, passes in results.items():
+        for pass_name, result in passes.items():
+            base = baseline.get(name, {}).get(pass_name)
+            if base and not result["error"] and result["seconds"] > base["seconds"] * (1 + tolerance):
+                regressions.append(f"{name}/{pass_name}: {base['seconds']:.2f}秒 → {result['seconds']:.2f}秒")
+    return regressions
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="ローカルの代替サービスを使って各パイプラインの性能を測定します。")
+    parser.add_argument("--only", nargs="+", choices=SCENARIOS, help="測定するパイプライン（既定: すべて）")
+    parser.add_argument("--items", type=int, default=3, help="パイプラインごとに処理する件数")
+    parser.add_argument("--videos", type=int, default=5, help="複数動画の要約で一度に処理する動画の数")
+    parser.add_argument("--latency", type=float, default=0.2, help="OpenAI の応答までの待ち時間（秒）")
+    parser.add_argument("--token-rate", type=float, default=500, help="OpenAI の生成速度（トークン/秒）")
+    parser.add_argument("--completion-tokens", type=int, default=150, help="OpenAI の応答のトークン数")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="この回数ごとに OpenAI が 429 を返す（0 で無効）")
+    parser.add_argument("--transcript-latency", type=float, default=0.3, help="文字起こしの取得の待ち時間（秒）")
+    parser.add_argument("--transcript-segments", type=int, default=600, help="文字起こしのセグメント数")
+    parser.add_argument("--http-latency", type=float, default=0.05, help="ウェブページ・PDF の応答の待ち時間（秒）")
+    parser.add_argument("--pdf-pages", type=int, default=24, help="PDF のページ数")
+    parser.add_argument("--json", help="結果を JSON で保存するファイル")
+    parser.add_argument("--baseline", help="比較する基準の結果（--json で保存したもの）")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="基準からの経過時間の増加の許容割合")
+    args = parser.parse_args(argv)
+
+    services = {
+        "openai": FakeOpenAIServer(args.latency, args.token_rate, args.completion_tokens, args.rate_limit_every).start(),
+        "fixtures": FixtureServer(args.http_latency, args.pdf_pages).start(),
+        "smtp": SMTPSink().start(),
+        "transcripts": FakeTranscripts(args.transcript_latency, args.transcript_segments),
+    }
+    results = {}
+    with tempfile.TemporaryDirectory(prefix="bench-") as workspace:
+        configure(workspace, services["openai"], services["smtp"])
+
+        from utils import transcripts
+        from utils.chunking import count_tokens
+        from utils.metrics import timed_function
+        from utils.prompts import get_prompt_registry
+
+        # Streamlit の外で実行するときの警告を表示しない
+        for logger_name in list(logging.root.manager.loggerDict):
+            if logger_name.startswith("streamlit"):
+                logging.getLogger(logger_name).setLevel(logging.ERROR)
+        # 読み込みやトークナイザーの準備にかかる時間を最初のパイプラインに含めない
+        get_prompt_registry()
+        count_tokens("warmup")
+
+        # YouTube への接続を代替の関数に置き換える（キャッシュはアプリと同じ処理を通る）
+        transcripts._fetch = timed_function("transcript_fetch")(services["transcripts"])
+
+        for name in args.only or SCENARIOS:
+            items = args.videos if name == "multi_summary" else args.items
+            # 1 回目はキャッシュなし、2 回目は同じ入力でキャッシュありの状態を測る
+            results[name] = {pass_name: run_scenario(name, services, items) for pass_name in PASSES}
+            print(f"{name}: 完了", file=sys.stderr)
+
+    for key in ("openai", "fixtures", "smtp"):
+        services[key].stop()
+
+    print_report(results)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "results": results}, f, ensure_ascii=False, indent=2)
+
+    if any(result["error"] for passes in results.values() for result in passes.values()):
+        return 1
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"性能の低下: {regression}", file=sys.stderr)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,51 @@
+"""文字起こしと音声合成をローカルの代替（fakes.py）に置き換えて Streamlit アプリを起動します。
+
+load.py が負荷試験の対象として起動します。OpenAI・SMTP などの接続先は、
+作業ディレクトリの .streamlit/secrets.toml で代替サービスに向けてください。
+
+使い方:
+    python benchmarks/serve.py --port 8599 -- --server.headless true
+"""
+import argparse
+import os
+import sys
+
+from fakes import FakeSpeech, FakeTranscripts
+
+# utils をリポジトリのルートから読み込む
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="代替サービスを使う設定で Streamlit アプリを起動します。")
+    parser.add_argument("--port", type=int, default=8599)
+    parser.add_argument("--transcript-latency", type=float, default=0.3, help="文字起こしの取得の待ち時間（秒）")
+    parser.add_argument("--transcript-segments", type=int, default=600, help="文字起こしのセグメント数")
+    parser.add_argument("--tts-latency", type=float, default=0.5, help="音声合成の待ち時間（秒）")
+    parser.add_argument("streamlit_args", nargs="*", help="streamlit run に渡す追加の引数（-- の後に指定）")
+    args = parser.parse_args(argv)
+
+    from utils import transcripts, tts
+    from utils.metrics import timed_function
+
+    # ページは同じプロセスの utils を使うため、ここで置き換えた関数がそのまま使われる
+    transcripts._fetch = timed_function("transcript_fetch")(FakeTranscripts(args.transcript_latency, args.transcript_segments))
+    tts._synthesize_chunk = FakeSpeech(args.tts_latency)
+
+    from streamlit.web import cli
+
+    sys.argv = [
+        "streamlit", "run", os.path.join(ROOT_DIR, "app.py"),
+        "--server.port", str(args.port),
+        "--server.address", "127.0.0.1",
+        "--server.headless", "true",
+        "--server.fileWatcherType", "none",
+        "--browser.gatherUsageStats", "false",
+        *args.streamlit_args,
+    ]
+    sys.exit(cli.main())
+
+
+if __name__ == "__main__":
+    main()
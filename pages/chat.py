@@ -1,4 +1,3 @@
-from openai import OpenAI
 import streamlit as st
 
 # ページ設定を最初に記述
@@ -14,6 +13,9 @@ st.title("💬 Chatbot")
 st.caption("🚀 A Streamlit chatbot powered by OpenAI")
 
 from utils.auth import check_authentication, show_logout_button
+from utils.chat_context import new_context_state, prepare_messages
+from utils.llm import stream_chat_completion
+from utils.metrics import show_run_metrics, start_run
 
 # 認証チェック
 check_authentication()
@@ -21,14 +23,17 @@ check_authentication()
 # サイドバーにログアウトボタンを表示
 show_logout_button()
 
-# OpenAI APIキーとモデルを設定
-api_key = st.secrets["openai_api_key"]
-model_name = st.secrets["openai_model"]
+# 処理時間の計測を開始
+start_run("chat")
 
 # メッセージ履歴の初期化
 if "messages" not in st.session_state:
     st.session_state["messages"] = [{"role": "assistant", "content": "お手伝いできることはありますか?"}]
 
+# 古い会話を要約した状態（送信する履歴をトークン数の上限内に収めるために使用）
+if "chat_context" not in st.session_state:
+    st.session_state["chat_context"] = new_context_state()
+
 # チャット履歴の表示
 st.write("---")  # 見た目を区切るライン
 for msg in st.session_state.messages:
@@ -42,19 +47,17 @@ if prompt := st.chat_input("GPTにメッセージを送信する"):
     with st.chat_message("user"):
         st.write(prompt)
 
-    # OpenAI APIを呼び出して応答を取得
+    # OpenAI APIを呼び出して応答をストリーミング表示
     try:
-        client = OpenAI(api_key=api_key)
-        response = client.chat.completions.create(
-            model=model_name,
-            messages=st.session_state.messages,
-        )
-        bot_message = response.choices[0].message.content
+        with st.chat_message("assistant"):
+            request_messages = prepare_messages(st.session_state.messages, st.session_state.chat_context)
+            bot_message = st.write_stream(stream_chat_completion(messages=request_messages, cache=False))
 
         # アシスタントの応答を履歴に追加
         st.session_state.messages.append({"role": "assistant", "content": bot_message})
-        with st.chat_message("assistant"):
-            st.write(bot_message)
     except Exception as e:
         # エラーが発生した場合は表示
         st.error(f"An error occurred: {e}")
+
+# 処理時間の内訳を表示
+show_run_metrics()
@@ -9,6 +9,9 @@ st.set_page_config(
 )
 
 from utils.auth import check_authentication, show_logout_button
+from utils.config import get_setting
+from utils.metrics import show_run_metrics, start_run
+from utils.outline import parse_outline, render_outline, walk_outline
 
 # 認証チェック
 check_authentication()
@@ -16,10 +19,24 @@ check_authentication()
 # サイドバーにログアウトボタンを表示
 show_logout_button()
 
+# 処理時間の計測を開始
+start_run("create_mindmap_by_markdown")
+
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def load_outline(markdown_content: str):
+    """Markdown を一度だけ解析し、ノードの木を返します（同じ内容は再解析しない）。
+
+    木は解析後に読み取るだけなので、再実行のたびに複製（pickle）しないよう共有します。
+    """
+    return parse_outline(markdown_content)
+
+
 st.title("Markdown to Mind Map Viewer")
 
 st.write("""
 このアプリでは、Markdownファイルをアップロードすると、その内容をマインドマップとして表示します。
+大きなファイルは上位の階層だけを表示し、選んだノードの下を展開して表示します。
 """)
 
 # ファイルアップロード
@@ -27,12 +44,60 @@ uploaded_file = st.file_uploader("Markdownファイルをアップロードし
 
 if uploaded_file:
     # Markdownの内容を読み込む
-    markdown_content = uploaded_file.read().decode("utf-8")
-    
+    markdown_content = uploaded_file.getvalue().decode("utf-8")
+    root = load_outline(markdown_content)
+    total_nodes = root.count() - 1
+
+    # 表示する階層の数（ノードが少なければすべて表示する）
+    if total_nodes <= get_setting("markdown_mindmap_full_nodes", 500):
+        levels = None
+    else:
+        levels = st.slider(
+            "一度に表示する階層の数",
+            min_value=1,
+            max_value=max(2, root.depth() - 1),
+            value=min(get_setting("markdown_mindmap_levels", 3), max(2, root.depth() - 1)),
+        )
+
+    # 展開するノードを選ぶ（表示している階層にあり、省略した子を持つノードが候補）
+    focus = root
+    if levels is not None:
+        candidates = [(path, node) for path, node in walk_outline(root, levels) if node.children]
+        choice = st.selectbox(
+            "展開するノード",
+            range(len(candidates) + 1),
+            format_func=lambda i: "（全体）" if i == 0 else " / ".join(candidates[i - 1][0]),
+        )
+        if choice:
+            focus = candidates[choice - 1][1]
+
+    if levels is None:
+        # 省略するノードが無い場合は、元の Markdown（フロントマターや書式を含む）をそのまま表示する
+        focus_markdown = markdown_content
+        shown_nodes = total_nodes
+    else:
+        focus_markdown = render_outline(focus, max_depth=levels, frontmatter=root.frontmatter)
+        shown_nodes = sum(1 for _ in walk_outline(focus, levels))
+
     # マインドマップを表示
     st.subheader("マインドマップ")
-    markmap(markdown_content)
-    
-    # アップロードされたMarkdownの内容を表示
+    st.caption(
+        f"ノード数: {total_nodes:,}（表示中: {shown_nodes:,}）／ 深さ: {root.depth() - 1}"
+        + ("" if levels is None else "　「（+N）」は省略した子孫のノード数です。")
+    )
+    markmap(focus_markdown)
+
+    # アップロードされたMarkdownの内容を表示（大きなファイルはページに分けて表示する）
     st.subheader("Markdownの内容")
-    st.code(markdown_content, language="markdown")
+    lines = markdown_content.splitlines()
+    page_lines = get_setting("markdown_source_page_lines", 200)
+    if len(lines) <= page_lines:
+        st.code(markdown_content, language="markdown")
+    else:
+        page_count = -(-len(lines) // page_lines)
+        page = st.number_input(f"ページ（全 {page_count} ページ、{len(lines):,} 行）", min_value=1, max_value=page_count, value=1)
+        start = (page - 1) * page_lines
+        st.code("\n".join(lines[start:start + page_lines]), language="markdown")
+
+# 処理時間の内訳を表示
+show_run_metrics()
@@ -1,12 +1,5 @@
-import os
 import requests
-import pdfplumber
-from tempfile import NamedTemporaryFile
 import streamlit as st
-from openai import OpenAI
-
-client = OpenAI(api_key=st.secrets["openai_api_key"])
-from requests.adapters import HTTPAdapter, Retry
 
 # ページ設定
 st.set_page_config(
@@ -16,6 +9,11 @@ st.set_page_config(
 )
 
 from utils.auth import check_authentication, show_logout_button
+from utils.jobs import DONE, get_job, recall_job, remember_job, show_job_progress, submit_job
+from utils.metrics import show_run_metrics, start_run
+from utils.pdf import download_pdf
+from utils.pipelines import extract_pdf_text
+from utils.summarize import summarize_long_text
 
 # 認証チェック
 check_authentication()
@@ -23,112 +21,56 @@ check_authentication()
 # サイドバーにログアウトボタンを表示
 show_logout_button()
 
-# OpenAI API キーの設定
-
-def download_and_save_pdf_temporarily(url: str) -> str:
-    # リトライとタイムアウト設定を含むセッションを作成
-    session = requests.Session()
-    retries = Retry(
-        total=3,
-        backoff_factor=1,
-        status_forcelist=[500, 502, 503, 504]
-    )
-    session.mount("http://", HTTPAdapter(max_retries=retries))
-    session.mount("https://", HTTPAdapter(max_retries=retries))
-
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
-    }
-
-    response = session.get(url, headers=headers, timeout=30, stream=True)
-    response.raise_for_status()
-
-    with NamedTemporaryFile(delete=False, suffix=".pdf") as temp_pdf:
-        for chunk in response.iter_content(chunk_size=1024):
-            if chunk:
-                temp_pdf.write(chunk)
-        temp_file_path = temp_pdf.name
-
-    return temp_file_path
-
-def extract_text_from_pdf(pdf_path: str) -> str:
-    text = ""
-    with pdfplumber.open(pdf_path) as pdf:
-        for page in pdf.pages:
-            page_text = page.extract_text()
-            if page_text:
-                text += page_text + "\n"
-    return text
-
-def chunk_text(text: str, max_chars: int = 3000):
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = start + max_chars
-        chunks.append(text[start:end])
-        start = end
-    return chunks
-
-def summarize_text(text_chunk: str, prompt_file_path: str) -> str:
-    with open(prompt_file_path, "r", encoding="utf-8") as f:
-        prompt_template = f.read()
-
-    prompt = prompt_template.format(text_chunk)
-
-    response = client.chat.completions.create(model=st.secrets["openai_model"],
-    messages=[
-        {"role": "system", "content": "You are a highly skilled financial analyst."},
-        {"role": "user", "content": prompt}
-    ],
-    temperature=0.5,
-    max_tokens=3000)
-    return response.choices[0].message.content
-
-def summarize_long_text(text: str, prompt_file_path: str) -> str:
-    chunks = chunk_text(text, max_chars=3000)
-    partial_summaries = []
-
-    for chunk in chunks:
-        summary = summarize_text(chunk, prompt_file_path)
-        partial_summaries.append(summary)
-
-    combined_summary_text = "\n".join(partial_summaries)
-    return summarize_text(combined_summary_text, prompt_file_path)
+# 処理時間の計測を開始
+start_run("financial_analyst")
+
+
+def run_analysis_job(job, pdf_url: str, page_range: str, extract_tables: bool) -> str:
+    """PDF のダウンロードから要約までを行います（バックグラウンドのジョブとして実行）。"""
+    try:
+        pdf_data = job.run_stage("PDFをダウンロードしています...", download_pdf, pdf_url)
+    except requests.exceptions.RequestException as e:
+        raise RuntimeError(f"PDFのダウンロードに失敗しました: {e}") from e
+    job.update(0.2)
+
+    text = job.run_stage("PDFのテキストを抽出しています...", extract_pdf_text, pdf_data, page_range, extract_tables)
+    job.update(0.4)
+
+    summary_stream = job.run_stage("要約しています...", summarize_long_text, text, "financial_analyst", stream=True)
+
+    # 最終要約は生成途中のテキストを途中結果として公開する
+    job.update(0.8, "要約を生成しています...")
+    parts = []
+    for part in summary_stream:
+        job.check_cancelled()
+        parts.append(part)
+        job.set_partial(["".join(parts)])
+    return "".join(parts)
+
 
 def main():
     st.title("決算公告から分析")
 
     pdf_url = st.text_input("PDFのURLを入力してください", "")
-    summary_output = st.session_state.get("summary_output", None)
+    page_range = st.text_input("分析するページ（任意、例: 1-10, 15, 20-）", "")
+    extract_tables = st.checkbox("表を検出してコンパクトに抽出する（財務諸表向け）", value=True)
+    summary_output = None
 
     if st.button("要約を実行"):
         if not pdf_url.strip():
             st.warning("URLを入力してください。")
             return
 
-        with st.spinner("PDFをダウンロードしています..."):
-            try:
-                temp_pdf_path = download_and_save_pdf_temporarily(pdf_url.strip())
-            except requests.exceptions.RequestException as e:
-                st.error(f"PDFのダウンロードに失敗しました: {e}")
-                return
-
-        with st.spinner("PDFのテキストを抽出しています..."):
-            text = extract_text_from_pdf(temp_pdf_path)
-
-        try:
-            os.remove(temp_pdf_path)
-        except Exception as e:
-            st.warning(f"一時ファイルの削除に失敗しました: {e}")
-
-        if not text.strip():
-            st.error("PDFからテキストを抽出できませんでした。")
-            return
-
-        with st.spinner("要約しています..."):
-            summary_output = summarize_long_text(text, "prompts/financial_analyst.txt")
+        # 分析はバックグラウンドのジョブとして実行し、再実行やページの再読み込みでも中断しない
+        job_id = submit_job("決算公告の分析", run_analysis_job, pdf_url.strip(), page_range, extract_tables)
+        remember_job("financial_job", job_id)
 
-        st.session_state["summary_output"] = summary_output
+    job_id = recall_job("financial_job")
+    if job_id:
+        show_job_progress(job_id, render_partial=lambda partial: st.write(partial[-1]))
+        job = get_job(job_id)
+        if job and job["status"] == DONE:
+            summary_output = job["result"]
 
     if summary_output:
         st.subheader("要約結果")
@@ -144,3 +86,4 @@ def main():
 
 if __name__ == "__main__":
     main()
+    show_run_metrics()
@@ -1,8 +1,5 @@
 import streamlit as st
 from streamlit_markmap import markmap
-from openai import OpenAI
-import io
-import textwrap
 
 # ページ設定
 st.set_page_config(
@@ -12,6 +9,12 @@ st.set_page_config(
 )
 
 from utils.auth import check_authentication, show_logout_button
+from utils.cache import make_key
+from utils.config import get_setting
+from utils.jobs import CANCELLED, DONE, FAILED, get_job, recall_job, remember_job, show_job_progress, submit_job
+from utils.metrics import show_run_metrics, start_run
+from utils.pipelines import generate_mindmap
+from utils.prompts import get_prompt
 
 # 認証チェック
 check_authentication()
@@ -19,8 +22,19 @@ check_authentication()
 # サイドバーにログアウトボタンを表示
 show_logout_button()
 
-# OpenAI API キーの設定
-client = OpenAI(api_key=st.secrets["openai_api_key"])
+# 処理時間の計測を開始
+start_run("mindmap")
+
+
+def run_mindmap_job(job, transcript_text: str, consolidate: bool) -> str:
+    """マインドマップを生成します（バックグラウンドのジョブとして実行）。"""
+    def progress(done, total):
+        job.update(done / total, f"{done} / {total} チャンク完了")
+
+    job.update(0.0, "チャンクを処理中...")
+
+    return generate_mindmap(transcript_text, progress=progress, consolidate=consolidate)
+
 
 st.title("文字起こしデータからマインドマップを生成")
 
@@ -33,52 +47,56 @@ if "full_mindmap_data" not in st.session_state:
 
 # ファイルアップロード
 uploaded_file = st.file_uploader("文字起こしデータをアップロード（.txt）", type="txt")
+consolidate = st.checkbox(
+    "似た意味のノードを LLM でまとめる（ラベルのみを送信）",
+    value=get_setting("mindmap_consolidate", False),
+)
 
 if uploaded_file is not None:
     try:
         # アップロードされたファイルをテキストとして読み取る
-        st.session_state.transcript_text = uploaded_file.read().decode("utf-8")
+        st.session_state.transcript_text = uploaded_file.getvalue().decode("utf-8")
 
         st.write("アップロードされた文字起こしデータ:")
         st.text_area("内容", st.session_state.transcript_text, height=200)
 
-        # プロンプトを外部ファイルから読み込む
-        try:
-            with open("prompts/mindmap.txt", "r", encoding="utf-8") as file:
-                prompt_template = file.read()
-        except FileNotFoundError:
-            st.error("プロンプトファイルが見つかりません。`prompts/mindmap.txt` を確認してください。")
-            st.stop()
-
-        # トークン制限を考慮して文字起こしデータを分割
-        chunk_size = 2000  # 各チャンクの文字数
-        transcript_chunks = textwrap.wrap(st.session_state.transcript_text, chunk_size)
-
-        # 各チャンクの要約を生成
-        summaries = []
-        for i, chunk in enumerate(transcript_chunks):
-            st.write(f"チャンク {i + 1} を処理中...")
-            prompt = prompt_template.format(chunk=chunk)  # プレースホルダー `{chunk}` を使用
-            try:
-                response = client.chat.completions.create(model=st.secrets["openai_model"],
-                messages=[
-                    {"role": "system", "content": "あなたは文字起こしデータを解析してマインドマップを生成するアシスタントです。"},
-                    {"role": "user", "content": prompt},
-                ],
-                max_tokens=1500,
-                temperature=0.5)
-                summaries.append(response.choices[0].message.content)
-            except Exception as e:
-                st.error(f"チャンク {i + 1} の処理中にエラーが発生しました: {e}")
-                st.stop()
-
-        # すべての部分要約を統合
-        st.session_state.full_mindmap_data = "- テーマ: 文字起こしのマインドマップ\n"
-        st.session_state.full_mindmap_data += "\n".join([f"    {summary}" for summary in summaries])
+        # 内容が変わったときだけジョブを開始し、再実行のたびに生成し直さない。
+        # 同じ内容のジョブが実行中・完了済みの場合はその結果を使う
+        content_key = make_key("mindmap", get_prompt("mindmap").text, consolidate, st.session_state.transcript_text)
+        content_changed = st.session_state.get("mindmap_content_key") != content_key
+
+        # 前回のジョブが失敗・キャンセルされた場合は、同じ内容でもボタンから生成し直せるようにする
+        previous_job_id = recall_job("mindmap_job")
+        previous_job = get_job(previous_job_id) if previous_job_id else None
+        retry = (
+            not content_changed
+            and previous_job is not None
+            and previous_job["status"] in (FAILED, CANCELLED)
+            and st.button("もう一度生成する")
+        )
+
+        if content_changed or retry:
+            st.session_state.mindmap_content_key = content_key
+            st.session_state.full_mindmap_data = ""
+            job_id = submit_job(
+                "マインドマップの生成",
+                run_mindmap_job,
+                st.session_state.transcript_text,
+                consolidate,
+                dedupe_key=content_key,
+            )
+            remember_job("mindmap_job", job_id)
 
     except Exception as e:
         st.error(f"予期しないエラーが発生しました: {e}")
 
+job_id = recall_job("mindmap_job")
+if job_id:
+    show_job_progress(job_id)
+    job = get_job(job_id)
+    if job and job["status"] == DONE:
+        st.session_state.full_mindmap_data = job["result"]
+
 # マインドマップの表示
 if st.session_state.full_mindmap_data:
     st.write("### マインドマップの構造")
@@ -104,3 +122,6 @@ if st.session_state.full_mindmap_data:
         file_name=transcript_file_name,
         mime="text/plain",
     )
+
+# 処理時間の内訳を表示
+show_run_metrics()
@@ -1,10 +1,4 @@
 import streamlit as st
-from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound
-from openai import OpenAI
-import io
-import tempfile
-import os
-import yagmail
 
 # ページ設定
 st.set_page_config(
@@ -15,6 +9,10 @@ st.set_page_config(
 )
 
 from utils.auth import check_authentication, show_logout_button
+from utils.config import get_setting
+from utils.jobs import DONE, get_job, recall_job, remember_job, show_job_progress, submit_job
+from utils.metrics import show_run_metrics, start_run
+from utils.pipelines import summarize_videos
 
 # 認証チェック
 check_authentication()
@@ -22,13 +20,38 @@ check_authentication()
 # サイドバーにログアウトボタンを表示
 show_logout_button()
 
-# OpenAI API キーの設定
-client = OpenAI(api_key=st.secrets["openai_api_key"])
+# 処理時間の計測を開始
+start_run("multi_summary")
+
+# 一度に処理できる URL の上限
+max_urls = get_setting("multi_summary_max_urls", 10)
+
+
+def show_item_status(item: dict):
+    """1 件の動画の警告・エラー・メール送信結果を表示します。"""
+    if item["warning"]:
+        st.warning(item["warning"])
+    if item["error"]:
+        st.error(item["error"])
+    if item["email"]:
+        st.success(item["email"])
+    if item["email_error"]:
+        st.error(item["email_error"])
+
+
+def render_partial_items(items: list):
+    """実行中のジョブで完了した動画の要約を入力順に表示します。"""
+    for item in sorted(items, key=lambda item: item["idx"]):
+        st.write(f"### 動画 {item['idx']}: {item['url']}")
+        show_item_status(item)
+        if "summary" in item:
+            st.write(item["summary"])
+
 
 st.title("複数動画の要約生成")
 
-# URL の入力欄（複数行入力、最大10行）
-st.write("YouTube 動画の URL を最大10件貼り付けてください（1行に1つの URL）。")
+# URL の入力欄（複数行入力）
+st.write(f"YouTube 動画の URL を最大{max_urls}件貼り付けてください（1行に1つの URL）。")
 urls = st.text_area(
     "動画 URL を入力してください:",
     height=150,
@@ -44,157 +67,92 @@ if "full_summary" not in st.session_state:
     st.session_state.full_summary = ""
 
 # 入力された URL の数を確認
-if len(urls) > 10:
-    st.error("最大10件までの URL を入力してください。")
+if len(urls) > max_urls:
+    st.error(f"最大{max_urls}件までの URL を入力してください。")
 else:
     email = st.text_input("要約を送信するメールアドレス（任意）:")
+    digest = st.checkbox(
+        "すべての要約を 1 通のメールにまとめて送信する",
+        value=get_setting("multi_summary_email_digest", False),
+        disabled=not email,
+    )
 
     if st.button("実行"):
         if not urls:
             st.error("URL が入力されていません。")
         else:
-            try:
-                yag = None
-
-                # メール送信用に yagmail を設定（メールアドレスが入力されている場合）
-                if email:
-                    try:
-                        yag = yagmail.SMTP(st.secrets["email_user"], st.secrets["email_password"])
-                    except Exception as e:
-                        st.error(f"メール送信設定中にエラーが発生しました: {e}")
-                        st.stop()
-
-                # 各動画 URL を処理
-                for idx, video_url in enumerate(urls, start=1):
-                    try:
-                        st.write(f"### 動画 {idx}: {video_url}")
-
-                        # URL に v= が含まれているかを確認し、含まれていない場合はエラー
-                        if "v=" not in video_url:
-                            raise ValueError("有効な YouTube 動画の URL を入力してください。")
-
-                        # 1. "v=" で分割して後ろの部分を取得
-                        video_id_part = video_url.split("v=")[1]
-
-                        # 2. "&" がある場合は分割して先頭の要素を取り出す
-                        video_id = video_id_part.split("&")[0]
-
-                        if not video_id:
-                            raise ValueError("有効な YouTube 動画の URL を入力してください。")
-
-                        # 文字起こしを取得
-                        try:
-                            transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=['en','ja'])
-                            transcript_text = " ".join([x["text"] for x in transcript])
-                        except NoTranscriptFound:
-                            st.warning(f"動画 {idx}: 利用可能な文字起こしが見つかりません。スキップします。")
-                            continue
-
-                        # プロンプトファイルを読み込む
-                        try:
-                            with open("prompts/summary.txt", "r", encoding="utf-8") as file:
-                                prompt_template = file.read()
-                            prompt = prompt_template.format(transcript=transcript_text)
-                        except FileNotFoundError:
-                            st.error("プロンプトファイルが見つかりません。")
-                            st.stop()
-
-                        # 要約を生成
-                        response = client.chat.completions.create(
-                            model=st.secrets["openai_model"],
-                            messages=[
-                                {"role": "system", "content": "あなたは動画の文字起こしを要約するアシスタントです。"},
-                                {"role": "user", "content": prompt},
-                            ],
-                            max_tokens=3000,
-                            temperature=0.5)
-                        summary = response.choices[0].message.content
-
-                        # 要約のタイトルを抽出
-                        title = summary.split("\n")[1].strip()
-
-                        # 要約結果を表示
-                        st.write("#### 要約結果")
-                        st.write(summary)
-
-                        # 区切り線を追加
-                        st.divider()
-
-                        # Markdown ファイルとしてダウンロード
-                        markdown_file_name = f"{title}.md"
-                        markdown_data = io.StringIO(summary)
-                        st.download_button(
-                            label=f"動画 {idx} の要約をダウンロード（Markdown形式）",
-                            data=markdown_data.getvalue(),
-                            file_name=markdown_file_name,
-                            mime="text/markdown",
-                        )
-
-                        # 文字起こしファイルとしてダウンロード
-                        transcript_file_name = f"{title}.txt"
-                        transcript_data = io.StringIO(transcript_text)
-                        st.download_button(
-                            label=f"動画 {idx} の文字起こしをダウンロード（テキスト形式）",
-                            data=transcript_data.getvalue(),
-                            file_name=transcript_file_name,
-                            mime="text/plain",
-                        )
-
-                        # メール送信部分の修正
-                        if yag:
-                            try:
-                                with tempfile.NamedTemporaryFile(delete=False) as markdown_temp:
-                                    markdown_temp.write(markdown_data.getvalue().encode("utf-8"))
-                                    markdown_temp_path = markdown_temp.name
-
-                                with tempfile.NamedTemporaryFile(delete=False) as transcript_temp:
-                                    transcript_temp.write(transcript_data.getvalue().encode("utf-8"))
-                                    transcript_temp_path = transcript_temp.name
-
-                                # メールの件名
-                                subject = f"動画 {idx} の要約: {title}"
-
-                                # メール送信
-                                yag.send(
-                                    to=email,
-                                    subject=subject,
-                                    contents=[
-                                        summary,
-                                        "文字起こしデータを添付しました。",
-                                    ],
-                                    attachments=[markdown_temp_path, transcript_temp_path]
-                                )
-                                st.success(f"動画 {idx} の要約と文字起こしデータをメール送信しました！件名: {subject}")
-
-                                # 一時ファイルを削除
-                                os.unlink(markdown_temp_path)
-                                os.unlink(transcript_temp_path)
-
-                            except Exception as e:
-                                st.error(f"動画 {idx} のメール送信中にエラーが発生しました: {e}")
-
-                        # 全体の要約に追加
-                        st.session_state.all_summaries.append(f"### 動画 {idx}: {title}\n{summary}")
-
-                    except Exception as e:
-                        st.error(f"動画 {idx} の処理中にエラーが発生しました: {e}")
-
-                # 全体の要約をセッションに保存
-                if st.session_state.all_summaries:
-                    st.session_state.full_summary = "\n\n".join(st.session_state.all_summaries)
-
-            except Exception as e:
-                st.error(f"エラーが発生しました: {e}")
-
-        # 全体の要約を表示
-        if st.session_state.full_summary:
-            st.write("### 全体の要約")
-            st.text_area("全体の要約", st.session_state.full_summary, height=300)
-
-            # 全体の要約をダウンロード
-            st.download_button(
-                label="全体の要約をダウンロード（テキスト形式）",
-                data=st.session_state.full_summary,
-                file_name="all_summaries.txt",
-                mime="text/plain",
+            # 要約はバックグラウンドのジョブとして実行し、再実行やページの再読み込みでも中断しない
+            job_id = submit_job(
+                "複数動画の要約",
+                summarize_videos,
+                urls,
+                email,
+                st.secrets.get("email_user") if email else None,
+                st.secrets.get("email_password") if email else None,
+                digest=digest,
             )
+            remember_job("multi_summary_job", job_id)
+
+    job_id = recall_job("multi_summary_job")
+    if job_id:
+        show_job_progress(job_id, render_partial=render_partial_items)
+        job = get_job(job_id)
+        if job and job["status"] == DONE:
+            results = []
+            for item in job["result"]:
+                idx = item["idx"]
+                st.write(f"### 動画 {idx}: {item['url']}")
+                show_item_status(item)
+                if "summary" not in item:
+                    continue
+
+                summary = item["summary"]
+                title = item["title"]
+
+                # 要約結果を表示
+                st.write("#### 要約結果")
+                st.write(summary)
+
+                # 区切り線を追加
+                st.divider()
+
+                # Markdown ファイルとしてダウンロード
+                st.download_button(
+                    label=f"動画 {idx} の要約をダウンロード（Markdown形式）",
+                    data=summary,
+                    file_name=f"{title}.md",
+                    mime="text/markdown",
+                    key=f"download_summary_{idx}",
+                )
+
+                # 文字起こしファイルとしてダウンロード
+                st.download_button(
+                    label=f"動画 {idx} の文字起こしをダウンロード（テキスト形式）",
+                    data=item["transcript_text"],
+                    file_name=f"{title}.txt",
+                    mime="text/plain",
+                    key=f"download_transcript_{idx}",
+                )
+
+                # 全体の要約に追加
+                results.append(f"### 動画 {idx}: {title}\n{summary}")
+
+            # 全体の要約を入力順に並べてセッションに保存
+            st.session_state.all_summaries = results
+            st.session_state.full_summary = "\n\n".join(results)
+
+            # 全体の要約を表示
+            if st.session_state.full_summary:
+                st.write("### 全体の要約")
+                st.text_area("全体の要約", st.session_state.full_summary, height=300)
+
+                # 全体の要約をダウンロード
+                st.download_button(
+                    label="全体の要約をダウンロード（テキスト形式）",
+                    data=st.session_state.full_summary,
+                    file_name="all_summaries.txt",
+                    mime="text/plain",
+                )
+
+# 処理時間の内訳を表示
+show_run_metrics()
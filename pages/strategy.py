@@ -1,5 +1,4 @@
 import streamlit as st
-from openai import OpenAI
 from streamlit_markmap import markmap
 
 # ページ設定を最初に記述
@@ -11,6 +10,9 @@ st.set_page_config(
 )
 
 from utils.auth import check_authentication, show_logout_button
+from utils.llm import stream_chat_completion
+from utils.metrics import show_run_metrics, start_run
+from utils.prompts import render_prompt
 
 # 認証チェック
 check_authentication()
@@ -18,13 +20,8 @@ check_authentication()
 # サイドバーにログアウトボタンを表示
 show_logout_button()
 
-# OpenAI APIキーを設定
-client = OpenAI(api_key=st.secrets["openai_api_key"])
-
-# プロンプトの読み込み関数
-def load_prompt(filepath):
-    with open(filepath, "r", encoding="utf-8") as file:
-        return file.read()
+# 処理時間の計測を開始
+start_run("strategy")
 
 # Streamlitアプリのレイアウト
 st.title("戦略立案アプリ")
@@ -41,32 +38,27 @@ if st.button("戦略を生成"):
     if not keywords or not goal or not period or not cost:
         st.warning("すべての項目を入力してください。")
     else:
-        # プロンプトを外部ファイルから読み込み
+        # 動的プロンプトの生成（テンプレートは prompts/strategy.txt）
         try:
-            base_prompt = load_prompt("prompts/strategy.txt")
-        except FileNotFoundError:
-            st.error("プロンプトファイルが見つかりませんでした。'prompts/strategy.txt' を確認してください。")
-        else:
-            # 動的プロンプトの生成
-            prompt = base_prompt.format(
+            prompt = render_prompt(
+                "strategy",
                 keywords=', '.join(keywords.split(',')),
                 goal=goal,
                 period=period,
                 cost=cost
             )
-
+        except FileNotFoundError:
+            st.error("プロンプトファイルが見つかりませんでした。'prompts/strategy.txt' を確認してください。")
+        else:
             # OpenAI API経由で戦略を生成
             try:
-                response = client.chat.completions.create(model=st.secrets["openai_model"],
+                # 戦略の出力（生成中のテキストを逐次表示する）
+                st.subheader("生成された戦略")
+                result = st.write_stream(stream_chat_completion(
                 messages=[
                     {"role": "system", "content": "あなたは優れた戦略アナリストです。"},
                     {"role": "user", "content": prompt},
-                ])
-                result = response.choices[0].message.content
-
-                # 戦略の出力
-                st.subheader("生成された戦略")
-                st.markdown(result)
+                ]))
 
                 # マインドマップ用データ抽出（マークダウン部分のみ）
                 if "マインドマップ用マークダウン形式" in result:
@@ -78,3 +70,6 @@ if st.button("戦略を生成"):
 
             except Exception as e:
                 st.error(f"エラーが発生しました: {e}")
+
+# 処理時間の内訳を表示
+show_run_metrics()
@@ -1,13 +1,5 @@
 import streamlit as st
-from youtube_transcript_api import YouTubeTranscriptApi, NoTranscriptFound
-from openai import OpenAI
 import io
-import tempfile
-import os
-import yagmail
-from gtts import gTTS
-import markdown
-from bs4 import BeautifulSoup
 
 # ページ設定
 st.set_page_config(
@@ -18,6 +10,12 @@ st.set_page_config(
 )
 
 from utils.auth import check_authentication, show_logout_button
+from utils.llm import stream_chat_completion
+from utils.mail import Attachment, send_mail, show_mail_status
+from utils.metrics import show_run_metrics, start_run
+from utils.pipelines import extract_title, video_summary_messages
+from utils.tts import show_audio_player
+from utils.transcripts import TranscriptNotFound, extract_video_id, get_transcript, transcript_to_text
 
 # 認証チェック
 check_authentication()
@@ -25,8 +23,8 @@ check_authentication()
 # サイドバーにログアウトボタンを表示
 show_logout_button()
 
-# OpenAI API キーの設定
-client = OpenAI(api_key=st.secrets["openai_api_key"])
+# 処理時間の計測を開始
+start_run("summary")
 
 st.title("YouTube 動画要約")
 
@@ -46,24 +44,14 @@ email = st.text_input("要約を送信するメールアドレス（任意）:")
 
 if st.button("実行"):
     try:
-        # URL に v= が含まれているかを確認し、含まれていない場合はエラー
-        if "v=" not in video_url:
-            raise ValueError("有効な YouTube 動画の URL を入力してください。")
+        # 1. URL から動画 ID を取得
+        video_id = extract_video_id(video_url)
 
-        # 1. "v=" で分割して後ろの部分を取得
-        video_id_part = video_url.split("v=")[1]
-
-        # 2. "&" がある場合は分割して先頭の要素を取り出す
-        video_id = video_id_part.split("&")[0]
-
-        if not video_id:
-            raise ValueError("有効な YouTube 動画の URL を入力してください。")
-
-        # 2. 日本語または英語の文字起こしを取得
+        # 2. 日本語または英語の文字起こしを取得（キャッシュ済みならネットワークに接続しない）
         try:
-            transcript = YouTubeTranscriptApi.get_transcript(video_id, languages=['en','ja'])
-            st.session_state.transcript_text = " ".join([x["text"] for x in transcript])
-        except NoTranscriptFound:
+            transcript = get_transcript(video_id, languages=('en', 'ja'))
+            st.session_state.transcript_text = transcript_to_text(transcript)
+        except TranscriptNotFound:
             st.error("指定された動画には字幕が無効です。別の動画を選択してください。")
             st.stop()
         except Exception as e:
@@ -72,9 +60,7 @@ if st.button("実行"):
 
         # 3. プロンプトファイルを読み込む
         try:
-            with open("prompts/summary.txt", "r", encoding="utf-8") as file:
-                prompt_template = file.read()
-            prompt = prompt_template.format(transcript=st.session_state.transcript_text)
+            messages = video_summary_messages(st.session_state.transcript_text)
         except FileNotFoundError:
             st.error("プロンプトファイルが見つかりません。`prompts/summary.txt` を確認してください。")
             st.stop()
@@ -82,27 +68,23 @@ if st.button("実行"):
             st.error(f"プロンプトの読み込み中にエラーが発生しました: {e}")
             st.stop()
 
-        # 4. OpenAI API を使用して要約を生成
+        # 4. OpenAI API を使用して要約を生成（生成中のテキストを逐次表示する）
         try:
-            response = client.chat.completions.create(
-                model=st.secrets["openai_model"],
-                messages=[
-                    {"role": "system", "content": "あなたは動画の文字起こしを要約するアシスタントです。"},
-                    {"role": "user", "content": prompt}
-                ],
-                max_tokens=3000,
-                temperature=0.5
-            )
-            st.session_state.summary = response.choices[0].message.content
+            stream_placeholder = st.empty()
+            with stream_placeholder.container():
+                st.session_state.summary = st.write_stream(stream_chat_completion(
+                    messages=messages,
+                    max_tokens=3000,
+                    temperature=0.5
+                ))
+            # 完成した要約は下の「要約結果」に表示する
+            stream_placeholder.empty()
         except Exception as e:
             st.error(f"要約の生成中にエラーが発生しました: {e}")
             st.stop()
 
         # 5. 要約のタイトルを抽出（2行目）
-        try:
-            st.session_state.title = st.session_state.summary.split("\n")[1].strip()
-        except IndexError:
-            st.session_state.title = "要約結果"
+        st.session_state.title = extract_title(st.session_state.summary)
 
     except Exception as e:
         st.error(f"予期しないエラーが発生しました: {e}")
@@ -132,55 +114,31 @@ if st.session_state.summary:
         mime="text/plain",
     )
 
-    # Markdownをプレーンテキストに変換
-    html = markdown.markdown(st.session_state.summary)
-    soup = BeautifulSoup(html, "html.parser")
-    plain_text_summary = soup.get_text()
-
-    # 音声で読み上げる機能を追加
-    tts = gTTS(plain_text_summary, lang='ja')
-    tts.save("summary.mp3")
-
-    audio_file = open("summary.mp3", "rb")
-    audio_bytes = audio_file.read()
-
-    st.audio(audio_bytes, format="audio/mp3")
+    # 音声で読み上げる機能を追加（バックグラウンドで合成し、同じ要約は再合成しない）
+    show_audio_player(st.session_state.summary)
 
-    # 音声ファイルをダウンロード
-    st.download_button(
-        label="要約をダウンロード（音声形式）",
-        data=audio_bytes,
-        file_name="summary.mp3",
-        mime="audio/mp3",
-    )
-
-    # メール送信（任意）
+    # メール送信（任意）。送信はバックグラウンドで行い、同じ要約を同じ宛先に再送しない
     if email:
-        try:
-            with tempfile.NamedTemporaryFile(delete=False) as markdown_temp:
-                markdown_temp.write(markdown_data.getvalue().encode("utf-8"))
-                markdown_temp_path = markdown_temp.name
-
-            with tempfile.NamedTemporaryFile(delete=False) as transcript_temp:
-                transcript_temp.write(transcript_data.getvalue().encode("utf-8"))
-                transcript_temp_path = transcript_temp.name
-
-            yag = yagmail.SMTP(st.secrets["email_user"], st.secrets["email_password"])
+        mail_key = (email, st.session_state.title, st.session_state.summary)
+        if st.session_state.get("summary_mail_key") != mail_key:
             subject = f"動画要約: {st.session_state.title}"  # 件名に要約のタイトルを含める
-            yag.send(
-                to=email,
-                subject=subject,
-                contents=[
-                    st.session_state.summary,
-                    "文字起こしデータを添付しました。"
+            st.session_state.summary_mail = send_mail(
+                st.secrets["email_user"],
+                st.secrets["email_password"],
+                email,
+                subject,
+                f"{st.session_state.summary}\n\n文字起こしデータを添付しました。",
+                [
+                    Attachment(markdown_file_name, markdown_data.getvalue(), "text/markdown"),
+                    Attachment(transcript_file_name, transcript_data.getvalue(), "text/plain"),
                 ],
-                attachments=[markdown_temp_path, transcript_temp_path]
             )
-            st.success(f"要約と文字起こしデータをメール送信しました！件名: {subject}")
-
-            # 一時ファイルを削除
-            os.unlink(markdown_temp_path)
-            os.unlink(transcript_temp_path)
-
-        except Exception as e:
-            st.error(f"メール送信中にエラーが発生しました: {e}")
+            st.session_state.summary_mail_key = mail_key
+            st.session_state.summary_mail_subject = subject
+        show_mail_status(
+            st.session_state.summary_mail,
+            f"要約と文字起こしデータをメール送信しました！件名: {st.session_state.summary_mail_subject}",
+        )
+
+# 処理時間の内訳を表示
+show_run_metrics()
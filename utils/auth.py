@@ -1,16 +1,111 @@
-import streamlit as st
-from streamlit_cookies_manager import EncryptedCookieManager
+import base64
 import hashlib
+import hmac
+import json
+import secrets
 import time
 
-# Initialize cookies manager
-cookies = EncryptedCookieManager(prefix="auth_", password=st.secrets["cookie_password"])  # 安全なキーを使用してください
-if not cookies.ready():
-    st.stop()
+import streamlit as st
+
+from utils.cache import SQLiteCache, cache_path
+from utils.config import get_setting
+
+# トークンの有効期間の既定値（st.secrets で上書き可能）
+DEFAULT_TOKEN_TTL = 30 * 24 * 60 * 60  # 30日間有効
+
+# クッキー名は COOKIE_PREFIX + TOKEN_COOKIE（auth_token）
+COOKIE_PREFIX = "auth_"
+TOKEN_COOKIE = "token"
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload: str) -> str:
+    secret = get_setting("auth_token_secret") or st.secrets["cookie_password"]
+    return _b64encode(hmac.new(secret.encode("utf-8"), payload.encode("ascii"), hashlib.sha256).digest())
+
+
+@st.cache_resource
+def _get_revoked_tokens() -> SQLiteCache:
+    """ログアウトで無効にしたトークンの ID を、トークンの有効期限まで保持するストアを返します。"""
+    return SQLiteCache(cache_path("auth.sqlite3"))
+
 
 # トークン生成
-def generate_token(username: str) -> str:
-    return hashlib.sha256(f"{username}{time.time()}".encode()).hexdigest()
+def generate_token(username: str, ttl: int = None) -> str:
+    """ユーザー名・有効期限・トークンの ID を含む、HMAC-SHA256 で署名したトークンを作成します。"""
+    expiry = int(time.time()) + (ttl or get_setting("auth_token_ttl", DEFAULT_TOKEN_TTL))
+    claims = {"u": username, "exp": expiry, "jti": secrets.token_urlsafe(16)}
+    payload = _b64encode(json.dumps(claims, separators=(",", ":")).encode("utf-8"))
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify_token(token: str):
+    """トークンの署名・有効期限・ユーザー名を検証し、(ユーザー名, 有効期限, トークンの ID) を返します。
+
+    無効な場合（空のトークンや、ログアウトで無効にしたトークンを含む）は None を返します。
+    """
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+        username, expiry, token_id = claims["u"], int(claims["exp"]), str(claims["jti"])
+    except (AttributeError, TypeError, ValueError, KeyError):
+        return None
+    if expiry <= time.time() or username != st.secrets["auth_user"]:
+        return None
+    if _get_revoked_tokens().get(f"revoked:{token_id}") is not None:
+        return None
+    return username, expiry, token_id
+
+
+def revoke_token(token_id: str, expiry: int):
+    """トークンを有効期限まで無効にします（他のタブやブラウザに残ったクッキーも使えなくなります）。"""
+    ttl = expiry - time.time()
+    if ttl > 0:
+        _get_revoked_tokens().set(f"revoked:{token_id}", b"1", ttl=ttl)
+
+
+def _sync_cookie():
+    """ログイン・ログアウトで変更したトークンをクッキーに書き込みます。
+
+    クッキーの書き込みにはブラウザ側のコンポーネントが必要なため、書き込む必要がある
+    ときだけ作成し、準備ができた（コンポーネントが応答した）後の実行で書き込みます。
+    """
+    # CookieManager は未反映の変更をこのキーのセッション状態に保持し、反映されるまで送り直す
+    if "auth_cookie" not in st.session_state and not st.session_state.get("CookieManager.queue"):
+        return
+
+    from streamlit_cookies_manager import CookieManager
+
+    cookies = CookieManager(prefix=COOKIE_PREFIX)
+    if not cookies.ready() or "auth_cookie" not in st.session_state:
+        return
+    # ログアウトでは空の値を書き込む（CookieManager の削除は接頭辞の無い名前では反映されない）
+    cookies[TOKEN_COOKIE] = st.session_state.pop("auth_cookie")
+    cookies.save()
+
+
+def _session_user():
+    """セッションで検証済みのユーザー名を返します。未ログイン・期限切れの場合は None です。"""
+    if st.session_state.get("auth_expiry", 0) > time.time():
+        return st.session_state.get("auth_user")
+    return None
+
+
+def _login(username: str, expiry: int, token_id: str):
+    st.session_state.auth_user = username
+    st.session_state.auth_expiry = expiry
+    st.session_state.auth_token_id = token_id
+    st.session_state.auth_logged_out = False
+
 
 # ログイン処理
 def authenticate():
@@ -20,34 +115,40 @@ def authenticate():
     password = st.text_input("パスワード:", type="password", key="auth_password")
 
     if st.button("ログイン"):
-        if username == st.secrets["auth_user"] and password == st.secrets["auth_pass"]:
+        valid_user = hmac.compare_digest(username.encode("utf-8"), st.secrets["auth_user"].encode("utf-8"))
+        valid_pass = hmac.compare_digest(password.encode("utf-8"), st.secrets["auth_pass"].encode("utf-8"))
+        if valid_user and valid_pass:
             token = generate_token(username)
-            cookies["auth_token"] = token
-            cookies["auth_username"] = username
-            cookies["auth_expiry"] = str(int(time.time()) + 30 * 24 * 60 * 60)  # 30日間有効
-            cookies.save()
-            st.session_state.authenticated = True
+            _login(*verify_token(token))
+            st.session_state.auth_cookie = token
+            _sync_cookie()
             st.success("ログインに成功しました！")
             return True
         else:
             st.error("ユーザー名またはパスワードが間違っています。")
     return False
 
+
 # 認証状態の確認
 def check_authentication():
-    """認証状態を確認し、認証されていない場合はログインフォームを表示します。"""
+    """認証状態を確認し、認証されていない場合はログインフォームを表示します。
+
+    一度検証したトークンの結果はセッション状態に保持し、以降のページではクッキーを
+    確認しません。クッキーはリクエストに含まれる値（st.context.cookies）を読むため、
+    初回の表示でもコンポーネントの応答を待つための再実行は発生しません。
+    """
+    _sync_cookie()
+
     # セッションの状態を確認
-    if "authenticated" in st.session_state and st.session_state.authenticated:
+    if _session_user():
         return
 
-    # クッキーを確認
-    if "auth_token" in cookies:
-        expiry_time_str = cookies.get("auth_expiry", "0")  # デフォルト値を文字列"0"に設定
-        if expiry_time_str and expiry_time_str.isdigit():  # 値がNoneまたは空文字でないか確認
-            expiry_time = int(expiry_time_str)
-            if time.time() < expiry_time:
-                st.session_state.authenticated = True
-                return
+    # クッキーのトークンを確認（ログアウトしたセッションでは、削除前のクッキーを使わない）
+    if not st.session_state.get("auth_logged_out"):
+        verified = verify_token(st.context.cookies.get(COOKIE_PREFIX + TOKEN_COOKIE))
+        if verified:
+            _login(*verified)
+            return
 
     # ログインフォームを表示
     if not authenticate():
@@ -55,13 +156,15 @@ def check_authentication():
 
 
 def logout():
-    """ユーザーをログアウトします。"""
-    # クッキーの値を空文字列に設定して削除
-    cookies["auth_token"] = ""
-    cookies["auth_username"] = ""
-    cookies["auth_expiry"] = ""
-    cookies.save()  # 変更を保存
-    st.session_state.authenticated = False
+    """ユーザーをログアウトし、ログインに使ったトークンを無効にします。"""
+    token_id = st.session_state.pop("auth_token_id", None)
+    expiry = st.session_state.pop("auth_expiry", None)
+    if token_id and expiry:
+        revoke_token(token_id, expiry)
+    st.session_state.pop("auth_user", None)
+    st.session_state.auth_logged_out = True
+    # クッキーのトークンを削除（次の実行で反映）
+    st.session_state.auth_cookie = ""
     st.rerun()
 
 
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+from utils.config import get_setting
+from utils.metrics import record_cache
+
+DEFAULT_CACHE_DIR = ".cache"
+
+
+def cache_path(name: str) -> str:
+    """キャッシュディレクトリ内のファイルパスを返します。ディレクトリが無ければ作成します。"""
+    cache_dir = get_setting("cache_dir", DEFAULT_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+    return os.path.join(cache_dir, name)
+
+
+def make_key(*parts) -> str:
+    """任意の JSON 化できる値からキャッシュキー（SHA-256）を作成します。"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class SQLiteCache:
+    """SQLite に保存する、プロセス間で共有可能なキーバリューキャッシュです。
+
+    エントリごとの有効期限（TTL）と、合計サイズが max_bytes を超えたときの
+    LRU 方式の削除に対応します。ヒット数・ミス数はプロセス内で集計し、
+    ファイル名（拡張子を除く）をキャッシュ名として計測値にも記録します。
+    """
+
+    def __init__(self, path: str, max_bytes: int = None, default_ttl: float = None):
+        self.path = path
+        self.name = os.path.splitext(os.path.basename(path))[0]
+        self.max_bytes = max_bytes
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connect().execute(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+            """
+        )
+        self._connect().execute("CREATE INDEX IF NOT EXISTS entries_accessed_at ON entries (accessed_at)")
+
+    def _connect(self) -> sqlite3.Connection:
+        # sqlite3 の接続はスレッドをまたいで使えないため、スレッドごとに保持する
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+        record_cache(self.name, hit)
+
+    def get(self, key: str):
+        """キーに対応する値を返します。無い場合や期限切れの場合は None を返します。"""
+        now = time.time()
+        connection = self._connect()
+        row = connection.execute("SELECT value, expires_at FROM entries WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] < now):
+            if row is not None:
+                connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            self._count(hit=False)
+            return None
+
+        connection.execute("UPDATE entries SET accessed_at = ? WHERE key = ?", (now, key))
+        self._count(hit=True)
+        return row[0]
+
+    def set(self, key: str, value: bytes, ttl: float = None):
+        """値を保存します。ttl を省略した場合は default_ttl を使用します。"""
+        now = time.time()
+        ttl = self.default_ttl if ttl is None else ttl
+        expires_at = now + ttl if ttl else None
+        self._connect().execute(
+            "INSERT OR REPLACE INTO entries (key, value, size, expires_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+            (key, value, len(value), expires_at, now),
+        )
+        self._evict(now)
+
+    def delete(self, key: str):
+        self._connect().execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def _evict(self, now: float):
+        """期限切れのエントリを削除し、サイズ上限を超えた分を古い順に削除します。"""
+        connection = self._connect()
+        connection.execute("DELETE FROM entries WHERE expires_at IS NOT NULL AND expires_at < ?", (now,))
+        if not self.max_bytes:
+            return
+
+        total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in connection.execute("SELECT key, size FROM entries ORDER BY accessed_at").fetchall():
+            connection.execute("DELETE FROM entries WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self) -> dict:
+        """ヒット数・ミス数・エントリ数・合計サイズを返します。"""
+        entries, size = self._connect().execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
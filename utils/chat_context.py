@@ -0,0 +1,111 @@
+from utils.chunking import context_window, count_tokens, truncate_text
+from utils.config import get_setting
+from utils.llm import create_chat_completion
+
+# 会話履歴の既定値（st.secrets で上書き可能）
+DEFAULT_RECENT_MESSAGES = 8
+DEFAULT_CONTEXT_TOKENS = 8000
+DEFAULT_SUMMARY_TOKENS = 500
+
+# 1 メッセージあたりのロール・区切りなどのオーバーヘッド
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = """以下は、ユーザーとアシスタントの会話の要約と、その続きの会話です。
+続きの会話の内容を要約に統合し、今後の会話に必要な事実・決定事項・ユーザーの要望を落とさずに、
+{max_tokens} トークン以内の簡潔な要約を作成してください。
+
+これまでの要約:
+{summary}
+
+続きの会話:
+{conversation}
+"""
+
+
+def new_context_state() -> dict:
+    """会話履歴の要約状態（要約済みのメッセージ数と要約文）を作成します。"""
+    return {"summary": "", "folded": 0}
+
+
+def _message_tokens(message: dict, model: str = None) -> int:
+    return count_tokens(message["content"], model) + MESSAGE_OVERHEAD_TOKENS
+
+
+def _budget(model: str = None) -> int:
+    """1 回のリクエストに含める会話履歴のトークン数の上限を返します。"""
+    configured = get_setting("chat_context_tokens", DEFAULT_CONTEXT_TOKENS)
+    # 応答の生成分としてコンテキストの半分は空けておく
+    return min(configured, context_window(model) // 2)
+
+
+def _summary_message(summary: str) -> dict:
+    return {"role": "system", "content": f"これまでの会話の要約:\n{summary}"}
+
+
+def _fold(summary: str, messages: list, max_tokens: int, budget: int, model: str = None) -> str:
+    """要約に messages の内容を統合した新しい要約を作成します。
+
+    統合する会話が長い場合は、上限に収まる単位に分けて順に統合します。
+    """
+    batch = []
+    batch_tokens = 0
+    for message in messages + [None]:
+        tokens = _message_tokens(message, model) if message else 0
+        if batch and (message is None or batch_tokens + tokens > budget):
+            conversation = "\n".join(f"{m['role']}: {m['content']}" for m in batch)
+            response = create_chat_completion(
+                messages=[
+                    {"role": "system", "content": "あなたは会話履歴を要約するアシスタントです。"},
+                    {"role": "user", "content": SUMMARY_PROMPT.format(
+                        max_tokens=max_tokens,
+                        summary=summary or "（なし）",
+                        conversation=conversation,
+                    )},
+                ],
+                max_tokens=max_tokens,
+                temperature=0)
+            summary = response.choices[0].message.content
+            batch = []
+            batch_tokens = 0
+        if message:
+            batch.append(message)
+            batch_tokens += tokens
+    return summary
+
+
+def prepare_messages(messages: list, state: dict, model: str = None) -> list:
+    """トークン数の上限に収まるように、API に送信するメッセージを組み立てます。
+
+    直近のメッセージはそのまま残し、それより古いメッセージは state の要約に
+    少しずつ統合します。直近のメッセージだけで上限を超える場合は、古いものから
+    要約に回します。state は new_context_state で作成し、セッション状態に保持してください。
+    """
+    budget = _budget(model)
+    summary_tokens = get_setting("chat_summary_tokens", DEFAULT_SUMMARY_TOKENS)
+    recent_count = get_setting("chat_recent_messages", DEFAULT_RECENT_MESSAGES)
+
+    # 直近のメッセージのうち、上限に収まる範囲を求める
+    split = max(state["folded"], len(messages) - recent_count)
+    while split < len(messages) - 1:
+        reserved = summary_tokens + MESSAGE_OVERHEAD_TOKENS if split > 0 else 0
+        if reserved + sum(_message_tokens(m, model) for m in messages[split:]) <= budget:
+            break
+        split += 1
+
+    # 新たに範囲外になったメッセージを要約に統合する。毎ターン要約し直さないよう、
+    # 統合するときは直近の件数が半分になるまでまとめて統合する
+    if split > state["folded"]:
+        split = min(max(split, len(messages) - recent_count // 2), len(messages) - 1)
+        state["summary"] = _fold(state["summary"], messages[state["folded"]:split], summary_tokens, budget, model)
+        state["folded"] = split
+
+    request = [_summary_message(state["summary"])] if state["summary"] else []
+    request.extend(messages[split:])
+
+    # 最新のメッセージだけで上限を超える場合は切り詰める
+    overflow = sum(_message_tokens(m, model) for m in request) - budget
+    if overflow > 0:
+        last = request[-1]
+        max_tokens = max(1, count_tokens(last["content"], model) - overflow)
+        request[-1] = {**last, "content": truncate_text(last["content"], max_tokens, model)}
+    return request
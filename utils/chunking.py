@@ -0,0 +1,248 @@
+import functools
+import math
+import re
+import zlib
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken が無い環境では文字種から概算する
+    tiktoken = None
+
+from utils.config import get_setting
+
+# モデルごとのコンテキスト長（トークン数）。前方一致で判定します。
+MODEL_CONTEXT_WINDOWS = {
+    "gpt-4.1": 1047576,
+    "gpt-4o": 128000,
+    "gpt-4-turbo": 128000,
+    "gpt-4-32k": 32768,
+    "gpt-4": 8192,
+    "gpt-3.5-turbo": 16385,
+    "o1": 200000,
+    "o3": 200000,
+    "o4": 200000,
+}
+DEFAULT_CONTEXT_WINDOW = 128000
+
+# 段落（空行・改ページ）と文の区切り。区切り文字と後続の空白はチャンク側に残す
+PARAGRAPH_RE = re.compile(r".*?(?:\n[ \t]*\n\s*|\f\s*|$)", re.S)
+SENTENCE_RE = re.compile(r".*?(?:[。！？]+[」』）)]*|[.!?]+(?=\s)|\n|$)\s*", re.S)
+# 内容に基づいて区切る場合に、区切りとみなす単位の割合（1 / BOUNDARY_MODULUS）
+BOUNDARY_MODULUS = 4
+# 句読点の無い長い文を内容に基づいて区切る場合の、ハッシュを求める語の数と
+# 区切りの平均的な間隔（max_tokens に対する割合、1 / PIECE_DIVISOR）
+ROLLING_WINDOW = 8
+PIECE_DIVISOR = 32
+
+CJK_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿＀-￯]")
+# 語（CJK は 1 文字ずつ）と後続の空白
+WORD_RE = re.compile(r"[぀-ヿ㐀-䶿一-鿿＀-￯]\s*|[^\s぀-ヿ㐀-䶿一-鿿＀-￯]+\s*|\s+")
+
+
+@functools.lru_cache(maxsize=None)
+def _encoding(model: str):
+    """モデルに対応する tiktoken のエンコーディングを返します。取得できない場合は None です。"""
+    if tiktoken is None:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        pass
+    except Exception:
+        # エンコーディングファイルを取得できない（オフライン）場合
+        return None
+    try:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception:
+        return None
+
+
+def _model(model: str = None) -> str:
+    return model or get_setting("openai_model", "gpt-4o")
+
+
+def count_tokens(text: str, model: str = None) -> int:
+    """テキストのトークン数を返します。
+
+    tiktoken が使えない場合は、日本語などの CJK 文字を 1 文字 1 トークン、
+    それ以外を 4 文字 1 トークンとして概算します。
+    """
+    encoding = _encoding(_model(model))
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk = len(CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def context_window(model: str = None) -> int:
+    """モデルのコンテキスト長を返します。st.secrets の model_context_window を優先します。"""
+    configured = get_setting("model_context_window")
+    if configured:
+        return int(configured)
+    model = _model(model)
+    for prefix in sorted(MODEL_CONTEXT_WINDOWS, key=len, reverse=True):
+        if model.startswith(prefix):
+            return MODEL_CONTEXT_WINDOWS[prefix]
+    return DEFAULT_CONTEXT_WINDOW
+
+
+def completion_max_tokens(messages: list, desired: int, model: str = None, margin: int = 256) -> int:
+    """プロンプトの長さから、コンテキストに収まる max_tokens を求めます。"""
+    prompt_tokens = sum(count_tokens(message["content"], model) + 4 for message in messages)
+    available = context_window(model) - prompt_tokens - margin
+    return max(1, min(desired, available))
+
+
+def _hard_split(text: str, max_tokens: int, model: str) -> list:
+    """区切りの無い長い文をトークン数で機械的に分割します。"""
+    encoding = _encoding(_model(model))
+    if encoding is not None:
+        tokens = encoding.encode(text, disallowed_special=())
+        return [encoding.decode(tokens[i:i + max_tokens]) for i in range(0, len(tokens), max_tokens)]
+
+    chars_per_token = len(text) / max(1, count_tokens(text, model))
+    step = max(1, int(max_tokens * chars_per_token))
+    return [text[i:i + step] for i in range(0, len(text), step)]
+
+
+def _content_split(text: str, max_tokens: int, model: str) -> list:
+    """区切りの無い長い文を、語の並びのローリングハッシュで決めた位置で分割します。
+
+    直前 ROLLING_WINDOW 語のハッシュが条件を満たす語の直後で区切るため、区切り位置は
+    文の先頭からの距離に依存せず、編集箇所から離れた部分は同じ断片になります。
+    条件を満たさないまま max_tokens に達した場合はそこで区切ります。
+    """
+    modulus = max(1, max_tokens // PIECE_DIVISOR)
+    base = 257
+    mask = (1 << 61) - 1
+    base_power = pow(base, ROLLING_WINDOW, mask)
+
+    pieces = []
+    words = WORD_RE.findall(text)
+    window = []
+    rolling = 0
+    start = 0
+    piece_tokens = 0
+    for i, word in enumerate(words):
+        value = zlib.crc32(word.strip().encode("utf-8"))
+        window.append(value)
+        rolling = (rolling * base + value) % mask
+        if len(window) > ROLLING_WINDOW:
+            rolling = (rolling - window.pop(0) * base_power) % mask
+
+        tokens = count_tokens(word, model)
+        if piece_tokens and piece_tokens + tokens > max_tokens:
+            pieces.append("".join(words[start:i]))
+            start = i
+            piece_tokens = 0
+        piece_tokens += tokens
+        if rolling % modulus == 0:
+            pieces.append("".join(words[start:i + 1]))
+            start = i + 1
+            piece_tokens = 0
+
+    if start < len(words):
+        pieces.append("".join(words[start:]))
+    # 1 語で max_tokens を超える場合（区切りの無い長い英数字など）は機械的に分割する
+    return [part for piece in pieces for part in
+            ([piece] if count_tokens(piece, model) <= max_tokens else _hard_split(piece, max_tokens, model))]
+
+
+def truncate_text(text: str, max_tokens: int, model: str = None) -> str:
+    """テキストを先頭から max_tokens 以内に切り詰めます。"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    return _hard_split(text, max_tokens, model)[0]
+
+
+def _split_units(text: str, max_tokens: int, model: str, split=_hard_split) -> list:
+    """段落 → 文 → トークンの順に、max_tokens 以下の単位へ分割します。
+
+    max_tokens を超える文は split(文, max_tokens, model) で分割します。
+    """
+    units = []
+    for paragraph in filter(None, PARAGRAPH_RE.findall(text)):
+        tokens = count_tokens(paragraph, model)
+        if tokens <= max_tokens:
+            units.append((paragraph, tokens))
+            continue
+        for sentence in filter(None, SENTENCE_RE.findall(paragraph)):
+            tokens = count_tokens(sentence, model)
+            if tokens <= max_tokens:
+                units.append((sentence, tokens))
+            else:
+                units.extend((part, count_tokens(part, model)) for part in split(sentence, max_tokens, model))
+    return units
+
+
+def _pack(units: list, max_tokens: int, overlap_tokens: int, is_boundary=None) -> list:
+    """単位を順に max_tokens 以下のチャンクに詰めます。
+
+    is_boundary(単位, チャンクのトークン数) が真を返した単位の直後でもチャンクを区切ります。
+    """
+    chunks = []
+    current = []
+    current_tokens = 0
+    # 直前のチャンクから重複させた単位の数（これだけのチャンクは出力しない）
+    carried = 0
+
+    def flush():
+        nonlocal current, current_tokens, carried
+        chunks.append("".join(u for u, _ in current))
+
+        # 重複させる末尾の単位を残す
+        overlap = []
+        overlap_size = 0
+        for previous in reversed(current):
+            if overlap_size + previous[1] > overlap_tokens:
+                break
+            overlap.insert(0, previous)
+            overlap_size += previous[1]
+        current = overlap
+        current_tokens = overlap_size
+        carried = len(overlap)
+
+    for unit, tokens in units:
+        if current_tokens + tokens > max_tokens:
+            if len(current) > carried:
+                flush()
+            # 重複分を含めると収まらない場合は、重複を古いものから減らす
+            while carried and current_tokens + tokens > max_tokens:
+                current_tokens -= current.pop(0)[1]
+                carried -= 1
+
+        current.append((unit, tokens))
+        current_tokens += tokens
+        if is_boundary is not None and is_boundary(unit, current_tokens):
+            flush()
+
+    if len(current) > carried and any(u.strip() for u, _ in current[carried:]):
+        chunks.append("".join(u for u, _ in current))
+    return chunks
+
+
+def chunk_text(text: str, max_tokens: int, overlap_tokens: int = 0, model: str = None) -> list:
+    """テキストをトークン数に基づいて分割します。
+
+    段落・改ページ・文の区切りを優先して max_tokens 以下のチャンクに詰め、
+    overlap_tokens を指定すると直前のチャンク末尾の文を次のチャンクの先頭に含めます。
+    空白や改行は元のテキストのまま保持します。
+    """
+    return _pack(_split_units(text, max_tokens, model), max_tokens, overlap_tokens)
+
+
+def chunk_text_stable(text: str, max_tokens: int, overlap_tokens: int = 0, model: str = None) -> list:
+    """テキストの内容から区切り位置を決めて分割します（content-defined chunking）。
+
+    チャンクが max_tokens の 3/4 以上になった後、内容のハッシュが条件を満たす文・段落の
+    直後で区切ります。句読点の無い文字起こしのように max_tokens を超える文は、
+    語の並びのローリングハッシュで決めた位置で細かく分割してから詰めます。
+    一部を編集したテキストでも編集箇所以外のチャンクは同じ内容になりやすいため、
+    チャンク単位で結果を再利用する処理に向いています。
+    """
+    min_tokens = max_tokens * 3 // 4
+
+    def is_boundary(unit: str, current_tokens: int) -> bool:
+        return current_tokens >= min_tokens and zlib.crc32(unit.strip().encode("utf-8")) % BOUNDARY_MODULUS == 0
+
+    return _pack(_split_units(text, max_tokens, model, _content_split), max_tokens, overlap_tokens, is_boundary)
@@ -0,0 +1,26 @@
+import os
+
+import streamlit as st
+
+
+def get_setting(key: str, default=None):
+    """設定値を st.secrets から取得します。
+
+    st.secrets に無い場合は環境変数（キーを大文字にしたもの）を参照し、
+    どちらにも無ければ既定値を返します。環境変数の値は既定値の型に変換します。
+    """
+    try:
+        if key in st.secrets:
+            return st.secrets[key]
+    except FileNotFoundError:
+        # secrets.toml が存在しない環境（CLI 実行など）
+        pass
+
+    value = os.environ.get(key.upper())
+    if value is None:
+        return default
+    if isinstance(default, bool):
+        return value.lower() in ("1", "true", "yes", "on")
+    if default is not None:
+        return type(default)(value)
+    return value
@@ -0,0 +1,151 @@
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from bs4 import BeautifulSoup, Comment
+
+from utils.chunking import chunk_text, completion_max_tokens
+from utils.config import get_setting
+from utils.llm import create_chat_completion
+from utils.metrics import propagate, timed_function
+from utils.prompts import render_prompt
+
+# 本文抽出の既定値（st.secrets で上書き可能）
+DEFAULT_MIN_CONFIDENCE = 0.5
+DEFAULT_CHUNK_TOKENS = 6000
+DEFAULT_MAX_WORKERS = 4
+
+# 本文とみなす最小の文字数（これ未満は確信度を下げる）
+MIN_CONTENT_CHARS = 500
+
+# 本文に不要な要素
+BOILERPLATE_TAGS = ["script", "style", "noscript", "svg", "canvas", "iframe", "form", "button", "nav", "header", "footer", "aside", "template"]
+# 段落として扱う要素
+BLOCK_TAGS = ["p", "div", "section", "article", "main", "li", "ul", "ol", "pre", "blockquote", "table", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "br", "dd", "dt"]
+PARAGRAPH_TAGS = ["p", "pre", "blockquote", "td", "dd"]
+
+POSITIVE_RE = re.compile(r"article|body|content|entry|main|post|story|text|honbun|kiji", re.I)
+NEGATIVE_RE = re.compile(r"comment|footer|sidebar|side|nav|menu|banner|share|social|related|ranking|widget|ad-|ads|promo|breadcrumb|pager", re.I)
+PUNCTUATION_RE = re.compile(r"[、。，．,.!?！？]")
+
+
+def clean_html(html: str) -> BeautifulSoup:
+    """スクリプト・スタイル・ナビゲーションなどの定型要素とコメントを取り除きます。"""
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup.find_all(BOILERPLATE_TAGS):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda s: isinstance(s, Comment)):
+        comment.extract()
+    return soup
+
+
+def _class_weight(tag) -> int:
+    names = " ".join(tag.get("class", [])) + " " + (tag.get("id") or "")
+    weight = 0
+    if POSITIVE_RE.search(names):
+        weight += 25
+    if NEGATIVE_RE.search(names):
+        weight -= 25
+    if tag.name in ("article", "main"):
+        weight += 25
+    return weight
+
+
+def _link_density(tag) -> float:
+    text_length = len(tag.get_text(strip=True))
+    if not text_length:
+        return 1.0
+    link_length = sum(len(a.get_text(strip=True)) for a in tag.find_all("a"))
+    return min(1.0, link_length / text_length)
+
+
+def _block_text(tag) -> str:
+    """要素のテキストを、段落ごとに改行を入れて取り出します。"""
+    for block in tag.find_all(BLOCK_TAGS):
+        block.insert_before("\n")
+        block.insert_after("\n")
+    lines = (re.sub(r"[ \t　]+", " ", line).strip() for line in tag.get_text().splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+@timed_function("html_extract")
+def extract_main_text(html: str):
+    """HTML から本文らしい部分をローカルで抽出し、(本文, 確信度 0〜1) を返します。
+
+    段落ごとの文字数・句読点の数を親要素に加点し、class/id とリンクの割合で
+    補正した得点が最も高い要素を本文とみなします（Readability と同様の方式）。
+    """
+    soup = clean_html(html)
+    scores = {}
+    for paragraph in soup.find_all(PARAGRAPH_TAGS):
+        text = paragraph.get_text(" ", strip=True)
+        if len(text) < 25:
+            continue
+        score = 1 + len(PUNCTUATION_RE.findall(text)) + min(len(text) / 100, 3)
+        parent = paragraph.parent
+        grandparent = parent.parent if parent is not None else None
+        for ancestor, share in ((parent, 1.0), (grandparent, 0.5)):
+            if ancestor is None or ancestor.name in (None, "[document]"):
+                continue
+            if id(ancestor) not in scores:
+                scores[id(ancestor)] = [ancestor, _class_weight(ancestor)]
+            scores[id(ancestor)][1] += score * share
+
+    if not scores:
+        body = soup.body or soup
+        return _block_text(body), 0.0
+
+    best, best_score = max(
+        ((tag, score * (1 - _link_density(tag))) for tag, score in scores.values()),
+        key=lambda item: item[1],
+    )
+    link_density = _link_density(best)
+    text = _block_text(best)
+    confidence = min(1.0, len(text) / MIN_CONTENT_CHARS) * (1 - link_density)
+    return text, confidence
+
+
+def extract_main_content(html: str, prompt_name: str) -> str:
+    """OpenAI API を使用して本文を抽出します。"""
+    prompt = render_prompt(prompt_name, html=html)
+
+    messages = [
+        {"role": "system", "content": "You are a highly skilled web content extractor."},
+        {"role": "user", "content": prompt}
+    ]
+    response = create_chat_completion(
+    messages=messages,
+    temperature=0.5,
+    max_tokens=completion_max_tokens(messages, 3000))
+    return response.choices[0].message.content
+
+
+def _strip_attributes(soup: BeautifulSoup) -> str:
+    """LLM に渡す HTML から属性を取り除き、トークン数を減らします。"""
+    for tag in soup.find_all(True):
+        tag.attrs = {}
+    return str(soup)
+
+
+def extract_article(html: str, prompt_name: str) -> str:
+    """HTML から本文を抽出します。
+
+    まずローカルで抽出し、確信度が extract_min_confidence 未満の場合のみ、
+    定型要素を除いた HTML を分割して LLM で並列に抽出します。
+    """
+    text, confidence = extract_main_text(html)
+    if text and confidence >= get_setting("extract_min_confidence", DEFAULT_MIN_CONFIDENCE):
+        return text
+
+    chunks = chunk_text(
+        _strip_attributes(clean_html(html)),
+        max_tokens=get_setting("extract_chunk_tokens", DEFAULT_CHUNK_TOKENS),
+    )
+    if not chunks:
+        return text
+    if len(chunks) == 1:
+        return extract_main_content(chunks[0], prompt_name)
+
+    max_workers = min(get_setting("extract_max_workers", DEFAULT_MAX_WORKERS), len(chunks))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        parts = executor.map(propagate(lambda chunk: extract_main_content(chunk, prompt_name)), chunks)
+        return "\n".join(parts)
@@ -0,0 +1,181 @@
+import io
+import json
+import re
+import struct
+import time
+from collections import namedtuple
+
+import requests
+import streamlit as st
+from charset_normalizer import from_bytes
+from requests.adapters import HTTPAdapter, Retry
+
+from utils.cache import SQLiteCache, cache_path
+from utils.config import get_setting
+from utils.metrics import timed_function
+
+# HTTP 取得の既定値（st.secrets で上書き可能）
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 30.0
+DEFAULT_MAX_BYTES = 20 * 1024 * 1024
+DEFAULT_CACHE_MAX_BYTES = 1024 * 1024 * 1024
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.0.0 Safari/537.36"
+META_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([A-Za-z0-9_\-]+)""", re.I)
+MAX_AGE_RE = re.compile(r"max-age=(\d+)")
+
+FetchResult = namedtuple("FetchResult", ["url", "status", "headers", "content", "from_cache"])
+
+
+class ResponseTooLarge(requests.exceptions.RequestException):
+    """レスポンスがサイズの上限を超えた場合に送出されます。"""
+
+
+@st.cache_resource
+def get_session() -> requests.Session:
+    """プロセス全体で共有する、接続プールとリトライ設定付きのセッションを返します。"""
+    session = requests.Session()
+    retries = Retry(
+        total=3,
+        backoff_factor=1,
+        status_forcelist=[500, 502, 503, 504]
+    )
+    pool_size = get_setting("http_pool_size", DEFAULT_POOL_SIZE)
+    adapter = HTTPAdapter(max_retries=retries, pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers.update({
+        "User-Agent": USER_AGENT,
+        "Accept-Encoding": "gzip, deflate",
+    })
+    return session
+
+
+@st.cache_resource
+def get_http_cache() -> SQLiteCache:
+    """URL をキーにしたレスポンスのキャッシュを返します。"""
+    return SQLiteCache(
+        cache_path("http.sqlite3"),
+        max_bytes=get_setting("http_cache_max_bytes", DEFAULT_CACHE_MAX_BYTES),
+    )
+
+
+def _pack(meta: dict, content: bytes) -> bytes:
+    meta_bytes = json.dumps(meta).encode("utf-8")
+    return struct.pack(">I", len(meta_bytes)) + meta_bytes + content
+
+
+def _unpack(value: bytes):
+    (length,) = struct.unpack(">I", value[:4])
+    return json.loads(value[4:4 + length].decode("utf-8")), value[4 + length:]
+
+
+def _read_body(response: requests.Response, max_bytes: int) -> bytes:
+    """レスポンス本文を読み込みます。max_bytes を超えた時点で ResponseTooLarge を送出します。"""
+    length = response.headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise ResponseTooLarge(f"レスポンスが大きすぎます（{int(length)} バイト）。上限は {max_bytes} バイトです。")
+
+    buffer = io.BytesIO()
+    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+        buffer.write(chunk)
+        if buffer.tell() > max_bytes:
+            raise ResponseTooLarge(f"レスポンスが上限の {max_bytes} バイトを超えました。")
+    return buffer.getvalue()
+
+
+def _expires_at(headers) -> float:
+    cache_control = headers.get("Cache-Control", "")
+    match = MAX_AGE_RE.search(cache_control)
+    if match and "no-cache" not in cache_control:
+        return time.time() + int(match.group(1))
+    return 0
+
+
+@timed_function("http_fetch")
+def fetch(url: str, max_bytes: int = None) -> FetchResult:
+    """URL の内容を取得します。
+
+    共有セッションで接続を再利用し、タイムアウトとサイズの上限を設定します。
+    ETag / Last-Modified を持つレスポンスはディスクにキャッシュし、次回は条件付き
+    リクエストを送って 304 の場合はキャッシュを返します（max-age 内は問い合わせません）。
+    """
+    if max_bytes is None:
+        max_bytes = get_setting("http_max_bytes", DEFAULT_MAX_BYTES)
+    cache = get_http_cache()
+    cached = cache.get(url)
+
+    headers = {}
+    if cached is not None:
+        meta, content = _unpack(cached)
+        if meta.get("expires_at", 0) > time.time():
+            return FetchResult(url, 200, meta["headers"], content, True)
+        if meta["headers"].get("ETag"):
+            headers["If-None-Match"] = meta["headers"]["ETag"]
+        if meta["headers"].get("Last-Modified"):
+            headers["If-Modified-Since"] = meta["headers"]["Last-Modified"]
+
+    timeout = (
+        get_setting("http_connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+        get_setting("http_read_timeout", DEFAULT_READ_TIMEOUT),
+    )
+    with get_session().get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304 and cached is not None:
+            meta["expires_at"] = _expires_at(response.headers)
+            cache.set(url, _pack(meta, content))
+            return FetchResult(url, 200, meta["headers"], content, True)
+
+        response.raise_for_status()
+        content = _read_body(response, max_bytes)
+        response_headers = {
+            key: response.headers[key]
+            for key in ("Content-Type", "ETag", "Last-Modified", "Cache-Control")
+            if key in response.headers
+        }
+
+    cache_control = response_headers.get("Cache-Control", "")
+    expires_at = _expires_at(response_headers)
+    if "no-store" not in cache_control and (
+        "ETag" in response_headers or "Last-Modified" in response_headers or expires_at
+    ):
+        cache.set(url, _pack({"headers": response_headers, "expires_at": expires_at}, content))
+    return FetchResult(url, response.status_code, response_headers, content, False)
+
+
+def decode_content(content: bytes, content_type: str = "") -> str:
+    """文字コードを判定してテキストに変換します。
+
+    Content-Type の charset、HTML の meta タグ、UTF-8、自動判定の順に試します。
+    """
+    candidates = []
+    match = re.search(r"charset=([\w\-]+)", content_type or "", re.I)
+    if match:
+        candidates.append(match.group(1))
+    match = META_CHARSET_RE.search(content[:4096])
+    if match:
+        candidates.append(match.group(1).decode("ascii"))
+    candidates.append("utf-8")
+
+    for encoding in candidates:
+        try:
+            return content.decode(encoding)
+        except (LookupError, UnicodeDecodeError):
+            continue
+
+    best = from_bytes(content).best()
+    if best is not None:
+        return str(best)
+    return content.decode("utf-8", errors="replace")
+
+
+def fetch_text(url: str, max_bytes: int = None) -> str:
+    """URL の内容を取得し、文字コードを判定したテキストとして返します。"""
+    result = fetch(url, max_bytes=max_bytes)
+    return decode_content(result.content, result.headers.get("Content-Type", ""))
+
+
+def fetch_bytes(url: str, max_bytes: int = None) -> bytes:
+    """URL の内容をバイト列として返します。"""
+    return fetch(url, max_bytes=max_bytes).content
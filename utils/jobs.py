@@ -0,0 +1,308 @@
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+import streamlit as st
+
+from utils.cache import SQLiteCache, cache_path
+from utils.config import get_setting
+from utils.metrics import current_run, propagate, render_run_summary, run_context
+
+# ジョブ実行の既定値（st.secrets で上書き可能）
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_STAGE_TIMEOUT = 600
+DEFAULT_RESULT_TTL = 7 * 24 * 60 * 60
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE_STATUSES = (PENDING, RUNNING)
+
+STATUS_LABELS = {
+    PENDING: "待機中",
+    RUNNING: "実行中",
+    DONE: "完了",
+    FAILED: "失敗",
+    CANCELLED: "キャンセル",
+}
+
+
+class JobCancelled(Exception):
+    """ジョブがキャンセルされた場合に送出されます。"""
+
+
+class StageTimeout(Exception):
+    """ジョブの段階（ステージ）が制限時間内に終わらなかった場合に送出されます。"""
+
+
+class Job:
+    """バックグラウンドで実行するジョブの状態です。
+
+    ジョブの関数には第 1 引数としてこのオブジェクトが渡され、update・add_partial で
+    進捗や途中結果を報告し、run_stage で制限時間付きの処理を実行します。
+    """
+
+    def __init__(self, name: str, job_id: str = None, dedupe_key: str = None):
+        self.id = job_id or uuid.uuid4().hex
+        self.name = name
+        self.status = PENDING
+        self.progress = 0.0
+        self.message = ""
+        self.partial = []
+        self.result = None
+        self.error = None
+        self.metrics = None
+        self.dedupe_key = dedupe_key
+        self.created_at = time.time()
+        self.finished_at = None
+        self._cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def update(self, progress: float = None, message: str = None):
+        """進捗（0〜1）とメッセージを更新します。キャンセルされていれば JobCancelled を送出します。"""
+        self.check_cancelled()
+        with self._lock:
+            if progress is not None:
+                self.progress = min(max(progress, 0.0), 1.0)
+            if message is not None:
+                self.message = message
+
+    def add_partial(self, item):
+        """途中結果を追加します。"""
+        with self._lock:
+            self.partial.append(item)
+
+    def set_partial(self, items: list):
+        """途中結果をまとめて置き換えます。"""
+        with self._lock:
+            self.partial = list(items)
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel_event.is_set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.id)
+
+    def run_stage(self, name: str, fn, *args, timeout: float = None, **kwargs):
+        """fn を別スレッドで実行し、制限時間とキャンセルを監視しながら結果を待ちます。
+
+        制限時間を超えた場合は StageTimeout、キャンセルされた場合は JobCancelled を送出します
+        （実行中の fn は中断できないため、結果を破棄します）。
+        """
+        if timeout is None:
+            timeout = get_setting("job_stage_timeout", DEFAULT_STAGE_TIMEOUT)
+        self.update(message=name)
+        future = _get_runner().stage_executor.submit(propagate(fn), *args, **kwargs)
+        deadline = time.monotonic() + timeout
+        while True:
+            self.check_cancelled()
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                future.cancel()
+                raise StageTimeout(f"{name} が {timeout} 秒以内に終わりませんでした。")
+            try:
+                return future.result(timeout=min(remaining, 0.5))
+            except FutureTimeoutError:
+                continue
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "id": self.id,
+                "name": self.name,
+                "status": self.status,
+                "progress": self.progress,
+                "message": self.message,
+                "partial": list(self.partial),
+                "result": self.result,
+                "error": self.error,
+                "metrics": self.metrics,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+            }
+
+
+class _JobRunner:
+    """プロセス全体で共有するジョブのワーカープールと、終了したジョブの保存先です。"""
+
+    def __init__(self, max_workers: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.stage_executor = ThreadPoolExecutor(max_workers=max_workers * 4, thread_name_prefix="job-stage")
+        self.jobs = {}
+        self.keys = {}
+        self.lock = threading.Lock()
+        self.store = SQLiteCache(cache_path("jobs.sqlite3"))
+
+    def submit(self, name: str, fn, *args, dedupe_key: str = None, **kwargs) -> str:
+        with self.lock:
+            if dedupe_key is not None:
+                existing = self._find(dedupe_key)
+                if existing is not None:
+                    return existing
+            job = Job(name, dedupe_key=dedupe_key)
+            self.jobs[job.id] = job
+            if dedupe_key is not None:
+                self.keys[dedupe_key] = job.id
+        # ジョブの計測は、投入したページの名前で記録する
+        run = current_run()
+        self.executor.submit(self._run, job, run.page if run else name, fn, args, kwargs)
+        return job.id
+
+    def _find(self, dedupe_key: str):
+        """同じキーで実行中、または完了したジョブの ID を返します（self.lock を取得して呼び出す）。"""
+        job_id = self.keys.get(dedupe_key)
+        if job_id in self.jobs:
+            return job_id
+        stored = self.store.get(f"key:{dedupe_key}")
+        if stored is not None:
+            job_id = stored.decode("utf-8")
+            snapshot = self.store.get(job_id)
+            if snapshot is not None and json.loads(snapshot.decode("utf-8"))["status"] == DONE:
+                return job_id
+        return None
+
+    def _run(self, job: Job, page: str, fn, args, kwargs):
+        if job.cancelled:
+            job.status = CANCELLED
+        else:
+            job.status = RUNNING
+            with run_context(page) as run:
+                try:
+                    job.result = fn(job, *args, **kwargs)
+                    job.status = DONE
+                    job.progress = 1.0
+                except JobCancelled:
+                    job.status = CANCELLED
+                except Exception as e:
+                    job.status = FAILED
+                    job.error = str(e)
+            job.metrics = run.summary()
+        job.finished_at = time.time()
+
+        # 終了したジョブは後から開けるように保存し、メモリからは取り除く
+        snapshot = job.snapshot()
+        snapshot["partial"] = []
+        ttl = get_setting("job_result_ttl", DEFAULT_RESULT_TTL)
+        self.store.set(job.id, json.dumps(snapshot, ensure_ascii=False, default=str).encode("utf-8"), ttl=ttl)
+        # 完了したジョブだけを同じキーの結果として再利用する（失敗・キャンセルは再実行できるように）
+        if job.dedupe_key is not None and job.status == DONE:
+            self.store.set(f"key:{job.dedupe_key}", job.id.encode("utf-8"), ttl=ttl)
+        with self.lock:
+            self.jobs.pop(job.id, None)
+            if job.dedupe_key is not None and self.keys.get(job.dedupe_key) == job.id:
+                del self.keys[job.dedupe_key]
+
+    def get(self, job_id: str):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            return job.snapshot()
+        stored = self.store.get(job_id)
+        if stored is None:
+            return None
+        return json.loads(stored.decode("utf-8"))
+
+    def cancel(self, job_id: str):
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is not None:
+            job.cancel()
+
+
+@st.cache_resource
+def _get_runner() -> _JobRunner:
+    return _JobRunner(max_workers=get_setting("job_max_workers", DEFAULT_MAX_WORKERS))
+
+
+def submit_job(name: str, fn, *args, dedupe_key: str = None, **kwargs) -> str:
+    """fn(job, *args, **kwargs) をバックグラウンドで実行し、ジョブ ID を返します。
+
+    dedupe_key を指定すると、同じキーのジョブが実行中または完了済みの場合は
+    新たに実行せず、そのジョブの ID を返します。
+    """
+    return _get_runner().submit(name, fn, *args, dedupe_key=dedupe_key, **kwargs)
+
+
+def get_job(job_id: str):
+    """ジョブの状態を dict で返します。見つからない場合は None を返します。
+
+    実行中のジョブはメモリから、終了したジョブは保存された結果から取得します。
+    """
+    return _get_runner().get(job_id)
+
+
+def cancel_job(job_id: str):
+    """実行中のジョブにキャンセルを要求します。"""
+    _get_runner().cancel(job_id)
+
+
+def remember_job(key: str, job_id: str):
+    """ジョブ ID をセッション状態と URL のクエリパラメータに保存します。
+
+    URL に残すことで、ブラウザを再読み込みしても同じジョブの結果を開けます。
+    """
+    st.session_state[key] = job_id
+    st.query_params[key] = job_id
+
+
+def recall_job(key: str):
+    """remember_job で保存したジョブ ID を返します。"""
+    job_id = st.session_state.get(key) or st.query_params.get(key)
+    if job_id:
+        st.session_state[key] = job_id
+    return job_id
+
+
+def forget_job(key: str):
+    st.session_state.pop(key, None)
+    if key in st.query_params:
+        del st.query_params[key]
+
+
+@st.fragment(run_every=1)
+def _poll_job_progress(job_id: str, render_partial=None):
+    """実行中のジョブの進捗を 1 秒ごとに更新し、終了したらページ全体を再実行します。"""
+    job = get_job(job_id)
+    if job is None or job["status"] not in ACTIVE_STATUSES:
+        st.rerun()
+
+    label = f"{job['name']}（{STATUS_LABELS[job['status']]}）: {job['message']}"
+    st.progress(job["progress"], text=label)
+    if render_partial and job["partial"]:
+        render_partial(job["partial"])
+    if st.button("キャンセル", key=f"cancel_job_{job_id}"):
+        cancel_job(job_id)
+
+
+def show_job_progress(job_id: str, render_partial=None):
+    """ジョブの進捗を表示します。
+
+    実行中は進捗と途中結果（render_partial で描画）の部分だけを 1 秒ごとに再実行して
+    更新し、終了したらページ全体を再実行して結果を表示できるようにします。
+    """
+    job = get_job(job_id)
+    if job is None:
+        st.warning("ジョブが見つかりません。期限切れの可能性があります。")
+        return
+
+    if job["status"] in ACTIVE_STATUSES:
+        _poll_job_progress(job_id, render_partial)
+        return
+
+    if job["status"] == FAILED:
+        st.error(f"{job['name']} に失敗しました: {job['error']}")
+    elif job["status"] == CANCELLED:
+        st.warning(f"{job['name']} はキャンセルされました。")
+
+    if job.get("metrics"):
+        with st.expander(f"処理時間の内訳（{job['metrics']['elapsed']:.1f} 秒）"):
+            render_run_summary(job["metrics"])
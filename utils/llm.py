@@ -0,0 +1,236 @@
+import asyncio
+import threading
+import weakref
+
+import httpx
+import streamlit as st
+from openai import AsyncOpenAI, OpenAI
+from openai.types.chat import ChatCompletion
+
+from utils.cache import SQLiteCache, cache_path, make_key
+from utils.config import get_setting
+from utils.metrics import record_usage, timed
+from utils.ratelimit import acall_with_limits, call_with_limits, estimate_tokens, get_rate_limiter
+
+# 接続プール・タイムアウトの既定値（st.secrets で上書き可能）
+DEFAULT_POOL_SIZE = 20
+DEFAULT_KEEPALIVE_EXPIRY = 60.0
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+DEFAULT_CACHE_TTL = 7 * 24 * 60 * 60
+DEFAULT_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# イベントループごとの非同期クライアント
+_async_clients = weakref.WeakKeyDictionary()
+_async_lock = threading.Lock()
+
+
+def _limits() -> httpx.Limits:
+    pool_size = get_setting("llm_pool_size", DEFAULT_POOL_SIZE)
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=get_setting("llm_keepalive_expiry", DEFAULT_KEEPALIVE_EXPIRY),
+    )
+
+
+def _timeout() -> httpx.Timeout:
+    return httpx.Timeout(
+        get_setting("llm_read_timeout", DEFAULT_READ_TIMEOUT),
+        connect=get_setting("llm_connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+    )
+
+
+@st.cache_resource
+def get_client() -> OpenAI:
+    """プロセス全体で共有する OpenAI クライアントを返します。
+
+    Streamlit の再実行やセッションをまたいでキャッシュされるため、
+    HTTP の keep-alive 接続と TLS セッションが再利用されます。
+    """
+    return OpenAI(
+        api_key=get_setting("openai_api_key"),
+        base_url=get_setting("openai_base_url"),
+        http_client=httpx.Client(limits=_limits(), timeout=_timeout()),
+        # 再試行は utils.ratelimit で行う（429 を同時実行数の調整に使うため）
+        max_retries=0,
+    )
+
+
+def get_async_client() -> AsyncOpenAI:
+    """実行中のイベントループに紐づく AsyncOpenAI クライアントを返します。
+
+    httpx の非同期接続プールはイベントループをまたいで使えないため、
+    ループごとに 1 つのクライアントを生成して使い回します。
+    """
+    loop = asyncio.get_running_loop()
+    with _async_lock:
+        client = _async_clients.get(loop)
+        if client is None:
+            client = AsyncOpenAI(
+                api_key=get_setting("openai_api_key"),
+                base_url=get_setting("openai_base_url"),
+                http_client=httpx.AsyncClient(limits=_limits(), timeout=_timeout()),
+                max_retries=0,
+            )
+            _async_clients[loop] = client
+    return client
+
+
+@st.cache_resource
+def get_completion_cache() -> SQLiteCache:
+    """生成結果のキャッシュ（モデル・メッセージ・パラメータのハッシュがキー）を返します。"""
+    return SQLiteCache(
+        cache_path("completions.sqlite3"),
+        max_bytes=get_setting("llm_cache_max_bytes", DEFAULT_CACHE_MAX_BYTES),
+        default_ttl=get_setting("llm_cache_ttl", DEFAULT_CACHE_TTL),
+    )
+
+
+def _request_params(messages: list, **kwargs) -> dict:
+    params = {
+        "model": get_setting("openai_model"),
+        "messages": messages,
+    }
+    params.update({key: value for key, value in kwargs.items() if value is not None})
+    return params
+
+
+def _use_cache(params: dict, cache: bool = None) -> bool:
+    if cache is None:
+        cache = get_setting("llm_cache_enabled", True)
+    return cache and not params.get("stream")
+
+
+def _create(params: dict):
+    """レート制限の範囲内で API を呼び出し、所要時間とトークン数を記録します。"""
+    def call():
+        with timed("llm", params["model"]):
+            return get_client().chat.completions.create(**params)
+
+    limiter = get_rate_limiter(params["model"])
+    estimated_tokens = estimate_tokens(params)
+    with limiter.slot():
+        response = call_with_limits(limiter, call, estimated_tokens)
+    usage = getattr(response, "usage", None)
+    limiter.settle(estimated_tokens, usage)
+    record_usage(usage, params["model"])
+    return response
+
+
+async def _acreate(params: dict):
+    async def call():
+        with timed("llm", params["model"]):
+            return await get_async_client().chat.completions.create(**params)
+
+    limiter = get_rate_limiter(params["model"])
+    estimated_tokens = estimate_tokens(params)
+    async with limiter.aslot():
+        response = await acall_with_limits(limiter, call, estimated_tokens)
+    usage = getattr(response, "usage", None)
+    limiter.settle(estimated_tokens, usage)
+    record_usage(usage, params["model"])
+    return response
+
+
+def create_chat_completion(messages: list, cache: bool = None, **kwargs):
+    """共有クライアント経由で chat.completions.create を呼び出します。
+
+    model を省略した場合は st.secrets["openai_model"] を使用します。
+    値が None の引数は送信しません。同じリクエストの結果はキャッシュから返し、
+    cache=False を指定するとキャッシュを使わずに API を呼び出します。
+    """
+    params = _request_params(messages, **kwargs)
+    if not _use_cache(params, cache):
+        return _create(params)
+
+    key = make_key(params)
+    cached = get_completion_cache().get(key)
+    if cached is not None:
+        return ChatCompletion.model_validate_json(cached)
+
+    response = _create(params)
+    get_completion_cache().set(key, response.model_dump_json().encode("utf-8"))
+    return response
+
+
+def stream_chat_completion(messages: list, cache: bool = None, **kwargs):
+    """stream=True で chat.completions.create を呼び出し、生成されたテキストを順に返します。
+
+    st.write_stream にそのまま渡せるジェネレータです。キャッシュにヒットした場合は
+    全文を一度に返し、最後まで生成できた結果は create_chat_completion と同じキーで保存します。
+    所要時間は最後のテキストを受け取るまで（表示の時間を含む）を llm_stream として記録します。
+    """
+    params = _request_params(messages, **kwargs)
+    use_cache = _use_cache(params, cache)
+    if use_cache:
+        key = make_key(params)
+        cached = get_completion_cache().get(key)
+        if cached is not None:
+            yield ChatCompletion.model_validate_json(cached).choices[0].message.content
+            return
+
+    parts = []
+    last_chunk = None
+    finish_reason = None
+    usage = None
+    limiter = get_rate_limiter(params["model"])
+    estimated_tokens = estimate_tokens(params)
+    # 受信し終わるまで同時実行の枠を使う。再試行するのは受信を始める前のエラーだけ
+    with limiter.slot(), timed("llm_stream", params["model"]):
+        # include_usage を指定すると、最後のチャンク（choices が空）に usage が入る
+        stream = call_with_limits(
+            limiter,
+            lambda: get_client().chat.completions.create(**params, stream=True, stream_options={"include_usage": True}),
+            estimated_tokens,
+        )
+        try:
+            for chunk in stream:
+                last_chunk = chunk
+                usage = getattr(chunk, "usage", None) or usage
+                if not chunk.choices:
+                    continue
+                choice = chunk.choices[0]
+                if choice.delta.content:
+                    parts.append(choice.delta.content)
+                    yield choice.delta.content
+                finish_reason = choice.finish_reason or finish_reason
+        finally:
+            # 表示の中断（GeneratorExit）や受信中のエラーでも、確保したトークン数を精算する。
+            # usage を受け取る前に終わった場合は見込みの分をすべて戻す
+            stream.close()
+            if usage is not None:
+                limiter.settle(estimated_tokens, usage)
+                record_usage(usage, params["model"])
+            else:
+                limiter.cancel(estimated_tokens)
+
+    if use_cache and last_chunk is not None and finish_reason is not None:
+        completion = ChatCompletion.model_validate({
+            "id": last_chunk.id,
+            "object": "chat.completion",
+            "created": last_chunk.created,
+            "model": last_chunk.model,
+            "choices": [{
+                "index": 0,
+                "finish_reason": finish_reason,
+                "message": {"role": "assistant", "content": "".join(parts)},
+            }],
+        })
+        get_completion_cache().set(key, completion.model_dump_json().encode("utf-8"))
+
+
+async def acreate_chat_completion(messages: list, cache: bool = None, **kwargs):
+    """create_chat_completion の非同期版です。"""
+    params = _request_params(messages, **kwargs)
+    if not _use_cache(params, cache):
+        return await _acreate(params)
+
+    key = make_key(params)
+    cached = get_completion_cache().get(key)
+    if cached is not None:
+        return ChatCompletion.model_validate_json(cached)
+
+    response = await _acreate(params)
+    get_completion_cache().set(key, response.model_dump_json().encode("utf-8"))
+    return response
@@ -0,0 +1,200 @@
+import queue
+import random
+import smtplib
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import Future
+from email.message import EmailMessage
+from email.utils import formatdate, make_msgid
+
+import markdown
+import streamlit as st
+
+from utils.config import get_setting
+from utils.metrics import propagate, timed
+
+# メール送信の既定値（st.secrets で上書き可能）
+DEFAULT_SMTP_HOST = "smtp.gmail.com"
+DEFAULT_SMTP_TIMEOUT = 30.0
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_RETRY_DELAY = 2.0
+DEFAULT_RETRY_MAX_DELAY = 60.0
+DEFAULT_IDLE_TIMEOUT = 60.0
+
+# メモリ上の内容から作成する添付ファイル（content は str または bytes）
+Attachment = namedtuple("Attachment", ["filename", "content", "mime_type"])
+
+
+def build_message(sender: str, to: str, subject: str, body: str, attachments: list = ()) -> EmailMessage:
+    """Markdown の本文（テキストと HTML の両方）と添付ファイルからメールを作成します。"""
+    msg = EmailMessage()
+    msg["From"] = sender
+    msg["To"] = to
+    msg["Subject"] = subject
+    msg["Date"] = formatdate(localtime=True)
+    msg["Message-ID"] = make_msgid()
+    msg.set_content(body)
+    msg.add_alternative(markdown.markdown(body), subtype="html")
+    for attachment in attachments:
+        maintype, subtype = attachment.mime_type.split("/", 1)
+        content = attachment.content
+        if isinstance(content, str):
+            content = content.encode("utf-8")
+        msg.add_attachment(content, maintype=maintype, subtype=subtype, filename=attachment.filename)
+    return msg
+
+
+class SMTPConnection:
+    """1 つのアカウントの SMTP 接続を保持し、複数のメールの送信に使い回します。
+
+    接続先は smtp_host・smtp_port・smtp_ssl・smtp_starttls で変更できます（既定は Gmail）。
+    """
+
+    def __init__(self, user: str, password: str):
+        self.user = user
+        self.password = password
+        self.smtp = None
+        self.last_used = 0.0
+
+    def _connect(self):
+        host = get_setting("smtp_host", DEFAULT_SMTP_HOST)
+        timeout = get_setting("smtp_timeout", DEFAULT_SMTP_TIMEOUT)
+        if get_setting("smtp_ssl", True):
+            smtp = smtplib.SMTP_SSL(host, get_setting("smtp_port", 465), timeout=timeout)
+        else:
+            smtp = smtplib.SMTP(host, get_setting("smtp_port", 587), timeout=timeout)
+            if get_setting("smtp_starttls", True):
+                smtp.starttls()
+        try:
+            smtp.login(self.user, self.password)
+        except Exception:
+            smtp.close()
+            raise
+        self.smtp = smtp
+
+    def send(self, msg: EmailMessage):
+        """メールを送信します。保持していた接続が切れていた場合は接続し直して 1 度だけ送り直します。"""
+        if self.smtp is None:
+            self._connect()
+        try:
+            self.smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            self.smtp = None
+            self._connect()
+            self.smtp.send_message(msg)
+        self.last_used = time.monotonic()
+
+    def close(self):
+        if self.smtp is None:
+            return
+        try:
+            self.smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self.smtp.close()
+        self.smtp = None
+
+
+def _is_transient(error: Exception) -> bool:
+    """一時的なエラー（接続の失敗・切断、4xx の応答）かどうかを返します。"""
+    if isinstance(error, smtplib.SMTPResponseException):
+        return 400 <= error.smtp_code < 500
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return all(400 <= code < 500 for code, _ in error.recipients.values())
+    if isinstance(error, smtplib.SMTPException):
+        return isinstance(error, smtplib.SMTPServerDisconnected)
+    # 接続の失敗・タイムアウト
+    return isinstance(error, OSError)
+
+
+class MailQueue:
+    """メールをバックグラウンドのスレッドで順に送信するキューです。
+
+    アカウントごとの SMTP 接続を使い回し、mail_idle_timeout 秒使わなかった接続は閉じます。
+    一時的なエラーは指数的に伸ばした範囲のランダムな時間（full jitter）を待って再試行します。
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._connections = {}  # (ユーザー, パスワード) -> SMTPConnection
+        self._thread = threading.Thread(target=self._run, name="mail-queue", daemon=True)
+        self._thread.start()
+
+    def submit(self, user: str, password: str, msg: EmailMessage) -> Future:
+        """メールを送信待ちに追加し、送信の結果（失敗した場合は例外）を返す Future を返します。"""
+        future = Future()
+        # 送信の所要時間は、送信を依頼したページ・ジョブの計測として記録する
+        self._queue.put((propagate(self._deliver), user, password, msg, future))
+        return future
+
+    def _run(self):
+        while True:
+            try:
+                deliver, user, password, msg, future = self._queue.get(timeout=1)
+            except queue.Empty:
+                self._close_idle()
+                continue
+            if future.set_running_or_notify_cancel():
+                try:
+                    future.set_result(deliver(user, password, msg))
+                except Exception as e:
+                    future.set_exception(e)
+            self._close_idle()
+
+    def _deliver(self, user: str, password: str, msg: EmailMessage):
+        connection = self._connections.get((user, password))
+        if connection is None:
+            connection = self._connections[(user, password)] = SMTPConnection(user, password)
+        max_retries = get_setting("mail_max_retries", DEFAULT_MAX_RETRIES)
+        for attempt in range(max_retries + 1):
+            try:
+                with timed("smtp"):
+                    connection.send(msg)
+                return msg["Subject"]
+            except Exception as e:
+                connection.close()
+                if attempt >= max_retries or not _is_transient(e):
+                    raise
+            delay = min(
+                get_setting("mail_retry_max_delay", DEFAULT_RETRY_MAX_DELAY),
+                get_setting("mail_retry_delay", DEFAULT_RETRY_DELAY) * 2 ** attempt,
+            )
+            time.sleep(random.uniform(0, delay))
+
+    def _close_idle(self):
+        idle_timeout = get_setting("mail_idle_timeout", DEFAULT_IDLE_TIMEOUT)
+        now = time.monotonic()
+        for connection in self._connections.values():
+            if connection.smtp is not None and now - connection.last_used >= idle_timeout:
+                connection.close()
+
+
+@st.cache_resource
+def get_mail_queue() -> MailQueue:
+    """プロセス全体で共有するメールの送信キューを返します。"""
+    return MailQueue()
+
+
+def send_mail(user: str, password: str, to: str, subject: str, body: str, attachments: list = ()) -> Future:
+    """メールを作成して送信キューに追加し、送信の結果の Future を返します（送信を待ちません）。"""
+    return get_mail_queue().submit(user, password, build_message(user, to, subject, body, attachments))
+
+
+@st.fragment(run_every=1)
+def _wait_for_mail(future: Future):
+    """送信が終わるまでこの部分だけを 1 秒ごとに再実行し、終わったらページ全体を再実行します。"""
+    if future.done():
+        st.rerun()
+    st.info("メールを送信しています...")
+
+
+def show_mail_status(future: Future, success_message: str):
+    """メールの送信状況（送信中・成功・失敗）を表示します。"""
+    if not future.done():
+        _wait_for_mail(future)
+        return
+    error = future.exception()
+    if error is None:
+        st.success(success_message)
+    else:
+        st.error(f"メール送信中にエラーが発生しました: {error}")
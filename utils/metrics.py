@@ -0,0 +1,304 @@
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import streamlit as st
+
+from utils.config import get_setting
+
+# 所要時間のヒストグラムの区切り（秒）
+BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+
+# 計測の書き出しの既定値（st.secrets で上書き可能）
+DEFAULT_EXPORT_INTERVAL = 60
+
+# 実行中のページ・ジョブの計測（スレッドプールには propagate で引き継ぐ）
+_current_run = contextvars.ContextVar("metrics_run", default=None)
+
+
+class RunRecorder:
+    """1 回の実行（ページの再実行やジョブ）で計測した段階ごとの所要時間とトークン数です。"""
+
+    def __init__(self, page: str):
+        self.page = page
+        self.started_at = time.perf_counter()
+        self.stages = {}  # 段階 -> [回数, 合計秒, エラー数]
+        self.tokens = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, stage: str, seconds: float, error: bool):
+        with self._lock:
+            entry = self.stages.setdefault(stage, [0, 0.0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] += int(error)
+
+    def add_tokens(self, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.tokens["prompt"] += prompt_tokens
+            self.tokens["completion"] += completion_tokens
+
+    def summary(self) -> dict:
+        """段階ごとの集計と経過時間・トークン数を JSON 化できる dict で返します。"""
+        with self._lock:
+            return {
+                "page": self.page,
+                "elapsed": time.perf_counter() - self.started_at,
+                "stages": [
+                    {"stage": stage, "count": count, "seconds": seconds, "errors": errors}
+                    for stage, (count, seconds, errors) in sorted(self.stages.items(), key=lambda item: -item[1][1])
+                ],
+                "tokens": dict(self.tokens),
+            }
+
+
+class _Collector:
+    """プロセス全体の計測値（所要時間のヒストグラム、トークン数、キャッシュのヒット数）です。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.timings = {}  # (段階, ページ, モデル) -> {"count", "errors", "sum", "buckets"}
+        self.tokens = defaultdict(int)  # (ページ, モデル, 種類) -> トークン数
+        self.cache = defaultdict(int)  # (キャッシュ名, ページ, 結果) -> 回数
+        self.last_export = 0.0
+
+    def observe(self, stage: str, seconds: float, error: bool, page: str, model: str):
+        with self.lock:
+            entry = self.timings.get((stage, page, model))
+            if entry is None:
+                entry = {"count": 0, "errors": 0, "sum": 0.0, "buckets": [0] * len(BUCKETS)}
+                self.timings[(stage, page, model)] = entry
+            entry["count"] += 1
+            entry["errors"] += int(error)
+            entry["sum"] += seconds
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    entry["buckets"][i] += 1
+
+    def add_tokens(self, page: str, model: str, prompt_tokens: int, completion_tokens: int):
+        with self.lock:
+            self.tokens[(page, model, "prompt")] += prompt_tokens
+            self.tokens[(page, model, "completion")] += completion_tokens
+
+    def record_cache(self, name: str, page: str, hit: bool):
+        with self.lock:
+            self.cache[(name, page, "hit" if hit else "miss")] += 1
+
+    def to_json(self) -> dict:
+        with self.lock:
+            return {
+                "timings": [
+                    {"stage": stage, "page": page, "model": model, **entry}
+                    for (stage, page, model), entry in self.timings.items()
+                ],
+                "tokens": [
+                    {"page": page, "model": model, "kind": kind, "tokens": count}
+                    for (page, model, kind), count in self.tokens.items()
+                ],
+                "cache": [
+                    {"cache": name, "page": page, "result": result, "count": count}
+                    for (name, page, result), count in self.cache.items()
+                ],
+                "buckets": list(BUCKETS),
+            }
+
+    def to_prometheus(self) -> str:
+        """Prometheus のテキスト形式で返します。"""
+        data = self.to_json()
+        lines = [
+            "# HELP app_stage_seconds Duration of pipeline stages.",
+            "# TYPE app_stage_seconds histogram",
+        ]
+        for entry in data["timings"]:
+            labels = _labels(stage=entry["stage"], page=entry["page"], model=entry["model"])
+            for bound, count in zip(BUCKETS, entry["buckets"]):
+                lines.append(f'app_stage_seconds_bucket{{{labels},le="{bound}"}} {count}')
+            lines.append(f'app_stage_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+            lines.append(f"app_stage_seconds_sum{{{labels}}} {entry['sum']:.6f}")
+            lines.append(f"app_stage_seconds_count{{{labels}}} {entry['count']}")
+        lines += ["# HELP app_stage_errors_total Failed pipeline stages.", "# TYPE app_stage_errors_total counter"]
+        for entry in data["timings"]:
+            labels = _labels(stage=entry["stage"], page=entry["page"], model=entry["model"])
+            lines.append(f"app_stage_errors_total{{{labels}}} {entry['errors']}")
+        lines += ["# HELP app_llm_tokens_total Tokens used by LLM calls.", "# TYPE app_llm_tokens_total counter"]
+        for entry in data["tokens"]:
+            labels = _labels(page=entry["page"], model=entry["model"], kind=entry["kind"])
+            lines.append(f"app_llm_tokens_total{{{labels}}} {entry['tokens']}")
+        lines += ["# HELP app_cache_requests_total Cache lookups by result.", "# TYPE app_cache_requests_total counter"]
+        for entry in data["cache"]:
+            labels = _labels(cache=entry["cache"], page=entry["page"], result=entry["result"])
+            lines.append(f"app_cache_requests_total{{{labels}}} {entry['count']}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{key}="{_escape(value)}"' for key, value in labels.items())
+
+
+@st.cache_resource
+def get_collector() -> _Collector:
+    return _Collector()
+
+
+def _page() -> str:
+    run = _current_run.get()
+    return run.page if run is not None else "-"
+
+
+@contextmanager
+def run_context(page: str):
+    """with ブロック内の計測を page の 1 回の実行として記録し、RunRecorder を返します。"""
+    run = RunRecorder(page)
+    token = _current_run.set(run)
+    try:
+        yield run
+    finally:
+        _current_run.reset(token)
+
+
+def start_run(page: str) -> RunRecorder:
+    """ページの実行の計測を開始します。ページの先頭で呼び出し、最後に show_run_metrics で表示します。"""
+    run = RunRecorder(page)
+    _current_run.set(run)
+    return run
+
+
+def current_run():
+    return _current_run.get()
+
+
+def propagate(fn):
+    """呼び出し元の計測（ページ・実行）を引き継いで fn を実行する関数を返します。
+
+    スレッドプールに渡す関数を包んで使います。
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(fn)
+    def run(*args, **kwargs):
+        return context.copy().run(fn, *args, **kwargs)
+
+    return run
+
+
+@contextmanager
+def timed(stage: str, model: str = None):
+    """with ブロックの所要時間を stage として記録します。例外が発生した場合はエラーとして数えます。"""
+    started = time.perf_counter()
+    error = False
+    try:
+        yield
+    except GeneratorExit:
+        # ジェネレーターを途中で閉じた場合はエラーとして数えない
+        raise
+    except BaseException:
+        error = True
+        raise
+    finally:
+        seconds = time.perf_counter() - started
+        run = _current_run.get()
+        get_collector().observe(stage, seconds, error, run.page if run else "-", model or "-")
+        if run is not None:
+            run.add(stage, seconds, error)
+
+
+def timed_function(stage: str):
+    """関数の所要時間を stage として記録するデコレーターです。"""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def record_usage(usage, model: str = None):
+    """API の応答の usage（response.usage）からトークン数を記録します。"""
+    if usage is None:
+        return
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    run = _current_run.get()
+    get_collector().add_tokens(run.page if run else "-", model or "-", prompt_tokens, completion_tokens)
+    if run is not None:
+        run.add_tokens(prompt_tokens, completion_tokens)
+
+
+def record_cache(name: str, hit: bool):
+    """キャッシュの参照結果を記録します。"""
+    get_collector().record_cache(name, _page(), hit)
+
+
+def write_metrics(path: str = None):
+    """計測値をファイルに書き出します。拡張子が .json なら JSON、それ以外は Prometheus のテキスト形式です。
+
+    path を省略した場合は metrics_export_path を使用し、未設定なら何もしません。
+    """
+    path = path or get_setting("metrics_export_path")
+    if not path:
+        return
+    collector = get_collector()
+    if path.endswith(".json"):
+        content = json.dumps(collector.to_json(), ensure_ascii=False, indent=2)
+    else:
+        content = collector.to_prometheus()
+    # 読み込み中のファイルを壊さないよう、書き出してから置き換える
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(content)
+    os.replace(temp_path, path)
+    collector.last_export = time.time()
+
+
+def _maybe_write_metrics():
+    if time.time() - get_collector().last_export >= get_setting("metrics_export_interval", DEFAULT_EXPORT_INTERVAL):
+        write_metrics()
+
+
+def render_run_summary(summary: dict):
+    """RunRecorder.summary() の結果を表として表示します。"""
+    if summary["stages"]:
+        st.dataframe(
+            [
+                {"段階": stage["stage"], "回数": stage["count"], "合計（秒）": round(stage["seconds"], 3), "エラー": stage["errors"]}
+                for stage in summary["stages"]
+            ],
+            hide_index=True,
+        )
+    tokens = summary["tokens"]
+    if tokens:
+        st.caption(f"トークン数: 入力 {tokens.get('prompt', 0):,} / 出力 {tokens.get('completion', 0):,}")
+
+
+def show_run_metrics():
+    """今回の実行の所要時間の内訳をサイドバーに表示します。ページの最後で呼び出します。"""
+    run = _current_run.get()
+    if run is None:
+        return
+    summary = run.summary()
+    with st.sidebar.expander(f"処理時間（{summary['elapsed']:.2f} 秒）"):
+        render_run_summary(summary)
+        collector = get_collector()
+        st.download_button(
+            "計測値をダウンロード（Prometheus形式）",
+            data=collector.to_prometheus(),
+            file_name="metrics.prom",
+            mime="text/plain",
+        )
+        st.download_button(
+            "計測値をダウンロード（JSON形式）",
+            data=json.dumps(collector.to_json(), ensure_ascii=False, indent=2),
+            file_name="metrics.json",
+            mime="application/json",
+        )
+    _maybe_write_metrics()
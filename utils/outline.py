@@ -0,0 +1,259 @@
+import json
+import re
+import unicodedata
+
+import openai
+
+from utils.config import get_setting
+from utils.llm import create_chat_completion
+from utils.metrics import timed
+from utils.prompts import render_prompt
+
+# 統合後のマインドマップの既定値（st.secrets で上書き可能）
+DEFAULT_MAX_DEPTH = 5
+DEFAULT_MAX_CHILDREN = 12
+DEFAULT_CONSOLIDATE_DEPTH = 2
+
+HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+LIST_ITEM_RE = re.compile(r"^(\s*)(?:[-*+]|\d+[.)])\s+(.*)$")
+# 先頭の YAML フロントマター（markmap のオプションなど）
+FRONTMATTER_RE = re.compile(r"\A---[ \t]*\n.*?\n---[ \t]*(?:\n|\Z)", re.S)
+# 比較時に無視する装飾・記号
+MARKUP_RE = re.compile(r"[*_`~\[\]]")
+SYMBOL_RE = re.compile(r"[\s、。，．,.:：;；!！?？・「」『』（）()【】\-—–]+")
+
+
+class OutlineNode:
+    """マインドマップ（Markdown のアウトライン）の 1 つのノードです。"""
+
+    def __init__(self, label: str, children: list = None):
+        self.label = label
+        self.children = children or []
+        # parse_outline で読み取った YAML フロントマター（仮のルートのみ）
+        self.frontmatter = ""
+
+    def count(self) -> int:
+        """このノードを含む、部分木のノード数を返します。"""
+        return 1 + sum(child.count() for child in self.children)
+
+    def depth(self) -> int:
+        return 1 + max((child.depth() for child in self.children), default=0)
+
+
+def normalize_label(label: str) -> str:
+    """ラベルを比較用に正規化します（全角・半角や大文字・小文字、装飾、記号の違いを無視）。"""
+    label = unicodedata.normalize("NFKC", label).lower()
+    label = MARKUP_RE.sub("", label)
+    return SYMBOL_RE.sub("", label)
+
+
+def parse_outline(markdown_text: str) -> OutlineNode:
+    """見出し（#）と箇条書き（インデント）の Markdown をノードの木に変換します。
+
+    返すのはラベルの無い仮のルートで、その子が最上位のノードです。
+    箇条書き以外の本文の行は、直前の見出しの子として扱います。コードブロックと表は
+    複数行のまま 1 つのノードにし、先頭の YAML フロントマターは root.frontmatter に保持します。
+    """
+    root = OutlineNode("")
+    frontmatter = FRONTMATTER_RE.match(markdown_text)
+    if frontmatter:
+        root.frontmatter = frontmatter.group(0).rstrip("\n")
+        markdown_text = markdown_text[frontmatter.end():]
+
+    headings = []  # (見出しのレベル, ノード)
+    items = []  # (インデント, ノード)
+    block = None  # 読み取り中のコードブロック・表の行
+    for line in markdown_text.expandtabs(4).splitlines():
+        section = headings[-1][1] if headings else root
+        if block is not None and block[0].lstrip().startswith("```"):
+            block.append(line)
+            if line.strip().startswith("```"):
+                section.children.append(OutlineNode(_dedent(block)))
+                block = None
+            continue
+        if block is not None and not line.strip().startswith("|"):
+            section.children.append(OutlineNode(_dedent(block)))
+            block = None
+        if line.strip().startswith(("```", "|")):
+            if block is None:
+                block = [line]
+            else:
+                block.append(line)
+            continue
+        if not line.strip():
+            continue
+
+        heading = HEADING_RE.match(line)
+        if heading:
+            level = len(heading.group(1))
+            while headings and headings[-1][0] >= level:
+                headings.pop()
+            node = OutlineNode(heading.group(2).strip())
+            (headings[-1][1] if headings else root).children.append(node)
+            headings.append((level, node))
+            items = []
+            continue
+
+        item = LIST_ITEM_RE.match(line)
+        if item:
+            indent = len(item.group(1))
+            while items and items[-1][0] >= indent:
+                items.pop()
+            node = OutlineNode(item.group(2).strip())
+            (items[-1][1] if items else section).children.append(node)
+            items.append((indent, node))
+        else:
+            section.children.append(OutlineNode(line.strip()))
+    if block is not None:
+        (headings[-1][1] if headings else root).children.append(OutlineNode(_dedent(block)))
+    return root
+
+
+def _dedent(lines: list) -> str:
+    """コードブロック・表の行から共通のインデントを除き、1 つのラベルにします。"""
+    indent = min(len(line) - len(line.lstrip()) for line in lines if line.strip())
+    return "\n".join(line[indent:] for line in lines)
+
+
+def merge_children(nodes: list) -> list:
+    """同じラベル（正規化後）のノードを、最初に現れた位置にまとめて再帰的に統合します。"""
+    merged = {}
+    for node in nodes:
+        key = normalize_label(node.label) or node.label
+        if key in merged:
+            merged[key].children.extend(node.children)
+        else:
+            merged[key] = OutlineNode(node.label, list(node.children))
+    for node in merged.values():
+        node.children = merge_children(node.children)
+    return list(merged.values())
+
+
+def prune(node: OutlineNode, max_depth: int, max_children: int, depth: int = 1):
+    """深さと子の数を制限します。子が多い場合は、部分木の大きいものを元の順序のまま残します。"""
+    if depth >= max_depth:
+        node.children = []
+        return
+    if len(node.children) > max_children:
+        keep = set(map(id, sorted(node.children, key=lambda child: child.count(), reverse=True)[:max_children]))
+        node.children = [child for child in node.children if id(child) in keep]
+    for child in node.children:
+        prune(child, max_depth, max_children, depth + 1)
+
+
+def merge_outlines(markdown_texts: list, root_label: str, max_depth: int = None, max_children: int = None) -> OutlineNode:
+    """チャンクごとのマインドマップを 1 つの木に統合します。
+
+    各チャンクの最上位ノード（チャンクごとのテーマ）の子を root_label の下に集め、
+    同じラベルのノードを統合してから、深さ（mindmap_max_depth）と
+    子の数（mindmap_max_children）を制限します。
+    """
+    children = []
+    for markdown_text in markdown_texts:
+        top = parse_outline(markdown_text).children
+        # テーマのノードが 1 つだけの場合は、その下の構造を統合する
+        if len(top) == 1 and top[0].children:
+            top = top[0].children
+        children.extend(top)
+
+    root = OutlineNode(root_label, merge_children(children))
+    prune(
+        root,
+        max_depth or get_setting("mindmap_max_depth", DEFAULT_MAX_DEPTH),
+        max_children or get_setting("mindmap_max_children", DEFAULT_MAX_CHILDREN),
+    )
+    return root
+
+
+def _collect(node: OutlineNode, max_depth: int, depth: int = 1, nodes: list = None) -> list:
+    """統合の候補にする（ルートを除く max_depth までの）ノードを幅優先の順で集めます。"""
+    nodes = [] if nodes is None else nodes
+    if depth > max_depth:
+        return nodes
+    for child in node.children:
+        nodes.append((node, child))
+    for child in node.children:
+        _collect(child, max_depth, depth + 1, nodes)
+    return nodes
+
+
+def consolidate_labels(root: OutlineNode, max_depth: int = None) -> OutlineNode:
+    """同じ意味のラベルを LLM で揃えてから、もう一度統合します。
+
+    LLM に送るのは上位のノードのラベルだけで、本文は送りません。
+    API の呼び出しに失敗した場合や応答を解釈できない場合は、mindmap_consolidate の
+    エラーとして記録し、元の木をそのまま返します（マインドマップの生成は失敗させません）。
+    """
+    max_depth = max_depth or get_setting("mindmap_consolidate_depth", DEFAULT_CONSOLIDATE_DEPTH)
+    nodes = _collect(root, max_depth)
+    if len(nodes) < 2:
+        return root
+
+    labels = "\n".join(f"{i}\t{parent.label}\t{node.label}" for i, (parent, node) in enumerate(nodes))
+    try:
+        with timed("mindmap_consolidate"):
+            response = create_chat_completion(
+                messages=[
+                    {"role": "system", "content": "あなたはマインドマップの構成を整理するアシスタントです。"},
+                    {"role": "user", "content": render_prompt("mindmap_consolidate", labels=labels)},
+                ],
+                response_format={"type": "json_object"},
+                temperature=0)
+            renames = json.loads(response.choices[0].message.content)
+    except (openai.OpenAIError, TypeError, ValueError):
+        return root
+    if not isinstance(renames, dict):
+        return root
+
+    for key, label in renames.items():
+        if str(key).isdigit() and int(key) < len(nodes) and isinstance(label, str) and label.strip():
+            nodes[int(key)][1].label = label.strip()
+    root.children = merge_children(root.children)
+    return root
+
+
+def walk_outline(root: OutlineNode, max_depth: int = None):
+    """(ラベルの経路, ノード) を深さ優先の順に返します。ラベルの無い仮のルートは含めません。"""
+    def walk(node, path):
+        if max_depth is not None and len(path) >= max_depth:
+            return
+        for child in node.children:
+            child_path = path + (child.label,)
+            yield child_path, child
+            yield from walk(child, child_path)
+
+    if root.label:
+        yield (root.label,), root
+        yield from walk(root, (root.label,))
+    else:
+        yield from walk(root, ())
+
+
+def render_outline(root: OutlineNode, indent: str = "  ", max_depth: int = None, frontmatter: str = None) -> str:
+    """木を Markdown の箇条書きに変換します。
+
+    max_depth を指定するとその深さまでを出力し、省略した子孫の数をラベルの後に付けます。
+    ラベルの無い仮のルート（parse_outline の結果）は出力せず、その子を最上位にします。
+    frontmatter（省略時は root.frontmatter）があれば先頭に出力します。
+    """
+    lines = []
+    frontmatter = root.frontmatter if frontmatter is None else frontmatter
+    if frontmatter:
+        lines.append(frontmatter)
+
+    def walk(node, depth):
+        label = node.label
+        if max_depth is not None and depth + 1 >= max_depth and node.children:
+            label = f"{label} （+{node.count() - 1}）"
+        # 複数行のラベル（コードブロック・表）は 2 行目以降を項目の本文の位置に揃える
+        first, *rest = label.split("\n")
+        lines.append(f"{indent * depth}- {first}")
+        lines.extend(indent * depth + "  " + line if line else "" for line in rest)
+        if max_depth is not None and depth + 1 >= max_depth:
+            return
+        for child in node.children:
+            walk(child, depth + 1)
+
+    for node in ([root] if root.label else root.children):
+        walk(node, 0)
+    return "\n".join(lines)
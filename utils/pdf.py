@@ -0,0 +1,186 @@
+import io
+import multiprocessing
+import os
+import re
+import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+import streamlit as st
+
+from utils.config import get_setting
+from utils.fetch import fetch_bytes
+from utils.metrics import timed_function
+
+# PDF 処理の既定値（st.secrets で上書き可能）
+DEFAULT_PARALLEL_MIN_PAGES = 16
+DEFAULT_MAX_BYTES = 200 * 1024 * 1024
+
+# ページの区切り（チャンク分割で改ページとして扱われる）
+PAGE_SEPARATOR = "\n\f"
+
+# ヘッダー・フッターとみなす、各ページの先頭・末尾の行数
+HEADER_FOOTER_LINES = 2
+
+
+def download_pdf(url: str) -> bytes:
+    """PDF をダウンロードし、メモリ上のバイト列として返します。"""
+    return fetch_bytes(url, max_bytes=get_setting("pdf_max_bytes", DEFAULT_MAX_BYTES))
+
+
+def count_pages(data: bytes) -> int:
+    with pdfplumber.open(io.BytesIO(data)) as pdf:
+        return len(pdf.pages)
+
+
+def parse_page_range(spec: str, page_count: int) -> list:
+    """"1-5, 8, 10-" のようなページ指定を 0 始まりのページ番号のリストに変換します。
+
+    空の指定はすべてのページを表します。範囲外のページは無視します。
+    """
+    if not spec.strip():
+        return list(range(page_count))
+
+    pages = set()
+    for part in spec.replace("、", ",").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            start = int(start) if start.strip() else 1
+            end = int(end) if end.strip() else page_count
+        else:
+            start = end = int(part)
+        pages.update(range(max(start, 1) - 1, min(end, page_count)))
+    return sorted(pages)
+
+
+def _format_table(rows: list) -> str:
+    """表を TSV 形式の文字列に変換します。空の行・列は取り除きます。"""
+    rows = [[re.sub(r"\s+", " ", cell or "").strip() for cell in row] for row in rows]
+    rows = [row for row in rows if any(row)]
+    if not rows:
+        return ""
+    width = max(len(row) for row in rows)
+    rows = [row + [""] * (width - len(row)) for row in rows]
+    columns = [i for i in range(width) if any(row[i] for row in rows)]
+    return "\n".join("\t".join(row[i] for i in columns) for row in rows)
+
+
+def _extract_page_with_tables(page):
+    """表以外の部分のテキストと、表を TSV にしたブロックのリストを抽出します。"""
+    tables = page.find_tables()
+    if not tables:
+        return page.extract_text() or "", []
+
+    bboxes = [table.bbox for table in tables]
+
+    def outside_tables(obj):
+        x = (obj["x0"] + obj["x1"]) / 2
+        y = (obj["top"] + obj["bottom"]) / 2
+        return not any(x0 <= x <= x1 and top <= y <= bottom for x0, top, x1, bottom in bboxes)
+
+    text = page.filter(outside_tables).extract_text() or ""
+    blocks = [block for block in (_format_table(table.extract()) for table in tables) if block]
+    return text, blocks
+
+
+def _extract_pages(source, page_numbers: list, tables: bool = False) -> list:
+    """指定したページの (テキスト, 表ブロックのリスト) を抽出します（ワーカープロセスで実行）。
+
+    source は PDF のバイト列か、ファイルのパスです。
+    """
+    pages = []
+    with pdfplumber.open(io.BytesIO(source) if isinstance(source, bytes) else source) as pdf:
+        for page_number in page_numbers:
+            page = pdf.pages[page_number]
+            if tables:
+                pages.append(_extract_page_with_tables(page))
+            else:
+                pages.append((page.extract_text() or "", []))
+    return pages
+
+
+def _normalize_line(line: str) -> str:
+    # ページ番号などの数字の違いは無視して比較する
+    return re.sub(r"\d+", "#", line.strip())
+
+
+def remove_repeated_headers(texts: list) -> list:
+    """多くのページの先頭・末尾に繰り返し現れる行（ヘッダー・フッター）を取り除きます。"""
+    if len(texts) < 3:
+        return texts
+
+    counts = Counter()
+    for text in texts:
+        lines = [line for line in text.splitlines() if line.strip()]
+        edge_lines = lines[:HEADER_FOOTER_LINES] + lines[-HEADER_FOOTER_LINES:]
+        counts.update({_normalize_line(line) for line in edge_lines})
+    repeated = {line for line, count in counts.items() if count >= max(3, len(texts) * 0.6)}
+    if not repeated:
+        return texts
+
+    cleaned = []
+    for text in texts:
+        lines = text.splitlines()
+        content = [i for i, line in enumerate(lines) if line.strip()]
+        edges = set(content[:HEADER_FOOTER_LINES] + content[-HEADER_FOOTER_LINES:])
+        cleaned.append("\n".join(
+            line for i, line in enumerate(lines)
+            if not (i in edges and _normalize_line(line) in repeated)
+        ))
+    return cleaned
+
+
+@st.cache_resource
+def _get_process_pool() -> tuple:
+    """(プロセスプール, ワーカー数) を返します。
+
+    ページ範囲の分割にはプールを作成したときのワーカー数を使い、実行中に
+    pdf_max_workers を変更してもプールの大きさと食い違わないようにします。
+    """
+    max_workers = max(1, int(get_setting("pdf_max_workers", os.cpu_count() or 1)))
+    # Streamlit はマルチスレッドで動作するため、fork ではなく spawn でワーカーを起動する
+    pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+    return pool, max_workers
+
+
+@timed_function("pdf_extract")
+def extract_text_from_pdf(data: bytes, page_numbers: list = None, tables: bool = False) -> str:
+    """PDF のバイト列からテキストを抽出します。
+
+    page_numbers（0 始まり）を指定するとそのページのみを対象にします。
+    tables=True の場合、表を検出してヘッダー行付きの TSV ブロックとして出力します。
+    ページ数が pdf_parallel_min_pages 以上の場合は、ページ範囲ごとに
+    プロセスプールで並列に抽出します（PDF は一時ファイルに一度だけ書き出し、各ワーカーは
+    そのパスから読み込みます）。繰り返し現れるヘッダー・フッターは取り除き、
+    ページの間は PAGE_SEPARATOR で区切ります。
+    """
+    if page_numbers is None:
+        page_numbers = list(range(count_pages(data)))
+
+    if len(page_numbers) < get_setting("pdf_parallel_min_pages", DEFAULT_PARALLEL_MIN_PAGES):
+        pages = _extract_pages(data, page_numbers, tables)
+    else:
+        pool, workers = _get_process_pool()
+        size = -(-len(page_numbers) // workers)
+        ranges = [page_numbers[i:i + size] for i in range(0, len(page_numbers), size)]
+        # バイト列をワーカーごとに複製して送らないよう、一時ファイルのパスを渡す
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as file:
+            file.write(data)
+        try:
+            pages = []
+            for range_pages in pool.map(_extract_pages, [file.name] * len(ranges), ranges, [tables] * len(ranges)):
+                pages.extend(range_pages)
+        finally:
+            os.remove(file.name)
+
+    texts = remove_repeated_headers([text for text, _ in pages])
+    page_texts = []
+    for text, blocks in zip(texts, [blocks for _, blocks in pages]):
+        # 表は空行で囲み、チャンク分割で 1 つの段落として扱われるようにする
+        parts = [text] + [f"[表]\n{block}\n[/表]" for block in blocks]
+        page_texts.append("\n\n".join(part for part in parts if part.strip()))
+    return PAGE_SEPARATOR.join(text for text in page_texts if text)
@@ -0,0 +1,292 @@
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+
+import streamlit as st
+
+from utils.cache import SQLiteCache, cache_path, make_key
+from utils.chunking import chunk_text_stable, completion_max_tokens
+from utils.config import get_setting
+from utils.extract import extract_article
+from utils.fetch import fetch_text
+from utils.llm import create_chat_completion
+from utils.mail import Attachment, send_mail
+from utils.metrics import propagate, timed
+from utils.outline import consolidate_labels, merge_outlines, render_outline
+from utils.pdf import count_pages, download_pdf, extract_text_from_pdf, parse_page_range
+from utils.prompts import render_prompt
+from utils.summarize import summarize_long_text
+from utils.transcripts import TranscriptNotFound, extract_video_id, get_transcript, transcript_to_text
+
+# 各ページとバッチ処理（batch.py）で共有する処理です。Streamlit の画面には依存しません。
+
+# マインドマップ生成の既定値（st.secrets で上書き可能）
+DEFAULT_MINDMAP_MAX_WORKERS = 4
+DEFAULT_MINDMAP_CACHE_MAX_BYTES = 256 * 1024 * 1024
+
+# 複数動画の要約の既定値（st.secrets で上書き可能）
+DEFAULT_MULTI_SUMMARY_MAX_WORKERS = 4
+
+VIDEO_SUMMARY_SYSTEM_PROMPT = "あなたは動画の文字起こしを要約するアシスタントです。"
+MINDMAP_SYSTEM_PROMPT = "あなたは文字起こしデータを解析してマインドマップを生成するアシスタントです。"
+MINDMAP_ROOT_LABEL = "テーマ: 文字起こしのマインドマップ"
+
+
+def extract_title(summary: str, default: str = "要約結果") -> str:
+    """要約の 2 行目（テンプレートの「動画のタイトル」）をタイトルとして取り出します。"""
+    lines = summary.split("\n")
+    title = lines[1].strip() if len(lines) > 1 else ""
+    return title or default
+
+
+def fetch_video_transcript(video_url: str) -> str:
+    """YouTube 動画の URL から文字起こしのテキストを取得します（見つからない場合は TranscriptNotFound）。"""
+    transcript = get_transcript(extract_video_id(video_url), languages=("en", "ja"))
+    return transcript_to_text(transcript)
+
+
+def video_summary_messages(transcript_text: str) -> list:
+    """動画の要約を生成するためのメッセージを作成します。"""
+    prompt = render_prompt("summary", transcript=transcript_text)
+    return [
+        {"role": "system", "content": VIDEO_SUMMARY_SYSTEM_PROMPT},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def summarize_video(video_url: str, job=None) -> dict:
+    """1 件の動画について文字起こしの取得と要約を行い、要約・タイトル・文字起こしを返します。"""
+    return summarize_transcript(fetch_video_transcript(video_url), job)
+
+
+def summarize_transcript(transcript_text: str, job=None) -> dict:
+    """取得済みの文字起こしを要約し、要約・タイトル・文字起こしを返します。
+
+    job を渡すと、API を呼び出す前にキャンセルされていないかを確認します（JobCancelled）。
+    """
+    messages = video_summary_messages(transcript_text)
+
+    if job is not None:
+        job.check_cancelled()
+    response = create_chat_completion(messages=messages, max_tokens=3000, temperature=0.5)
+    summary = response.choices[0].message.content
+
+    return {"summary": summary, "title": extract_title(summary), "transcript_text": transcript_text}
+
+
+def summary_attachments(item: dict, prefix: str = "") -> list:
+    """要約（Markdown）と文字起こし（テキスト）の添付ファイルを作成します。"""
+    return [
+        Attachment(f"{prefix}{item['title']}.md", item["summary"], "text/markdown"),
+        Attachment(f"{prefix}{item['title']}.txt", item["transcript_text"], "text/plain"),
+    ]
+
+
+def send_summary_email(email: str, email_user: str, email_password: str, idx: int, item: dict):
+    """1 件の要約と文字起こしを送信キューに追加し、(件名, Future) を返します。"""
+    subject = f"動画 {idx} の要約: {item['title']}"
+    body = f"{item['summary']}\n\n文字起こしデータを添付しました。"
+    return subject, send_mail(email_user, email_password, email, subject, body, summary_attachments(item))
+
+
+def send_digest_email(email: str, email_user: str, email_password: str, items: list):
+    """複数の動画の要約と文字起こしを 1 通にまとめて送信キューに追加し、(件名, Future) を返します。"""
+    subject = f"{len(items)} 件の動画の要約"
+    sections = [f"## 動画 {item['idx']}: {item['title']}\n{item['url']}\n\n{item['summary']}" for item in items]
+    body = "\n\n".join(sections) + "\n\n文字起こしデータを添付しました。"
+    attachments = [
+        attachment
+        for item in items
+        for attachment in summary_attachments(item, prefix=f"{item['idx']:02d}_")
+    ]
+    return subject, send_mail(email_user, email_password, email, subject, body, attachments)
+
+
+def summarize_videos(job, urls: list, email: str, email_user: str, email_password: str,
+                     max_workers: int = None, digest: bool = False) -> list:
+    """複数の動画を並行に要約し、入力順の結果のリストを返します（バックグラウンドのジョブとして実行）。
+
+    文字起こしはすべての動画について同時に取得し、取得できたものから要約を
+    max_workers（既定は multi_summary_max_workers）件まで並行に生成します。
+    完了した動画から順に途中結果として公開します。メールアドレスが指定されていれば要約ごとに
+    （digest=True の場合はすべての要約を 1 通にまとめて）送信キューに追加し、送信は待たずに
+    次の動画の処理を続けます。送信の結果は、すべての要約が終わった後で各動画の結果に反映します。
+    """
+    job.update(0.0, f"0 / {len(urls)} 件完了")
+
+    max_workers = max_workers or get_setting("multi_summary_max_workers", DEFAULT_MULTI_SUMMARY_MAX_WORKERS)
+    items = {}
+    mails = {}  # 動画の番号 -> (件名, Future)
+    fetch_executor = ThreadPoolExecutor(max_workers=len(urls))
+    summary_executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    try:
+        fetches = {
+            fetch_executor.submit(propagate(fetch_video_transcript), video_url): idx
+            for idx, video_url in enumerate(urls, start=1)
+        }
+        futures = dict(fetches)  # 文字起こしの取得・要約の Future -> 動画の番号
+        pending = set(futures)
+        done_count = 0
+        while pending:
+            finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+            job.check_cancelled()
+            for future in finished:
+                idx = futures.pop(future)
+                # 取得できた文字起こしは、要約の段階に回す
+                if future in fetches and future.exception() is None:
+                    summary = summary_executor.submit(propagate(summarize_transcript), future.result(), job)
+                    futures[summary] = idx
+                    pending.add(summary)
+                    continue
+
+                item = {"idx": idx, "url": urls[idx - 1], "error": None, "warning": None, "email": None, "email_error": None}
+                try:
+                    item.update(future.result())
+                except TranscriptNotFound:
+                    item["warning"] = f"動画 {idx}: 利用可能な文字起こしが見つかりません。スキップします。"
+                except FileNotFoundError:
+                    item["error"] = "プロンプトファイルが見つかりません。"
+                except Exception as e:
+                    item["error"] = f"動画 {idx} の処理中にエラーが発生しました: {e}"
+
+                if email and not digest and "summary" in item:
+                    mails[idx] = send_summary_email(email, email_user, email_password, idx, item)
+
+                items[idx] = item
+                done_count += 1
+                job.add_partial(item)
+                # キャンセルされていればここで中断する（未完了の動画の結果は破棄される）
+                job.update(done_count / len(urls), f"{done_count} / {len(urls)} 件完了")
+    finally:
+        # キャンセル・エラー時は未着手の動画を処理せず、実行中の動画の終了も待たない
+        fetch_executor.shutdown(wait=False, cancel_futures=True)
+        summary_executor.shutdown(wait=False, cancel_futures=True)
+
+    results = [items[idx] for idx in sorted(items)]
+    summarized = [item for item in results if "summary" in item]
+    if email and digest and summarized:
+        digest_mail = send_digest_email(email, email_user, email_password, summarized)
+        mails = {item["idx"]: digest_mail for item in summarized}
+
+    if mails:
+        job.update(1.0, "メールを送信しています")
+    sent = "まとめてメール送信しました" if digest else "メール送信しました"
+    for idx, (subject, mail) in mails.items():
+        try:
+            mail.result()
+            items[idx]["email"] = f"動画 {idx} の要約と文字起こしデータを{sent}！件名: {subject}"
+        except Exception as e:
+            items[idx]["email_error"] = f"動画 {idx} のメール送信中にエラーが発生しました: {e}"
+    return results
+
+
+def summarize_web_page(url: str, stream: bool = False):
+    """ウェブページを取得して本文を抽出し、要約します。
+
+    stream=True の場合は最終要約をテキストの断片のジェネレーターで返します。
+    """
+    html = fetch_text(url)
+    if not html.strip():
+        raise ValueError("ウェブコンテンツを取得できませんでした。")
+    main_content = extract_article(html, "extract_main_content")
+    return summarize_long_text(main_content, "url_summary", stream=stream)
+
+
+def extract_pdf_text(pdf_data: bytes, page_range: str = "", tables: bool = True) -> str:
+    """PDF のバイト列から、page_range（例: "1-10, 15"）で指定したページのテキストを抽出します。"""
+    try:
+        page_numbers = parse_page_range(page_range, count_pages(pdf_data))
+    except ValueError as e:
+        raise ValueError("ページの指定が正しくありません。例: 1-10, 15, 20-") from e
+    text = extract_text_from_pdf(pdf_data, page_numbers, tables=tables)
+    if not text.strip():
+        raise ValueError("PDFからテキストを抽出できませんでした。")
+    return text
+
+
+def analyze_pdf(pdf_url: str, page_range: str = "", tables: bool = True, stream: bool = False):
+    """決算公告などの PDF をダウンロードして要約します。"""
+    text = extract_pdf_text(download_pdf(pdf_url), page_range, tables)
+    return summarize_long_text(text, "financial_analyst", stream=stream)
+
+
+@st.cache_resource
+def get_mindmap_cache() -> SQLiteCache:
+    """チャンクの内容をキーにした、マインドマップの部分結果のキャッシュを返します。
+
+    LLM の応答のキャッシュ（llm_cache_enabled・llm_cache_ttl）とは別に、期限なしで保持します。
+    """
+    return SQLiteCache(
+        cache_path("mindmap.sqlite3"),
+        max_bytes=get_setting("mindmap_cache_max_bytes", DEFAULT_MINDMAP_CACHE_MAX_BYTES),
+    )
+
+
+def _mindmap_chunk(chunk: str) -> str:
+    """1 つのチャンクからマインドマップの部分を生成します。同じ内容のチャンクは再利用します。"""
+    messages = [
+        {"role": "system", "content": MINDMAP_SYSTEM_PROMPT},
+        {"role": "user", "content": render_prompt("mindmap", chunk=chunk)},
+    ]
+    # プロンプト（テンプレートを含む）とモデルが同じなら同じ結果とみなす
+    key = make_key(get_setting("openai_model"), messages)
+    cached = get_mindmap_cache().get(key)
+    if cached is not None:
+        return cached.decode("utf-8")
+
+    # 結果はこのキャッシュだけに保存する（LLM の応答のキャッシュと二重に保存しない）
+    response = create_chat_completion(
+        messages=messages,
+        cache=False,
+        max_tokens=completion_max_tokens(messages, 1500),
+        temperature=0.5)
+    result = response.choices[0].message.content
+    get_mindmap_cache().set(key, result.encode("utf-8"))
+    return result
+
+
+def generate_mindmap(transcript_text: str, progress=None, consolidate: bool = None) -> str:
+    """文字起こしをチャンクに分けてマインドマップ（Markdown のリスト）を生成します。
+
+    チャンクの区切りは内容から決め、チャンクごとの結果は mindmap.sqlite3 に保持するため
+    （llm_cache_enabled の設定によらない）、一部を編集したテキストでは変更のあった
+    チャンクだけを API に送信します。チャンクは mindmap_max_workers 件まで並列に処理し、
+    progress を渡すと、チャンクが終わるたびに progress(完了数, チャンク数) を呼び出します。
+    チャンクごとの結果は 1 つの木に統合し、consolidate=True（既定は mindmap_consolidate）の
+    場合は、ラベルだけを LLM に送って同じ意味のノードをさらにまとめます。
+    """
+    # トークン制限を考慮して文字起こしデータを分割
+    transcript_chunks = chunk_text_stable(
+        transcript_text,
+        max_tokens=get_setting("mindmap_chunk_tokens", 3000),  # 各チャンクのトークン数
+        # 重複させると編集が次のチャンクにも及ぶため、既定では重複させない
+        overlap_tokens=get_setting("mindmap_chunk_overlap_tokens", 0),
+    )
+    if not transcript_chunks:
+        raise ValueError("文字起こしデータが空です。")
+
+    # 各チャンクの要約を並列に生成し、元の順序で並べる
+    summaries = [None] * len(transcript_chunks)
+    max_workers = min(get_setting("mindmap_max_workers", DEFAULT_MINDMAP_MAX_WORKERS), len(transcript_chunks))
+    with timed("mindmap_chunks"):
+        executor = ThreadPoolExecutor(max_workers=max_workers)
+        try:
+            futures = {executor.submit(propagate(_mindmap_chunk), chunk): i for i, chunk in enumerate(transcript_chunks)}
+            for done, future in enumerate(as_completed(futures), start=1):
+                i = futures[future]
+                try:
+                    summaries[i] = future.result()
+                except Exception as e:
+                    raise RuntimeError(f"チャンク {i + 1} の処理中にエラーが発生しました: {e}") from e
+                if progress:
+                    progress(done, len(transcript_chunks))
+        finally:
+            # エラー・キャンセル時は未着手のチャンクを送信しない
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    # すべての部分要約を 1 つの木に統合し、同じラベルのノードをまとめる
+    with timed("mindmap_merge"):
+        root = merge_outlines(summaries, MINDMAP_ROOT_LABEL)
+        if consolidate is None:
+            consolidate = get_setting("mindmap_consolidate", False)
+        if consolidate:
+            root = consolidate_labels(root)
+        return render_outline(root)
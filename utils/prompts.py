@@ -0,0 +1,99 @@
+import os
+import string
+import threading
+
+import streamlit as st
+
+# プロンプトのテンプレートを置くディレクトリ（作業ディレクトリによらずリポジトリ直下の prompts/）
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "prompts")
+
+# 各テンプレートで必要なプレースホルダー（読み込み時に過不足を検証する）
+REQUIRED_FIELDS = {
+    "extract_main_content": {"html"},
+    "financial_analyst": {"text"},
+    "mindmap": {"chunk"},
+    "mindmap_consolidate": {"labels"},
+    "strategy": {"keywords", "goal", "period", "cost"},
+    "summary": {"transcript"},
+    "url_summary": {"text"},
+}
+
+
+class PromptError(ValueError):
+    """プロンプトのテンプレートが正しくない場合、または埋め込む値が足りない場合に送出されます。"""
+
+
+class PromptTemplate:
+    """1 つのプロンプトのテンプレートです。"""
+
+    def __init__(self, name: str, path: str, text: str, mtime: float):
+        self.name = name
+        self.path = path
+        self.text = text
+        self.mtime = mtime
+        self.fields = _parse_fields(name, text)
+
+        required = REQUIRED_FIELDS.get(name)
+        if required is not None and self.fields != required:
+            raise PromptError(
+                f"プロンプト '{name}' のプレースホルダーが正しくありません"
+                f"（必要: {sorted(required)}、実際: {sorted(self.fields)}）。"
+            )
+
+    def render(self, **values) -> str:
+        missing = self.fields - values.keys()
+        if missing:
+            raise PromptError(f"プロンプト '{self.name}' に埋め込む値がありません: {sorted(missing)}")
+        return self.text.format(**values)
+
+
+def _parse_fields(name: str, text: str) -> set:
+    """テンプレートのプレースホルダー名を返します。位置指定の {} や閉じていない括弧はエラーにします。"""
+    try:
+        fields = {field for _, field, _, _ in string.Formatter().parse(text) if field is not None}
+    except ValueError as e:
+        raise PromptError(f"プロンプト '{name}' の書式が正しくありません: {e}") from e
+    positional = [field for field in fields if not field or field.isdigit()]
+    if positional:
+        raise PromptError(f"プロンプト '{name}' では {{text}} のように名前付きのプレースホルダーを使用してください。")
+    return fields
+
+
+class _PromptRegistry:
+    """prompts/ のテンプレートをプロセス内に保持し、ファイルが更新されたときだけ読み直します。"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.templates = {}
+        self.lock = threading.Lock()
+        # 起動時にすべて読み込んで検証し、テンプレートの誤りをすぐに検出する
+        for file_name in sorted(os.listdir(directory)):
+            if file_name.endswith(".txt"):
+                self.get(file_name[:-len(".txt")])
+
+    def get(self, name: str) -> PromptTemplate:
+        path = os.path.join(self.directory, f"{name}.txt")
+        # 存在しない場合は FileNotFoundError を送出する
+        mtime = os.stat(path).st_mtime
+        with self.lock:
+            template = self.templates.get(name)
+            if template is None or template.mtime != mtime:
+                with open(path, "r", encoding="utf-8") as f:
+                    template = PromptTemplate(name, path, f.read(), mtime)
+                self.templates[name] = template
+            return template
+
+
+@st.cache_resource
+def get_prompt_registry() -> _PromptRegistry:
+    return _PromptRegistry(PROMPTS_DIR)
+
+
+def get_prompt(name: str) -> PromptTemplate:
+    """名前（prompts/ のファイル名から .txt を除いたもの）でテンプレートを取得します。"""
+    return get_prompt_registry().get(name)
+
+
+def render_prompt(name: str, **values) -> str:
+    """テンプレートにプレースホルダーの値を埋め込んだプロンプトを返します。"""
+    return get_prompt(name).render(**values)
@@ -0,0 +1,342 @@
+import asyncio
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import parsedate_to_datetime
+
+import openai
+import streamlit as st
+
+from utils.chunking import count_tokens
+from utils.config import get_setting
+from utils.metrics import timed
+
+# レート制限の既定値（st.secrets で上書き可能）
+DEFAULT_MAX_CONCURRENCY = 16
+DEFAULT_MIN_CONCURRENCY = 1
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 60.0
+
+# max_tokens を指定しない呼び出しで見込む出力のトークン数
+DEFAULT_COMPLETION_ESTIMATE = 1000
+
+# 429 が続けて返っても、同時実行数を下げるのはこの間隔（秒）に 1 回まで
+DECREASE_INTERVAL = 1.0
+DECREASE_FACTOR = 0.5
+
+# 非同期の呼び出しが空きを待つときの確認間隔（秒）
+ASYNC_POLL_INTERVAL = 0.05
+
+
+class TokenBucket:
+    """1 分あたりの上限（リクエスト数・トークン数）に合わせて補充されるバケットです。
+
+    reserve は不足分を前借りして待つ秒数を返すため、待っている呼び出しの順に割り当てられます。
+    """
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.rate = self.capacity / 60
+        self.level = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """amount を確保し、使えるようになるまでの秒数を返します。"""
+        with self._lock:
+            self._refill()
+            # 上限を超える量は 1 分かけて補充される分までとする（待ち続けないように）
+            self.level -= min(amount, self.capacity)
+            return max(0.0, -self.level / self.rate)
+
+    def refund(self, amount: float):
+        """見込みより少なかった分を戻します。"""
+        with self._lock:
+            self._refill()
+            self.level = min(self.capacity, self.level + amount)
+
+
+class RateLimiter:
+    """1 つのモデルへの呼び出しの同時実行数とリクエスト数・トークン数を制限します。
+
+    同時実行数は 429 が返ると半分に下げ、返らない呼び出しが続くと 1 ずつ戻します。
+    Retry-After を受け取った場合は、その間すべての呼び出しを待たせます。
+    """
+
+    def __init__(self, model: str, rpm: float = None, tpm: float = None,
+                 max_concurrency: int = DEFAULT_MAX_CONCURRENCY, min_concurrency: int = DEFAULT_MIN_CONCURRENCY):
+        self.model = model
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+        self.max_concurrency = max(1, int(max_concurrency))
+        self.min_concurrency = max(1, min(int(min_concurrency), self.max_concurrency))
+        self.limit = float(self.max_concurrency)
+        self.active = 0
+        self.rate_limited = 0
+        self.blocked_until = 0.0
+        self._successes = 0
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+
+    def _try_acquire(self) -> float:
+        """空きがあれば確保して 0 を、無ければ次に確認するまでの秒数（不明なら None）を返します。"""
+        wait = self.blocked_until - time.monotonic()
+        if wait > 0:
+            return wait
+        if self.active < int(self.limit):
+            self.active += 1
+            return 0
+        return None
+
+    def acquire(self):
+        with self._cond:
+            wait = self._try_acquire()
+            if wait == 0:
+                return
+            with timed("llm_wait", self.model):
+                while wait != 0:
+                    self._cond.wait(wait)
+                    wait = self._try_acquire()
+
+    async def acquire_async(self):
+        with self._cond:
+            wait = self._try_acquire()
+        if wait == 0:
+            return
+        with timed("llm_wait", self.model):
+            while wait != 0:
+                # イベントループを止めないよう、ロックを待たずに一定間隔で確認する
+                await asyncio.sleep(ASYNC_POLL_INTERVAL)
+                with self._cond:
+                    wait = self._try_acquire()
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self):
+        """with ブロックの間、同時実行の枠を 1 つ確保します。"""
+        self.acquire()
+        try:
+            yield self
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def aslot(self):
+        """slot の非同期版です。"""
+        await self.acquire_async()
+        try:
+            yield self
+        finally:
+            self.release()
+
+    def reserve(self, estimated_tokens: int) -> float:
+        """リクエスト 1 回分と見込みのトークン数を確保し、送信できるまでの秒数を返します。"""
+        wait = 0.0
+        if self.requests is not None:
+            wait = max(wait, self.requests.reserve(1))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.reserve(estimated_tokens))
+        return wait
+
+    def settle(self, estimated_tokens: int, usage):
+        """実際の使用量（response.usage）が見込みより少なければ、差分をバケットに戻します。"""
+        if self.tokens is None or usage is None:
+            return
+        used = getattr(usage, "total_tokens", 0) or 0
+        if used and used < estimated_tokens:
+            self.tokens.refund(estimated_tokens - used)
+
+    def cancel(self, estimated_tokens: int):
+        """失敗した呼び出しで確保した見込みのトークン数をバケットに戻します。
+
+        エラーになったリクエストはトークンを消費しないため、再試行や他の呼び出しの分に回します。
+        リクエスト数は送信した時点で数えられるため戻しません。
+        """
+        if self.tokens is not None:
+            self.tokens.refund(estimated_tokens)
+
+    def on_success(self):
+        with self._cond:
+            self._successes += 1
+            # 同時実行数と同じ回数だけ続けて成功したら 1 増やす（加算的な増加）
+            if self._successes >= self.limit and self.limit < self.max_concurrency:
+                self.limit += 1
+                self._successes = 0
+                self._cond.notify_all()
+
+    def on_rate_limited(self, retry_after: float = None):
+        with self._cond:
+            now = time.monotonic()
+            self.rate_limited += 1
+            self._successes = 0
+            # 同じ時期に返った 429 で何度も下げないよう、一定間隔に 1 回だけ下げる（乗算的な減少）
+            if now - self._last_decrease >= DECREASE_INTERVAL:
+                self.limit = max(float(self.min_concurrency), self.limit * DECREASE_FACTOR)
+                self._last_decrease = now
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def snapshot(self) -> dict:
+        with self._cond:
+            return {
+                "model": self.model,
+                "limit": int(self.limit),
+                "active": self.active,
+                "rate_limited": self.rate_limited,
+                "blocked_for": max(0.0, self.blocked_until - time.monotonic()),
+            }
+
+
+def estimate_tokens(params: dict) -> int:
+    """リクエストのトークン数（入力 + 出力の上限）を見込みます。
+
+    API もリクエスト時点では max_tokens を使用量として数えるため、出力は上限で見込み、
+    応答後に settle で実際の使用量との差分を戻します。
+    """
+    prompt_tokens = sum(count_tokens(str(message.get("content") or ""), params["model"]) + 4 for message in params["messages"])
+    completion_tokens = params.get("max_completion_tokens") or params.get("max_tokens") or DEFAULT_COMPLETION_ESTIMATE
+    return prompt_tokens + completion_tokens
+
+
+def _model_limits(model: str) -> dict:
+    """モデルごとの設定（llm_rate_limits）があればそれを、無ければ全体の設定を返します。"""
+    limits = {
+        "rpm": get_setting("llm_rpm_limit"),
+        "tpm": get_setting("llm_tpm_limit"),
+        "max_concurrency": get_setting("llm_max_concurrency", DEFAULT_MAX_CONCURRENCY),
+        "min_concurrency": get_setting("llm_min_concurrency", DEFAULT_MIN_CONCURRENCY),
+    }
+    overrides = (get_setting("llm_rate_limits") or {}).get(model) or {}
+    limits.update({key: overrides[key] for key in limits if key in overrides})
+    return {key: float(value) if key in ("rpm", "tpm") and value else value for key, value in limits.items()}
+
+
+@st.cache_resource
+def _get_limiters() -> dict:
+    return {"lock": threading.Lock(), "models": {}}
+
+
+def get_rate_limiter(model: str) -> RateLimiter:
+    """プロセス全体で共有する、モデルごとの RateLimiter を返します。"""
+    limiters = _get_limiters()
+    with limiters["lock"]:
+        limiter = limiters["models"].get(model)
+        if limiter is None:
+            limiter = RateLimiter(model, **_model_limits(model))
+            limiters["models"][model] = limiter
+    return limiter
+
+
+def retry_after(error: Exception):
+    """エラーの応答の Retry-After（retry-after-ms を優先）を秒で返します。無ければ None です。"""
+    response = getattr(error, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        value = headers.get("retry-after")
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            # HTTP の日付形式
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, openai.RateLimitError):
+        # 利用枠の不足は待っても解消しない
+        return getattr(error, "code", None) != "insufficient_quota"
+    return isinstance(error, (openai.APIConnectionError, openai.InternalServerError))
+
+
+def backoff_delay(attempt: int, wait: float = None) -> float:
+    """attempt 回目（0 始まり）の再試行までの秒数を返します。
+
+    指数的に伸ばした上限までの範囲でランダムに選び（full jitter）、Retry-After があれば
+    それより短くはしません。
+    """
+    base = get_setting("llm_backoff_base", DEFAULT_BACKOFF_BASE)
+    cap = get_setting("llm_backoff_max", DEFAULT_BACKOFF_MAX)
+    delay = random.uniform(0, min(cap, base * 2 ** attempt))
+    if wait:
+        delay = max(delay, min(wait, cap))
+    return delay
+
+
+def _retry_delay(limiter: RateLimiter, error: Exception, attempt: int):
+    """再試行する場合は待つ秒数を、しない場合は None を返します。
+
+    429 は再試行しない場合（回数の上限など）も limiter に伝え、他の呼び出しを抑えます。
+    """
+    wait = retry_after(error)
+    if isinstance(error, openai.RateLimitError):
+        limiter.on_rate_limited(wait)
+    if not _is_retryable(error) or attempt >= get_setting("llm_max_retries", DEFAULT_MAX_RETRIES):
+        return None
+    return backoff_delay(attempt, wait)
+
+
+def call_with_limits(limiter: RateLimiter, call, estimated_tokens: int):
+    """limiter の制限内で call() を呼び出し、429・接続エラー・5xx はバックオフして再試行します。
+
+    同時実行の枠は limiter.slot() で呼び出し側が確保します。
+    """
+    attempt = 0
+    while True:
+        wait = limiter.reserve(estimated_tokens)
+        if wait > 0:
+            with timed("llm_wait", limiter.model):
+                time.sleep(wait)
+        try:
+            result = call()
+        except Exception as e:
+            limiter.cancel(estimated_tokens)
+            delay = _retry_delay(limiter, e, attempt)
+            if delay is None:
+                raise
+            with timed("llm_backoff", limiter.model):
+                time.sleep(delay)
+            attempt += 1
+            continue
+        limiter.on_success()
+        return result
+
+
+async def acall_with_limits(limiter: RateLimiter, call, estimated_tokens: int):
+    """call_with_limits の非同期版です。call はコルーチンを返す関数です。"""
+    attempt = 0
+    while True:
+        wait = limiter.reserve(estimated_tokens)
+        if wait > 0:
+            with timed("llm_wait", limiter.model):
+                await asyncio.sleep(wait)
+        try:
+            result = await call()
+        except Exception as e:
+            limiter.cancel(estimated_tokens)
+            delay = _retry_delay(limiter, e, attempt)
+            if delay is None:
+                raise
+            with timed("llm_backoff", limiter.model):
+                await asyncio.sleep(delay)
+            attempt += 1
+            continue
+        limiter.on_success()
+        return result
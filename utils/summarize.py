@@ -0,0 +1,101 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.chunking import chunk_text, completion_max_tokens, count_tokens
+from utils.config import get_setting
+from utils.llm import create_chat_completion, stream_chat_completion
+from utils.metrics import propagate, timed
+from utils.prompts import render_prompt
+
+# 並列要約の既定値（st.secrets で上書き可能）
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_CHUNK_TOKENS = 6000
+DEFAULT_CHUNK_OVERLAP_TOKENS = 200
+DEFAULT_REDUCE_MAX_TOKENS = 12000
+
+
+def summarize_text(text_chunk: str, prompt_name: str, stream: bool = False):
+    """テキストを要約します。stream=True の場合は生成されたテキストを順に返すジェネレータを返します。
+
+    prompt_name は {text} を含む prompts/ のテンプレート名です。
+    """
+    prompt = render_prompt(prompt_name, text=text_chunk)
+
+    messages = [
+        {"role": "system", "content": "You are a highly skilled financial analyst."},
+        {"role": "user", "content": prompt}
+    ]
+    if stream:
+        return stream_chat_completion(
+        messages=messages,
+        temperature=0.5,
+        max_tokens=completion_max_tokens(messages, 3000))
+
+    response = create_chat_completion(
+    messages=messages,
+    temperature=0.5,
+    max_tokens=completion_max_tokens(messages, 3000))
+    return response.choices[0].message.content
+
+
+def _summarize_all(texts: list, prompt_name: str, max_workers: int) -> list:
+    """複数のテキストを並列に要約し、入力と同じ順序で結果を返します。"""
+    if not texts:
+        return []
+    if len(texts) == 1:
+        return [summarize_text(texts[0], prompt_name)]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(texts)))) as executor:
+        return list(executor.map(propagate(lambda text: summarize_text(text, prompt_name)), texts))
+
+
+def _group_by_size(texts: list, max_tokens: int) -> list:
+    """テキストを順序を保ったまま、合計が max_tokens 以内のグループにまとめます。"""
+    groups = []
+    current = []
+    current_size = 0
+    for text in texts:
+        size = count_tokens(text)
+        if current and current_size + size > max_tokens:
+            groups.append("\n".join(current))
+            current = []
+            current_size = 0
+        current.append(text)
+        current_size += size
+    if current:
+        groups.append("\n".join(current))
+    return groups
+
+
+def summarize_long_text(text: str, prompt_name: str, max_workers: int = None, stream: bool = False):
+    """長いテキストを分割して並列に要約し、部分要約を統合します。
+
+    部分要約の合計が reduce の上限を超える場合は、上限内に収まるまで
+    部分要約をグループごとに要約する処理を繰り返してから最終要約を作成します。
+    stream=True の場合、最終要約のみをストリーミングするジェネレータを返します。
+    要約するテキストが無い（空白のみの）場合は ValueError を送出します。
+    """
+    if max_workers is None:
+        max_workers = get_setting("summary_max_workers", DEFAULT_MAX_WORKERS)
+    chunks = chunk_text(
+        text,
+        max_tokens=get_setting("summary_chunk_tokens", DEFAULT_CHUNK_TOKENS),
+        overlap_tokens=get_setting("summary_chunk_overlap_tokens", DEFAULT_CHUNK_OVERLAP_TOKENS),
+    )
+    if not chunks:
+        raise ValueError("要約するテキストがありません。")
+    reduce_max_tokens = get_setting("summary_reduce_max_tokens", DEFAULT_REDUCE_MAX_TOKENS)
+
+    with timed("summarize_map"):
+        partial_summaries = _summarize_all(chunks, prompt_name, max_workers)
+
+    # 部分要約が大きすぎる場合は階層的に統合する
+    while len(partial_summaries) > 1 and count_tokens("\n".join(partial_summaries)) > reduce_max_tokens:
+        groups = _group_by_size(partial_summaries, reduce_max_tokens)
+        if len(groups) == len(partial_summaries):
+            # 1 件ずつしか入らない場合はこれ以上まとめられない
+            break
+        with timed("summarize_reduce"):
+            partial_summaries = _summarize_all(groups, prompt_name, max_workers)
+
+    combined_summary_text = "\n".join(partial_summaries)
+    return summarize_text(combined_summary_text, prompt_name, stream=stream)
@@ -0,0 +1,94 @@
+import json
+import zlib
+
+import streamlit as st
+from youtube_transcript_api import NoTranscriptFound, TranscriptsDisabled, YouTubeTranscriptApi
+
+from utils.cache import SQLiteCache, cache_path, make_key
+from utils.config import get_setting
+from utils.metrics import timed_function
+
+DEFAULT_LANGUAGES = ("en", "ja")
+DEFAULT_NEGATIVE_TTL = 60 * 60
+DEFAULT_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 文字起こしが存在しないことを表すキャッシュ値
+_NOT_FOUND = b""
+
+
+class TranscriptNotFound(Exception):
+    """指定された動画に利用可能な文字起こしが無い場合に送出されます。"""
+
+
+def extract_video_id(video_url: str) -> str:
+    """YouTube 動画の URL から動画 ID を取り出します。"""
+    # URL に v= が含まれているかを確認し、含まれていない場合はエラー
+    if "v=" not in video_url:
+        raise ValueError("有効な YouTube 動画の URL を入力してください。")
+
+    # 1. "v=" で分割して後ろの部分を取得
+    video_id_part = video_url.split("v=")[1]
+
+    # 2. "&" がある場合は分割して先頭の要素を取り出す
+    video_id = video_id_part.split("&")[0]
+
+    if not video_id:
+        raise ValueError("有効な YouTube 動画の URL を入力してください。")
+    return video_id
+
+
+@st.cache_resource
+def get_transcript_cache() -> SQLiteCache:
+    """動画 ID と言語をキーにした文字起こしのキャッシュを返します。"""
+    return SQLiteCache(
+        cache_path("transcripts.sqlite3"),
+        max_bytes=get_setting("transcript_cache_max_bytes", DEFAULT_CACHE_MAX_BYTES),
+    )
+
+
+@timed_function("transcript_fetch")
+def _fetch(video_id: str, languages: tuple) -> list:
+    # youtube-transcript-api 1.x ではインスタンスの fetch を使用する
+    if hasattr(YouTubeTranscriptApi, "get_transcript"):
+        return YouTubeTranscriptApi.get_transcript(video_id, languages=list(languages))
+    return YouTubeTranscriptApi().fetch(video_id, languages=list(languages)).to_raw_data()
+
+
+def _encode(segments: list) -> bytes:
+    rows = [[segment["start"], segment["duration"], segment["text"]] for segment in segments]
+    return zlib.compress(json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8"))
+
+
+def _decode(value: bytes) -> list:
+    rows = json.loads(zlib.decompress(value).decode("utf-8"))
+    return [{"text": text, "start": start, "duration": duration} for start, duration, text in rows]
+
+
+def get_transcript(video_id: str, languages: tuple = DEFAULT_LANGUAGES) -> list:
+    """動画の文字起こし（text, start, duration を持つ dict のリスト）を取得します。
+
+    取得結果はキャッシュに圧縮して保存し、次回以降はネットワークに接続せずに返します。
+    文字起こしが無かった結果も短い期間だけ記録し、その間は TranscriptNotFound を送出します。
+    """
+    cache = get_transcript_cache()
+    key = make_key("transcript", video_id, list(languages))
+
+    cached = cache.get(key)
+    if cached == _NOT_FOUND:
+        raise TranscriptNotFound(video_id)
+    if cached is not None:
+        return _decode(cached)
+
+    try:
+        segments = _fetch(video_id, tuple(languages))
+    except (NoTranscriptFound, TranscriptsDisabled) as e:
+        cache.set(key, _NOT_FOUND, ttl=get_setting("transcript_negative_ttl", DEFAULT_NEGATIVE_TTL))
+        raise TranscriptNotFound(video_id) from e
+
+    cache.set(key, _encode(segments))
+    return segments
+
+
+def transcript_to_text(segments: list) -> str:
+    """文字起こしのセグメントを 1 つのテキストに連結します。"""
+    return " ".join([x["text"] for x in segments])
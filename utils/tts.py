@@ -0,0 +1,141 @@
+import hashlib
+import io
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import markdown
+import streamlit as st
+from bs4 import BeautifulSoup
+from gtts import gTTS
+
+from utils.config import get_setting
+from utils.metrics import propagate, timed_function
+
+# 音声合成の既定値（st.secrets で上書き可能）
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_CHUNK_CHARS = 500
+DEFAULT_MAX_ENTRIES = 32
+
+# 文の区切り（句点・感嘆符・疑問符・改行）
+SENTENCE_RE = re.compile(r".*?(?:[。！？!?]+|\n+|$)", re.S)
+
+
+class _AudioStore:
+    """テキストのハッシュをキーに、音声合成の Future を保持します。"""
+
+    def __init__(self, max_workers: int, max_entries: int):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tts")
+        self.max_entries = max_entries
+        self.futures = OrderedDict()
+        self.lock = threading.Lock()
+
+    def request(self, text: str, lang: str):
+        key = hashlib.sha256(f"{lang}\0{text}".encode("utf-8")).hexdigest()
+        with self.lock:
+            future = self.futures.get(key)
+            # 失敗した結果は保持せず、作り直す
+            if future is not None and not (future.done() and future.exception() is not None):
+                self.futures.move_to_end(key)
+                return future
+
+            future = self.executor.submit(propagate(synthesize), text, lang)
+            self.futures[key] = future
+            while len(self.futures) > self.max_entries:
+                self.futures.popitem(last=False)
+            return future
+
+
+@st.cache_resource
+def _get_store() -> _AudioStore:
+    return _AudioStore(
+        max_workers=get_setting("tts_max_workers", DEFAULT_MAX_WORKERS),
+        max_entries=get_setting("tts_max_entries", DEFAULT_MAX_ENTRIES),
+    )
+
+
+def markdown_to_plain_text(markdown_text: str) -> str:
+    """Markdown をプレーンテキストに変換します。"""
+    html = markdown.markdown(markdown_text)
+    soup = BeautifulSoup(html, "html.parser")
+    return soup.get_text()
+
+
+def _split_sentences(text: str, max_chars: int) -> list:
+    """テキストを文の区切りで max_chars 前後のかたまりに分けます。"""
+    chunks = []
+    current = ""
+    for sentence in filter(None, SENTENCE_RE.findall(text)):
+        if current and len(current) + len(sentence) > max_chars:
+            chunks.append(current)
+            current = ""
+        current += sentence
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def _synthesize_chunk(text: str, lang: str) -> bytes:
+    buffer = io.BytesIO()
+    gTTS(text, lang=lang).write_to_fp(buffer)
+    return buffer.getvalue()
+
+
+@timed_function("tts")
+def synthesize(text: str, lang: str = "ja") -> bytes:
+    """テキストを MP3 に変換してバイト列で返します。
+
+    長いテキストは文単位のかたまりに分けて並列に合成し、順番どおりに連結します
+    （MP3 はフレームの連結でそのまま再生できます）。
+    """
+    chunks = _split_sentences(text, get_setting("tts_chunk_chars", DEFAULT_CHUNK_CHARS))
+    if len(chunks) <= 1:
+        return _synthesize_chunk(text, lang)
+
+    # 呼び出し元と同じプールを使うとデッドロックし得るため、かたまり用のプールを別に用意する
+    with ThreadPoolExecutor(max_workers=get_setting("tts_max_workers", DEFAULT_MAX_WORKERS)) as chunk_executor:
+        return b"".join(chunk_executor.map(lambda chunk: _synthesize_chunk(chunk, lang), chunks))
+
+
+def request_audio(text: str, lang: str = "ja"):
+    """バックグラウンドで音声合成を開始し、結果の Future を返します。
+
+    同じテキストの合成はプロセス内で一度だけ行い、結果はメモリ上に保持します。
+    """
+    return _get_store().request(text, lang)
+
+
+@st.fragment(run_every=1)
+def _wait_for_audio(future):
+    """音声の合成が終わるまでこの部分だけを 1 秒ごとに再実行し、終わったらページ全体を再実行します。"""
+    if future.done():
+        st.rerun()
+    st.info("音声を生成しています...")
+
+
+def show_audio_player(markdown_text: str, file_name: str = "summary.mp3"):
+    """要約の音声プレーヤーとダウンロードボタンを表示します。
+
+    音声の合成はバックグラウンドで行い、完了するまではその表示だけを再実行して待ちます。
+    """
+    future = request_audio(markdown_to_plain_text(markdown_text))
+    if not future.done():
+        _wait_for_audio(future)
+        return
+
+    try:
+        audio_bytes = future.result()
+    except Exception as e:
+        st.error(f"音声の生成中にエラーが発生しました: {e}")
+        return
+
+    st.audio(audio_bytes, format="audio/mp3")
+
+    # 音声ファイルをダウンロード
+    st.download_button(
+        label="要約をダウンロード（音声形式）",
+        data=audio_bytes,
+        file_name=file_name,
+        mime="audio/mp3",
+    )